@@ -1,33 +1,190 @@
-from typing import Callable, Dict, List
+import operator
+import threading
+from datetime import date, datetime, timedelta
+from functools import cmp_to_key
+from itertools import combinations
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Type
 
-from django.db.models import Aggregate, F, QuerySet, Sum
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import (
+    Aggregate,
+    Avg,
+    Case,
+    Count,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Max,
+    Min,
+    Q,
+    QuerySet,
+    Sum,
+    When,
+)
+from django.db.models.expressions import Col, Func, OrderBy, Window
+from django.db.models.functions import (
+    Cast,
+    NullIf,
+    RowNumber,
+    TruncMonth,
+    TruncQuarter,
+    TruncWeek,
+    TruncYear,
+)
+from django.db.models.lookups import Lookup
+from django.db.models.query import ValuesIterable
+from django.db.models.sql.where import OR, WhereNode
+from django.utils.module_loading import import_string
 
 from .exceptions import AggregationError
-from .models import Metric
+from .fields import DimensionField, get_value_ordering
+from .models import Metric, MetricRollup
+from .rollups import ADDITIVE_COLUMNS, ROLLUP_MODELS
+from .versioning import get_data_versions
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 CPI = 'cpi'
+DATE = 'date'
+# Column of rows with totals, the bitmask of rolled up columns like SQL `GROUPING()`
+GROUPING = 'grouping'
+# Rank of a row in its partition selected by `ROW_NUMBER()` for top rows
+TOP_RANK = 'top_rank'
+# Suffixes of the previous period columns and their differences with the current period
+PREVIOUS_SUFFIX = '_previous'
+DELTA_SUFFIX = '_delta'
+
+_aggregators: Dict[str, 'MetricAggregator'] = {}
+
+
+def get_aggregator() -> 'MetricAggregator':
+    """Get the aggregator configured by `METRICS_AGGREGATOR` setting."""
+    path = getattr(settings, 'METRICS_AGGREGATOR', 'modules.metrics.aggregations.MetricAggregator')
+    if path not in _aggregators:
+        _aggregators[path] = import_string(path)()
+    return _aggregators[path]
+
+
+def _previous_year(day: date) -> date:
+    """Get the same day of the previous year, February 29 becomes February 28."""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+
+class ColumnOrderValuesIterable(ValuesIterable):
+    """Yield a dict per row with the columns in the order passed to `values()`.
+
+    SQL selects the model fields before annotations like date buckets.
+
+    """
+
+    def __iter__(self):
+        columns = self.queryset._fields
+        for row in super().__iter__():
+            yield {**{column: row[column] for column in columns}, **row}
+
+
+def select_columns(queryset: QuerySet, columns: List[str]) -> QuerySet:
+    """Select the columns of an aggregated `values()` queryset in their order."""
+    queryset = queryset.values(*columns)
+    queryset._iterable_class = ColumnOrderValuesIterable
+    return queryset
+
+
+def get_selected_columns(queryset: QuerySet) -> List[str]:
+    """Get names of the row columns of a `values()` queryset in their order."""
+    query = queryset.query
+    columns = [*query.extra_select, *query.values_select, *query.annotation_select]
+    if issubclass(queryset._iterable_class, ColumnOrderValuesIterable):
+        return list(dict.fromkeys([*queryset._fields, *columns]))
+    return columns
 
 
 class MetricAggregator:
     """Aggregate Metric data using GROUP BY functionality.
 
-    The current solution is limited and support only SUM aggregation.
+    Display columns are aggregated with SUM by default, other functions are requested
+    as `%column%__%function%`. Ratio metrics are computed from sums of their columns,
+    so all requested values are selected by a single GROUP BY query.
+
+    Queries that group and filter only by dimensions of one of `rollup_models` are answered
+    from the smallest such rollup instead of the raw `Metric` table.
 
     """
     model = Metric
     supported_group_by_columns = (
         'date',
+        'date__week',
+        'date__month',
+        'date__quarter',
+        'date__year',
         'channel',
         'country',
         'os',
     )
+    # Date buckets available in `group_by` as `date__%bucket%`, the value is the bucket start date
+    date_buckets: Dict[str, Type[Func]] = {
+        'date__week': TruncWeek,
+        'date__month': TruncMonth,
+        'date__quarter': TruncQuarter,
+        'date__year': TruncYear,
+    }
     not_supported_display_columns = (
         'date',
     )
     supported_aggregations: Dict[str, Callable] = {
         'sum': Sum,
+        'avg': Avg,
+        'min': Min,
+        'max': Max,
+        'count': Count,
     }
     default_aggregation: Callable = Sum
+    # Ratio metrics as (numerator, denominator) columns, both are summed before the division
+    ratio_metrics: Dict[str, Tuple[str, str]] = {
+        CPI: ('spend', 'installs'),
+        'ctr': ('clicks', 'impressions'),
+        'cr': ('installs', 'clicks'),
+        'roas': ('revenue', 'spend'),
+    }
+    # Functions combining partial aggregates of finer groups
+    partial_combiners: Dict[str, Callable] = {
+        'sum': operator.add,
+        'count': operator.add,
+        'min': min,
+        'max': max,
+    }
+    # Databases supporting `GROUP BY GROUPING SETS`
+    grouping_sets_vendors = ('postgresql', )
+    # Grouping sets of group columns for `totals` kinds, like `ROLLUP`, `CUBE` and a grand total
+    totals_grouping_sets: Dict[str, Callable[[Tuple[str, ...]], List[Tuple[str, ...]]]] = {
+        'rollup': lambda columns: [columns[:size] for size in range(len(columns), -1, -1)],
+        'cube': lambda columns: [
+            subset for size in range(len(columns), -1, -1) for subset in combinations(columns, size)
+        ],
+        'grand': lambda columns: [columns, ()],
+    }
+    # Previous periods for `compare` kinds, functions of the first and the last dates of the current one
+    comparison_periods: Dict[str, Callable[[date, date], Tuple[date, date]]] = {
+        'previous_period': lambda start, end: (
+            start - (end - start) - timedelta(days=1),
+            start - timedelta(days=1),
+        ),
+        'previous_year': lambda start, end: (_previous_year(start), _previous_year(end)),
+    }
+    rollup_models = ROLLUP_MODELS
+    rollup_columns = ADDITIVE_COLUMNS + tuple(ratio_metrics)
+    model_columns = frozenset(field.name for field in Metric._meta.fields)
+
+    def __init__(self, use_rollups: bool = True):
+        self.use_rollups = use_rollups
 
     def aggregate(
             self,
@@ -35,12 +192,119 @@ class MetricAggregator:
             group_by_columns: List[str],
             display_columns: List[str],
     ) -> QuerySet:
-        """Aggregate the data using SELECT ... GROUP BY query under the hood."""
+        """Aggregate the data using SELECT ... GROUP BY query under the hood.
+
+        The `queryset` may be already filtered.
+
+        """
         self._validate_group_by_columns(group_by_columns)
         aggregations = self._get_column_aggregations(group_by_columns, display_columns)
+        if self.use_rollups:
+            queryset = self._route_to_rollup(queryset, group_by_columns, display_columns)
+        queryset = self._annotate_date_buckets(queryset, group_by_columns)
         queryset = queryset.values(*group_by_columns).annotate(**aggregations)
+        if any(column in self.date_buckets for column in group_by_columns):
+            queryset = select_columns(queryset, [*group_by_columns, *aggregations])
         return queryset
 
+    def _annotate_date_buckets(self, queryset: QuerySet, group_by_columns: List[str]) -> QuerySet:
+        """Truncate dates to the start of week, month, etc. in SQL for grouping."""
+        buckets = {
+            column: self.date_buckets[column](DATE)
+            for column in group_by_columns if column in self.date_buckets
+        }
+        return queryset.annotate(**buckets) if buckets else queryset
+
+    def get_columns(self, group_by_columns: List[str], display_columns: List[str]) -> List[str]:
+        """Get names of aggregated row columns in their order."""
+        aggregations = self._get_column_aggregations(group_by_columns, display_columns)
+        return [*group_by_columns, *aggregations]
+
+    def _route_to_rollup(
+            self,
+            queryset: QuerySet,
+            group_by_columns: List[str],
+            display_columns: List[str],
+    ) -> QuerySet:
+        """Replace `Metric` queryset with the smallest rollup covering the query.
+
+        Return the queryset untouched when there is no covering rollup.
+
+        """
+        if not self._is_rollup_compatible(queryset, display_columns):
+            return queryset
+
+        filtered_columns = self._get_filtered_columns(queryset.query.where)
+        if filtered_columns is None:
+            return queryset
+
+        # Date buckets are computed from the `date` column
+        required_columns = filtered_columns.union(
+            DATE if column in self.date_buckets else column for column in group_by_columns
+        )
+        rollup_models = [
+            rollup_model for rollup_model in self.rollup_models
+            if required_columns.issubset(rollup_model.dimensions)
+        ]
+        if not rollup_models:
+            return queryset
+
+        rollup_model = min(rollup_models, key=lambda model: len(model.dimensions))
+        return self._rebase_queryset(queryset, rollup_model)
+
+    def _is_rollup_compatible(self, queryset: QuerySet, display_columns: List[str]) -> bool:
+        """Check that the queryset and display columns can be computed from rollups."""
+        query = queryset.query
+        if queryset.model is not self.model or query.annotations or query.extra or query.is_sliced:
+            return False
+
+        for column_with_function in display_columns:
+            column, *any_func = column_with_function.split('__')
+            if column not in self.rollup_columns:
+                return False
+            func = any_func[0] if any_func else None
+            if func and self.supported_aggregations.get(func) is not Sum:
+                return False
+
+        return True
+
+    def _get_filtered_columns(self, where: WhereNode) -> Optional[Set[str]]:
+        """Get names of `Metric` fields used in the WHERE clause.
+
+        Return None when the clause contains anything besides simple field lookups.
+
+        """
+        columns = set()
+        for child in where.children:
+            if isinstance(child, WhereNode):
+                child_columns = self._get_filtered_columns(child)
+                if child_columns is None:
+                    return None
+                columns.update(child_columns)
+            elif (
+                isinstance(child, Lookup)
+                and isinstance(child.lhs, Col)
+                and child.lhs.alias == self.model._meta.db_table
+                and not hasattr(child.rhs, 'resolve_expression')
+            ):
+                columns.add(child.lhs.target.name)
+            else:
+                return None
+
+        return columns
+
+    def _rebase_queryset(self, queryset: QuerySet, rollup_model: Type[MetricRollup]) -> QuerySet:
+        """Apply filters of `Metric` queryset to the rollup table.
+
+        Rollups have the same column names as `Metric`, so relabeling the table is enough.
+
+        """
+        rollup_queryset = rollup_model.objects.all()
+        rollup_queryset.query.where = queryset.query.where.relabeled_clone({
+            self.model._meta.db_table: rollup_model._meta.db_table,
+        })
+        return rollup_queryset
+
     def _validate_group_by_columns(self, group_by_columns: List[str]):
         unsupported_columns = []
         for column in group_by_columns:
@@ -53,19 +317,33 @@ class MetricAggregator:
                 f'The following values are not supported in the `group_by_columns`: {error_line}'
             )
 
+    @classmethod
+    def get_aggregated_column_name(cls, column: str, func: Optional[str]) -> str:
+        """Get the result column name: `column` for sums and ratios, `column_func` otherwise."""
+        if func is None or cls.supported_aggregations.get(func) is Sum or column in cls.ratio_metrics:
+            return column
+        return f'{column}_{func}'
+
     def _get_column_aggregations(
             self,
             group_by_columns: List[str],
             display_columns: List[str],
+            condition: Optional[Q] = None,
+            suffix: str = '',
     ) -> Dict['str', Aggregate]:
         """Get proper aggregation functions from parameters.
 
-        Apply correct CPI computation.
-        Apply SUM aggregation for other columns.
+        Aggregations of columns go first, sums named as columns go next and ratio metrics last,
+        so the other functions are resolved before the sum aliases shadow the columns
+        and ratio metrics reuse the sums already selected.
+
+        With `condition` only the rows matching it are aggregated by `CASE` expressions
+        and `suffix` is appended to the result column names.
 
         """
         column_aggregations = dict()
-        has_cpi = False
+        column_sums = dict()
+        ratio_columns = []
 
         for column_with_function in display_columns:
             column, *any_func = column_with_function.split('__')
@@ -82,24 +360,813 @@ class MetricAggregator:
                     f'"{column}" in `group_by_columns`'
                 )
 
-            # Skip `cpi` column and implement aggregation below
-            if column == CPI:
-                has_cpi = True
-                continue
+            if column not in self.ratio_metrics and column not in self.model_columns:
+                raise AggregationError(f'The "{column}" in `display_columns` not supported')
 
             func = any_func[0] if any_func else None
             if func and func not in self.supported_aggregations:
                 raise AggregationError(f'Aggregation function {func} not supported')
 
             aggregation = self.supported_aggregations.get(func) or self.default_aggregation
-            column_aggregations[column] = aggregation(column)
+            if column in self.ratio_metrics:
+                if aggregation is not Sum:
+                    raise AggregationError(
+                        f'The "{column}" is computed from sums and does not support {func} aggregation'
+                    )
+                ratio_columns.append(column)
+            elif aggregation is Sum:
+                column_sums[column] = Sum(self._get_aggregated_value(column, condition))
+            else:
+                name = self.get_aggregated_column_name(column, func) + suffix
+                column_aggregations[name] = aggregation(self._get_aggregated_value(column, condition))
 
-        if has_cpi:
-            # Use aggregated value of `spend` or `installs` when already aggregated
-            spend_agg = F('spend') if 'spend' in display_columns else Sum('spend')
-            installs_agg = F('installs') if 'installs' in display_columns else Sum('installs')
-            column_aggregations.update({
-                'cpi': spend_agg / installs_agg,
-            })
+        column_aggregations.update({column + suffix: total for column, total in column_sums.items()})
+        for column in ratio_columns:
+            column_aggregations[column + suffix] = self._get_ratio(column, column_sums, condition, suffix)
 
         return column_aggregations
+
+    @staticmethod
+    def _get_aggregated_value(column: str, condition: Optional[Q]):
+        return Case(When(condition, then=F(column))) if condition is not None else column
+
+    def _get_ratio(
+            self,
+            name: str,
+            column_sums: Dict[str, Aggregate],
+            condition: Optional[Q] = None,
+            suffix: str = '',
+    ) -> ExpressionWrapper:
+        """Divide sums as floats, the ratio is NULL when the denominator is zero."""
+        numerator, denominator = (
+            F(column + suffix) if column in column_sums else Sum(self._get_aggregated_value(column, condition))
+            for column in self.ratio_metrics[name]
+        )
+        return ExpressionWrapper(
+            Cast(numerator, FloatField()) / NullIf(denominator, 0),
+            output_field=FloatField(),
+        )
+
+    def aggregate_grouping_sets(
+            self,
+            queryset: QuerySet,
+            grouping_sets: List[Tuple[str, ...]],
+            display_columns: List[str],
+    ) -> Dict[Tuple[str, ...], List[dict]]:
+        """Aggregate the data by several groupings with a single scan of the data.
+
+        The data is aggregated once by all grouping columns into partial aggregates:
+        sums, counts, minimums and maximums. The partial aggregates are combined for every
+        grouping set by `GROUP BY GROUPING SETS` over the finest aggregation on databases
+        in `grouping_sets_vendors`, or in Python on other databases. Averages and ratio metrics
+        are computed from combined sums and counts, so they are correct for every grouping set.
+
+        """
+        grouping_columns = list(dict.fromkeys(
+            column for grouping_set in grouping_sets for column in grouping_set
+        ))
+        self._validate_group_by_columns(grouping_columns)
+        self._get_column_aggregations(grouping_columns, display_columns)
+        partial_columns = self._get_partial_columns(display_columns)
+
+        if grouping_columns:
+            finest = self.aggregate(queryset, grouping_columns, list(partial_columns))
+        else:
+            aggregations = self._get_column_aggregations([], list(partial_columns))
+            finest = AggregationResult([queryset.aggregate(**aggregations)])
+
+        if isinstance(finest, QuerySet) and connections[finest.db].vendor in self.grouping_sets_vendors:
+            grouped_partials = self._combine_partials_in_db(
+                finest, grouping_columns, grouping_sets, partial_columns,
+            )
+        else:
+            grouped_partials = self._combine_partials(finest, grouping_sets, partial_columns)
+
+        columns = [
+            self.get_aggregated_column_name(*self._split_column(column_with_function))
+            for column_with_function in display_columns
+        ]
+        return {
+            grouping_set: [
+                {**group, **self._finalize_partials(partials, display_columns, columns)}
+                for group, partials in grouped_partials[grouping_set]
+            ]
+            for grouping_set in grouping_sets
+        }
+
+    def aggregate_with_totals(
+            self,
+            queryset: QuerySet,
+            group_by_columns: List[str],
+            display_columns: List[str],
+            totals: str,
+    ) -> 'AggregationResult':
+        """Aggregate the data with subtotal and total rows computed by a single scan.
+
+        Rolled up columns of total rows are None and `grouping` column is the bitmask
+        of rolled up columns, the first group column is the most significant bit.
+        Rows are sorted by group columns, totals follow their groups.
+
+        """
+        if totals not in self.totals_grouping_sets:
+            raise AggregationError(f'Totals {totals} not supported')
+
+        grouping_sets = self.totals_grouping_sets[totals](tuple(group_by_columns))
+        grouped_rows = self.aggregate_grouping_sets(queryset, grouping_sets, display_columns)
+        columns = self.get_columns(group_by_columns, display_columns)
+        rows = []
+        for grouping_set in grouping_sets:
+            grouping = sum(
+                1 << (len(group_by_columns) - 1 - index)
+                for index, column in enumerate(group_by_columns) if column not in grouping_set
+            )
+            rows.extend(
+                {**{column: row.get(column) for column in columns}, GROUPING: grouping}
+                for row in grouped_rows[grouping_set]
+            )
+
+        rows.sort(key=lambda row: [(row[column] is None, row[column]) for column in group_by_columns])
+        return AggregationResult(rows)
+
+    def aggregate_comparison(
+            self,
+            queryset: QuerySet,
+            group_by_columns: List[str],
+            display_columns: List[str],
+            compare: str,
+            start: date,
+            end: date,
+    ) -> QuerySet:
+        """Aggregate the data of the period from `start` to `end` and of the compared period by a single scan.
+
+        Both date windows are selected by one GROUP BY query aggregating every display column
+        by `CASE` expressions over each window: the current values keep the column names,
+        the previous ones are `%column%_previous` and `%column%_delta` is their difference,
+        rows have the columns in this order after the group columns.
+        Ratio metrics are computed from the sums of each window. Values of a window
+        without data of the group are NULL.
+
+        """
+        if compare not in self.comparison_periods:
+            raise AggregationError(f'Comparison {compare} not supported')
+        if start > end:
+            raise AggregationError('The compared period starts after its end')
+        date_columns = [column for column in group_by_columns if column == DATE or column in self.date_buckets]
+        if date_columns:
+            raise AggregationError(f'Compared periods can not be grouped by dates: {", ".join(date_columns)}')
+        self._validate_group_by_columns(group_by_columns)
+
+        current = Q(date__range=(start, end))
+        previous = Q(date__range=self.comparison_periods[compare](start, end))
+        # Previous period columns are annotated first, the current period sums shadow the columns
+        previous_aggregations = self._get_column_aggregations(
+            group_by_columns, display_columns, previous, PREVIOUS_SUFFIX,
+        )
+        aggregations = self._get_column_aggregations(group_by_columns, display_columns, current)
+        deltas = {
+            column + DELTA_SUFFIX: F(column) - F(column + PREVIOUS_SUFFIX)
+            for column in aggregations
+        }
+
+        queryset = queryset.filter(current | previous)
+        if self.use_rollups:
+            queryset = self._route_to_rollup(queryset, group_by_columns, display_columns)
+        queryset = queryset.values(*group_by_columns).annotate(**previous_aggregations, **aggregations, **deltas)
+        return select_columns(queryset, [*group_by_columns, *aggregations, *previous_aggregations, *deltas])
+
+    def aggregate_top(
+            self,
+            queryset: QuerySet,
+            group_by_columns: List[str],
+            display_columns: List[str],
+            top: int,
+            top_by: str,
+            top_partition: Optional[str] = None,
+    ) -> 'AggregationResult':
+        """Aggregate the data keeping only the first `top` rows of every `top_partition` group.
+
+        Rows are ranked by `top_by` column in the `ordering` syntax, e.g. `-installs` ranks
+        the most installs first, NULL values are ranked last and ties are broken by group columns.
+        Without `top_partition` the first `top` rows of all rows are kept.
+        Rows are sorted by the partition column and the rank.
+
+        """
+        columns = self.get_columns(group_by_columns, display_columns)
+        rank_column = top_by[1:] if top_by.startswith('-') else top_by
+        if rank_column not in columns:
+            raise AggregationError(f'Ranking by not selected column: {rank_column}')
+        if top_partition is not None and top_partition not in group_by_columns:
+            raise AggregationError(f'The top partition column is not in `group_by_columns`: {top_partition}')
+
+        aggregated = self.aggregate(queryset, group_by_columns, display_columns)
+        partition = [top_partition] if top_partition else []
+        ordering = [top_by, *(column for column in group_by_columns if column != rank_column)]
+        if isinstance(aggregated, QuerySet):
+            return self._get_top_rows_in_db(aggregated, top, ordering, partition)
+        return self._get_top_rows(aggregated, top, ordering, partition)
+
+    def _get_top_rows_in_db(
+            self,
+            aggregated: QuerySet,
+            top: int,
+            ordering: List[str],
+            partition: List[str],
+    ) -> 'AggregationResult':
+        """Rank aggregated rows by `ROW_NUMBER()` and select the top ones by a query over them.
+
+        Window functions can not be filtered in the same query, so the aggregation query
+        is a subquery. Its values are converted by the converters of its compiler.
+
+        """
+        ranked = aggregated.order_by().annotate(**{TOP_RANK: Window(
+            RowNumber(),
+            partition_by=[F(column) for column in partition] or None,
+            order_by=[self._get_window_ordering(aggregated.model, field) for field in ordering],
+        )})
+        compiler = ranked.query.get_compiler(ranked.db)
+        ranked_sql, params = compiler.as_sql()
+        qn = compiler.connection.ops.quote_name
+        order = ', '.join(qn(column) for column in (*partition, TOP_RANK))
+        sql = f'SELECT * FROM ({ranked_sql}) ranked WHERE {qn(TOP_RANK)} <= %s ORDER BY {order}'
+        with compiler.connection.cursor() as cursor:
+            cursor.execute(sql, (*params, top))
+            rows = cursor.fetchall()
+
+        converters = compiler.get_converters([expression for expression, _, _ in compiler.select])
+        if converters:
+            rows = compiler.apply_converters(rows, converters)
+        query = ranked.query
+        names = [*query.extra_select, *query.values_select, *query.annotation_select]
+        columns = get_selected_columns(aggregated)
+        top_rows = AggregationResult([
+            {column: values[column] for column in columns}
+            for values in (dict(zip(names, row)) for row in rows)
+        ])
+        # The query sorts partitions by the stored codes, the stable sort by values keeps the ranks
+        return AggregationResult(top_rows.order_by(*partition).rows) if partition else top_rows
+
+    @staticmethod
+    def _get_window_ordering(model, field: str) -> OrderBy:
+        ordering = get_value_ordering(model, field, nulls_last=True)
+        if isinstance(ordering, OrderBy):
+            return ordering
+        return OrderBy(F(field.lstrip('-')), descending=field.startswith('-'), nulls_last=True)
+
+    @staticmethod
+    def _get_top_rows(
+            rows: Iterable[dict],
+            top: int,
+            ordering: List[str],
+            partition: List[str],
+    ) -> 'AggregationResult':
+        """Keep the top rows of aggregation results computed in memory."""
+        rank_column = ordering[0].lstrip('-')
+        groups = {}
+        for row in AggregationResult(list(rows)).order_by(*partition):
+            groups.setdefault(tuple(row[column] for column in partition), []).append(row)
+
+        top_rows = []
+        for group_rows in groups.values():
+            ranked = AggregationResult([row for row in group_rows if row[rank_column] is not None])
+            not_ranked = AggregationResult([row for row in group_rows if row[rank_column] is None])
+            top_rows.extend([*ranked.order_by(*ordering), *not_ranked.order_by(*ordering[1:])][:top])
+        return AggregationResult(top_rows)
+
+    @staticmethod
+    def _split_column(column_with_function: str) -> Tuple[str, Optional[str]]:
+        column, *any_func = column_with_function.split('__')
+        return column, any_func[0] if any_func else None
+
+    def _get_partial_columns(self, display_columns: List[str]) -> Dict[str, Tuple[str, str]]:
+        """Get display columns of partial aggregates mapped to (result name, function)."""
+        partial_columns = {}
+        for column_with_function in display_columns:
+            column, func = self._split_column(column_with_function)
+            func = func or 'sum'
+            if column in self.ratio_metrics:
+                partials = [(ratio_column, 'sum') for ratio_column in self.ratio_metrics[column]]
+            elif func == 'avg':
+                partials = [(column, 'sum'), (column, 'count')]
+            else:
+                partials = [(column, func)]
+
+            for partial_column, partial_func in partials:
+                name = self.get_aggregated_column_name(partial_column, partial_func)
+                partial_columns[f'{partial_column}__{partial_func}'] = (name, partial_func)
+        return partial_columns
+
+    def _combine_partials(
+            self,
+            rows: Iterable[dict],
+            grouping_sets: List[Tuple[str, ...]],
+            partial_columns: Dict[str, Tuple[str, str]],
+    ) -> Dict[Tuple[str, ...], List[Tuple[dict, dict]]]:
+        """Combine partial aggregates of rows for every grouping set in Python."""
+        grouped = {grouping_set: {} for grouping_set in grouping_sets}
+        for row in rows:
+            for grouping_set, groups in grouped.items():
+                key = tuple(row[column] for column in grouping_set)
+                partials = groups.get(key)
+                if partials is None:
+                    groups[key] = {name: row[name] for name, _ in partial_columns.values()}
+                    continue
+                for name, func in partial_columns.values():
+                    value = row[name]
+                    if partials[name] is None:
+                        partials[name] = value
+                    elif value is not None:
+                        partials[name] = self.partial_combiners[func](partials[name], value)
+
+        for grouping_set in grouping_sets:
+            # Aggregation without grouping returns a single row even without data
+            if not grouping_set and not grouped[grouping_set]:
+                grouped[grouping_set][()] = {name: None for name, _ in partial_columns.values()}
+
+        return {
+            grouping_set: [
+                (dict(zip(grouping_set, key)), partials) for key, partials in groups.items()
+            ]
+            for grouping_set, groups in grouped.items()
+        }
+
+    def _combine_partials_in_db(
+            self,
+            finest: QuerySet,
+            grouping_columns: List[str],
+            grouping_sets: List[Tuple[str, ...]],
+            partial_columns: Dict[str, Tuple[str, str]],
+    ) -> Dict[Tuple[str, ...], List[Tuple[dict, dict]]]:
+        """Combine partial aggregates with `GROUP BY GROUPING SETS` over the finest aggregation.
+
+        `GROUPING()` of all grouping columns tells the grouping set of a row: a bit is set
+        for every column not in the set, the first column is the most significant bit.
+
+        """
+        connection = connections[finest.db]
+        qn = connection.ops.quote_name
+        finest_sql, params = finest.order_by().query.sql_with_params()
+        grouping = ', '.join(qn(column) for column in grouping_columns)
+        combined = [
+            self._get_partial_combination_sql(name, func, qn)
+            for name, func in partial_columns.values()
+        ]
+        sets = ', '.join(
+            '({})'.format(', '.join(qn(column) for column in grouping_set))
+            for grouping_set in dict.fromkeys(grouping_sets)
+        )
+        sql = (
+            f'SELECT {grouping}, GROUPING({grouping}), {", ".join(combined)} '
+            f'FROM ({finest_sql}) finest GROUP BY GROUPING SETS ({sets})'
+        )
+
+        masks = {
+            sum(
+                1 << (len(grouping_columns) - 1 - index)
+                for index, column in enumerate(grouping_columns) if column not in grouping_set
+            ): grouping_set
+            for grouping_set in grouping_sets
+        }
+        grouped = {grouping_set: [] for grouping_set in grouping_sets}
+        names = [name for name, _ in partial_columns.values()]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            for row in cursor.fetchall():
+                group_values = row[:len(grouping_columns)]
+                grouping_set = masks[row[len(grouping_columns)]]
+                group = {
+                    column: self._to_python(column, value)
+                    for column, value in zip(grouping_columns, group_values)
+                    if column in grouping_set
+                }
+                partials = dict(zip(names, row[len(grouping_columns) + 1:]))
+                grouped[grouping_set].append((group, partials))
+        return grouped
+
+    def _get_partial_combination_sql(self, name: str, func: str, qn: Callable[[str], str]) -> str:
+        """Get SQL combining a partial aggregate, sums of integers stay integers."""
+        column = qn(name)
+        if func in ('min', 'max'):
+            return f'{func.upper()}({column})'
+        if func == 'count' or self.model._meta.get_field(name).get_internal_type() != 'FloatField':
+            return f'CAST(SUM({column}) AS BIGINT)'
+        return f'SUM({column})'
+
+    def _finalize_partials(self, partials: dict, display_columns: List[str], columns: List[str]) -> dict:
+        """Compute display columns from combined partial aggregates."""
+        values = {}
+        for column_with_function, name in zip(display_columns, columns):
+            column, func = self._split_column(column_with_function)
+            if column in self.ratio_metrics:
+                numerator, denominator = (partials[part] for part in self.ratio_metrics[column])
+                values[name] = numerator / denominator if numerator is not None and denominator else None
+            elif func == 'avg':
+                total, count = partials[column], partials[f'{column}_count']
+                values[name] = total / count if total is not None and count else None
+            else:
+                values[name] = partials[name]
+        return values
+
+    def _to_python(self, column: str, value):
+        """Convert a group value selected by raw SQL like the model field does.
+
+        Bucket starts are selected by `DATE_TRUNC` as timestamps, dimensions as codes.
+
+        """
+        if column in self.date_buckets:
+            return value.date() if isinstance(value, datetime) else value
+        field = self.model._meta.get_field(column)
+        return field.from_db_value(value, None, None) if hasattr(field, 'from_db_value') else value
+
+
+class AggregationResult(Sequence):
+    """Aggregated rows computed in memory.
+
+    Supports the part of `QuerySet` API used by the metrics API:
+    ordering, filtering by lookups of `Q` objects, slicing and counting.
+
+    """
+    lookups: Dict[str, Callable[[Any, Any], bool]] = {
+        'exact': operator.eq,
+        'gt': operator.gt,
+        'gte': operator.ge,
+        'lt': operator.lt,
+        'lte': operator.le,
+        'in': lambda value, values: value in values,
+    }
+
+    def __init__(self, rows: List[dict], ordering: Tuple[str, ...] = ()):
+        self.rows = rows
+        self.ordering = ordering
+
+    def __getitem__(self, item):
+        return self.rows[item]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.rows)
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def iterator(self, chunk_size: Optional[int] = None) -> Iterator[dict]:
+        return iter(self.rows)
+
+    def order_by(self, *fields: str) -> 'AggregationResult':
+        """Sort rows like SQL does: NULL values are the smallest."""
+        def compare(row, other):
+            for field in fields:
+                column = field.lstrip('-')
+                result = self._compare(row[column], other[column])
+                if result:
+                    return -result if field.startswith('-') else result
+            return 0
+
+        return AggregationResult(sorted(self.rows, key=cmp_to_key(compare)), fields)
+
+    def filter(self, *args: Q, **kwargs) -> 'AggregationResult':
+        condition = Q(*args, **kwargs)
+        rows = [row for row in self.rows if self._matches(row, condition)]
+        return AggregationResult(rows, self.ordering)
+
+    @staticmethod
+    def _compare(value, other) -> int:
+        if value is None or other is None:
+            return (value is not None) - (other is not None)
+        return (value > other) - (value < other)
+
+    def _matches(self, row: dict, condition: Q) -> bool:
+        results = []
+        for child in condition.children:
+            if isinstance(child, Q):
+                results.append(self._matches(row, child))
+                continue
+
+            lookup, expected = child
+            column, _, lookup_name = lookup.rpartition('__')
+            if lookup_name not in self.lookups and lookup_name != 'isnull':
+                # Columns of date buckets contain `__`, e.g. `date__month`
+                column, lookup_name = lookup, 'exact'
+            value = row[column]
+            if lookup_name == 'isnull':
+                results.append((value is None) == expected)
+                continue
+            if isinstance(value, date) and isinstance(expected, str):
+                expected = date.fromisoformat(expected)
+            results.append(
+                value is not None and self.lookups[lookup_name](value, expected)
+            )
+
+        matches = any(results) if condition.connector == Q.OR else all(results)
+        return matches != condition.negated
+
+
+class MetricColumnStore:
+    """`Metric` table held in memory as NumPy column arrays.
+
+    String dimensions are dictionary-encoded: integer codes index sorted categories,
+    so comparisons of codes keep the order of strings.
+    The data reloaded when the data version changes. When only new rows were added since
+    the last load, only these rows are loaded.
+
+    """
+    categorical_columns = ('channel', 'country', 'os')
+    numeric_columns = ('id', 'date') + ADDITIVE_COLUMNS
+    comparisons: Dict[str, Callable] = {
+        'exact': operator.eq,
+        'gt': operator.gt,
+        'gte': operator.ge,
+        'lt': operator.lt,
+        'lte': operator.le,
+    }
+
+    def __init__(self, model=Metric, chunk_size: int = 100000):
+        self.model = model
+        self.chunk_size = chunk_size
+        self.version = None
+        self.columns: Dict[str, 'np.ndarray'] = {}
+        self.categories: Dict[str, 'np.ndarray'] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.columns['id']) if self.columns else 0
+
+    def refresh(self):
+        version, rewrite_version = get_data_versions()
+        if version == self.version:
+            return
+
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None and self.version >= rewrite_version:
+                self._append(self.model.objects.filter(pk__gt=self.columns['id'].max(initial=0)))
+            else:
+                self.columns, self.categories = {}, {}
+                self._append(self.model.objects.all())
+            self.version = version
+
+    def compare(self, column: str, lookup_name: str, value) -> Optional['np.ndarray']:
+        """Get boolean mask of the lookup. Return None for unsupported lookups."""
+        if lookup_name == 'range':
+            start, end = value
+            start_mask, end_mask = self.compare(column, 'gte', start), self.compare(column, 'lte', end)
+            return None if start_mask is None or end_mask is None else start_mask & end_mask
+        if column in self.categorical_columns:
+            return self._compare_categorical(column, lookup_name, value)
+        if column not in self.numeric_columns:
+            return None
+
+        values = self.columns[column]
+        if lookup_name == 'in':
+            return np.isin(values, np.array(list(value), dtype=values.dtype))
+        if lookup_name not in self.comparisons:
+            return None
+        return self.comparisons[lookup_name](values, np.array(value, dtype=values.dtype))
+
+    def get_codes(self, column: str, mask: 'np.ndarray') -> Tuple['np.ndarray', int, Callable]:
+        """Get non-negative integer codes of filtered values, their cardinality and decoder."""
+        if column in self.categorical_columns:
+            categories = self.categories[column]
+            return self.columns[column][mask], len(categories), lambda codes: categories[codes]
+
+        source, _, bucket = column.partition('__')
+        values = self.columns[source][mask]
+        if bucket:
+            values = self.truncate_dates(values, bucket)
+
+        integers = values.astype(np.int64)
+        start = integers.min() if len(integers) else 0
+        cardinality = int(integers.max() - start + 1) if len(integers) else 1
+        return integers - start, cardinality, lambda codes: (codes + start).astype(values.dtype)
+
+    @staticmethod
+    def truncate_dates(dates: 'np.ndarray', bucket: str) -> 'np.ndarray':
+        """Get start dates of week, month, quarter or year of the dates like `Trunc*` functions."""
+        if bucket == 'week':
+            days = dates.astype(np.int64)
+            # 1970-01-05, the day 4, is Monday
+            return (days - (days - 4) % 7).astype('datetime64[D]')
+        if bucket == 'quarter':
+            months = dates.astype('datetime64[M]').astype(np.int64)
+            return (months - months % 3).astype('datetime64[M]').astype('datetime64[D]')
+
+        unit = {'month': 'M', 'year': 'Y'}[bucket]
+        return dates.astype(f'datetime64[{unit}]').astype('datetime64[D]')
+
+    def _compare_categorical(self, column: str, lookup_name: str, value) -> Optional['np.ndarray']:
+        categories, codes = self.categories[column], self.columns[column]
+        value = self._decode_lookup_value(column, value)
+        if lookup_name == 'exact':
+            value = str(value)
+            position = np.searchsorted(categories, value)
+            found = position < len(categories) and categories[position] == value
+            return codes == position if found else np.zeros(len(codes), dtype=bool)
+        if lookup_name == 'in':
+            return np.isin(categories[codes], np.array([str(item) for item in value]))
+        # Codes of sorted categories keep order of the values
+        if lookup_name in ('gt', 'lte'):
+            threshold = np.searchsorted(categories, str(value), side='right')
+        elif lookup_name in ('gte', 'lt'):
+            threshold = np.searchsorted(categories, str(value), side='left')
+        else:
+            return None
+        return codes >= threshold if lookup_name in ('gt', 'gte') else codes < threshold
+
+    def _decode_lookup_value(self, column: str, value):
+        """Get dimension values of the codes prepared by a lookup.
+
+        Unknown values are prepared as the code 0 sorted before all codes, like the empty string.
+
+        """
+        field = self.model._meta.get_field(column)
+        if isinstance(value, (list, tuple, set)):
+            return [self._decode_lookup_value(column, item) for item in value]
+        if isinstance(value, int) and isinstance(field, DimensionField):
+            return field.decode(value) or ''
+        return value
+
+    def _append(self, queryset: QuerySet):
+        names = (*self.numeric_columns, *self.categorical_columns)
+        rows = list(queryset.order_by('pk').values_list(*names).iterator(chunk_size=self.chunk_size))
+        if not rows:
+            if not self.columns:
+                self._set_empty_columns()
+            return
+
+        values = dict(zip(names, zip(*rows)))
+        new_columns = {
+            'id': np.array(values['id'], dtype=np.int64),
+            'date': np.array(values['date'], dtype='datetime64[D]'),
+        }
+        for column in ADDITIVE_COLUMNS:
+            field = self.model._meta.get_field(column)
+            dtype = np.float64 if field.get_internal_type() == 'FloatField' else np.int64
+            new_columns[column] = np.array(values[column], dtype=dtype)
+
+        if not self.columns:
+            self._set_empty_columns()
+        for column in self.numeric_columns:
+            self.columns[column] = np.concatenate([self.columns[column], new_columns[column]])
+        for column in self.categorical_columns:
+            self._append_categorical(column, np.array([str(value) for value in values[column]]))
+
+    def _append_categorical(self, column: str, values: 'np.ndarray'):
+        old_categories, old_codes = self.categories[column], self.columns[column]
+        categories = np.union1d(old_categories, values)
+        remapped = np.searchsorted(categories, old_categories)[old_codes]
+        codes = np.searchsorted(categories, values)
+        self.categories[column] = categories
+        self.columns[column] = np.concatenate([remapped, codes]).astype(np.int64)
+
+    def _set_empty_columns(self):
+        self.columns = {
+            'id': np.array([], dtype=np.int64),
+            'date': np.array([], dtype='datetime64[D]'),
+        }
+        for column in ADDITIVE_COLUMNS:
+            field = self.model._meta.get_field(column)
+            dtype = np.float64 if field.get_internal_type() == 'FloatField' else np.int64
+            self.columns[column] = np.array([], dtype=dtype)
+        for column in self.categorical_columns:
+            self.columns[column] = np.array([], dtype=np.int64)
+            self.categories[column] = np.array([], dtype=str)
+
+
+class NumpyMetricAggregator(MetricAggregator):
+    """Aggregate Metric data in memory with NumPy.
+
+    Filters of the queryset are applied as vectorized boolean masks, GROUP BY performed
+    with `np.unique` and `np.bincount`. Queries without `group_by` columns, using anything besides
+    simple field lookups or SUM aggregations are aggregated by `MetricAggregator`.
+
+    Requires `numpy` package. Enable with
+    `METRICS_AGGREGATOR = 'modules.metrics.aggregations.NumpyMetricAggregator'` setting.
+
+    """
+
+    def __init__(self, use_rollups: bool = True):
+        if np is None:
+            raise ImproperlyConfigured('NumpyMetricAggregator requires `numpy` package')
+        super().__init__(use_rollups=use_rollups)
+        self.store = MetricColumnStore(self.model)
+
+    def aggregate(
+            self,
+            queryset: QuerySet,
+            group_by_columns: List[str],
+            display_columns: List[str],
+    ):
+        self._validate_group_by_columns(group_by_columns)
+        aggregations = self._get_column_aggregations(group_by_columns, display_columns)
+        sum_columns = self._get_sum_columns(display_columns)
+        # Without `group_by` columns SQL aggregates every row
+        if not group_by_columns or sum_columns is None or not self._is_numpy_compatible(queryset):
+            return super().aggregate(queryset, group_by_columns, display_columns)
+
+        self.store.refresh()
+        mask = self._get_mask(queryset.query.where)
+        if mask is None:
+            return super().aggregate(queryset, group_by_columns, display_columns)
+
+        groups, group_index = self._group(group_by_columns, mask)
+        groups_count = len(groups[group_by_columns[0]])
+        totals = {
+            column: np.bincount(
+                group_index,
+                weights=self.store.columns[column][mask],
+                minlength=groups_count,
+            )
+            for column in set(sum_columns)
+        }
+        columns = {name: values.tolist() for name, values in groups.items()}
+        for name in aggregations:
+            if name in self.ratio_metrics:
+                numerator, denominator = self.ratio_metrics[name]
+                columns[name] = [
+                    value / total if total else None
+                    for value, total in zip(totals[numerator].tolist(), totals[denominator].tolist())
+                ]
+            else:
+                columns[name] = self._to_column_type(name, totals[name])
+
+        names = list(columns)
+        rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+        return AggregationResult(rows)
+
+    def _get_sum_columns(self, display_columns: List[str]) -> Optional[List[str]]:
+        """Get columns to sum for sums and ratios. Return None when other aggregations required."""
+        columns = []
+        for column_with_function in display_columns:
+            column, *any_func = column_with_function.split('__')
+            func = any_func[0] if any_func else None
+            if func and self.supported_aggregations.get(func) is not Sum:
+                return None
+            columns.extend(self.ratio_metrics.get(column, (column, )))
+        return columns
+
+    def _is_numpy_compatible(self, queryset: QuerySet) -> bool:
+        query = queryset.query
+        return (
+            queryset.model is self.model
+            and not query.annotations
+            and not query.extra
+            and not query.is_sliced
+        )
+
+    def _get_mask(self, where: WhereNode) -> Optional['np.ndarray']:
+        """Translate the WHERE clause to a boolean mask. Return None for unsupported clauses."""
+        masks = []
+        for child in where.children:
+            if isinstance(child, WhereNode):
+                mask = self._get_mask(child)
+            elif (
+                isinstance(child, Lookup)
+                and isinstance(child.lhs, Col)
+                and child.lhs.alias == self.model._meta.db_table
+                and child.rhs_is_direct_value()
+            ):
+                mask = self.store.compare(child.lhs.target.name, child.lookup_name, child.rhs)
+            else:
+                mask = None
+
+            if mask is None:
+                return None
+            masks.append(mask)
+
+        if not masks:
+            mask = np.ones(len(self.store), dtype=bool)
+        elif where.connector == OR:
+            mask = np.logical_or.reduce(masks)
+        else:
+            mask = np.logical_and.reduce(masks)
+        return ~mask if where.negated else mask
+
+    def _group(
+            self,
+            group_by_columns: List[str],
+            mask: 'np.ndarray',
+    ) -> Tuple[Dict[str, 'np.ndarray'], 'np.ndarray']:
+        """Get values of groups and the group index of every filtered row.
+
+        Codes of group columns are combined into a single integer key of a group.
+
+        """
+        encoded = [self.store.get_codes(column, mask) for column in group_by_columns]
+        keys = np.zeros(int(mask.sum()), dtype=np.int64)
+        for codes, cardinality, _ in encoded:
+            keys = keys * cardinality + codes
+
+        group_keys, group_index = np.unique(keys, return_inverse=True)
+        groups = {}
+        for column, (_, cardinality, decode) in reversed(list(zip(group_by_columns, encoded))):
+            groups[column] = decode(group_keys % cardinality)
+            group_keys = group_keys // cardinality
+
+        return {column: groups[column] for column in group_by_columns}, group_index.reshape(-1)
+
+    def _to_column_type(self, column: str, totals: 'np.ndarray') -> list:
+        if self.store.columns[column].dtype == np.int64:
+            return totals.round().astype(np.int64).tolist()
+        return totals.tolist()
@@ -0,0 +1,117 @@
+import asyncio
+from typing import Optional
+
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from ..exceptions import AggregationError
+from ..executors import run_in_db_thread
+from ..routers import replica_reads
+from .renderers import MetricColumnarRenderer
+from .views import MetricViewSet
+
+
+class AsyncMetricViewSet(MetricViewSet):
+    """Metrics list and aggregation served by an async view.
+
+    The request is handled by the `MetricViewSet` methods running on the database thread pool,
+    so the event loop is never blocked by queries. The page and the count queries of the default
+    limit-offset pagination run concurrently on two pool threads.
+
+    Export formats are streamed by `MetricViewSet` only. Requests are not instrumented:
+    their queries run on several threads.
+
+    """
+    renderer_classes = (*api_settings.DEFAULT_RENDERER_CLASSES, MetricColumnarRenderer)
+    instrumented_actions = ()
+
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.action_map = {'get': 'list', 'head': 'list'}
+            return await self.async_dispatch(request, *args, **kwargs)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.csrf_exempt = True
+        return view
+
+    async def async_dispatch(self, request, *args, **kwargs):
+        """`APIView.dispatch` awaiting the list handler."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        with replica_reads():
+            try:
+                response = await self.async_list(request)
+            except Exception as exc:
+                response = await run_in_db_thread(self.handle_exception, exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def async_list(self, request) -> Response:
+        cache_key, response, queryset = await run_in_db_thread(self.prepare_list, request)
+        if response is None:
+            page = await self.paginate_queryset_concurrently(queryset)
+            response = await run_in_db_thread(self.finish_list, cache_key, queryset, page)
+        return self.set_http_cache_headers(response)
+
+    def prepare_list(self, request):
+        """Check the request and filter the data.
+
+        Return the cache key and either a ready response or the data to paginate.
+
+        """
+        if self.action is None:
+            self.http_method_not_allowed(request)
+        self.initial(request)
+
+        response = self.get_not_modified_response()
+        if response is not None:
+            return None, response, None
+
+        cache_key, response = self.get_cached_response()
+        if response is not None:
+            return cache_key, response, None
+
+        try:
+            queryset = self.get_list_queryset()
+        except AggregationError as error:
+            return cache_key, self.get_aggregation_error_response(error), None
+        return cache_key, None, queryset
+
+    async def paginate_queryset_concurrently(self, queryset) -> Optional[list]:
+        """Run `LimitOffsetPagination.paginate_queryset` queries concurrently.
+
+        The page is selected without waiting for the count, for an offset beyond the count
+        the page is empty anyway. Other pagination modes run their queries on a pool thread.
+
+        """
+        paginator = self.paginator
+        if type(paginator) is not LimitOffsetPagination:
+            return await run_in_db_thread(self.paginate_queryset, queryset)
+
+        paginator.request = self.request
+        paginator.limit = paginator.get_limit(self.request)
+        if paginator.limit is None:
+            return None
+        paginator.offset = paginator.get_offset(self.request)
+
+        paginator.count, page = await asyncio.gather(
+            run_in_db_thread(paginator.get_count, queryset),
+            run_in_db_thread(list, queryset[paginator.offset:paginator.offset + paginator.limit]),
+        )
+        if paginator.count > paginator.limit and paginator.template is not None:
+            paginator.display_page_controls = True
+        return page
+
+    def finish_list(self, cache_key: Optional[str], queryset, page: Optional[list]) -> Response:
+        response = self.get_page_response(queryset, page)
+        self.cache_response(cache_key, response)
+        return response
@@ -0,0 +1,77 @@
+import hashlib
+import json
+from typing import Any, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+
+from ..params import normalize_query_params
+from ..versioning import get_data_version
+
+HITS_KEY = 'metrics:stats:hits'
+MISSES_KEY = 'metrics:stats:misses'
+
+
+class MetricResponseCache:
+    """Cache of metric API response data.
+
+    Cache keys contain the data version, so entries become unreachable when the data changes
+    and are evicted by the cache backend according to its TTL and size limits.
+    The backend is the `METRICS_RESPONSE_CACHE` alias of `CACHES` setting, None disables the cache.
+
+    """
+
+    @property
+    def cache(self) -> Optional[BaseCache]:
+        alias = getattr(settings, 'METRICS_RESPONSE_CACHE', None)
+        return caches[alias] if alias else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.cache is not None
+
+    def get_key(self, request, namespace: str = 'response', ignored_params: Iterable[str] = (),
+                data_version: Optional[int] = None) -> str:
+        """Build a key from the data version and normalized query parameters except `ignored_params`.
+
+        The current data version is read when `data_version` is not passed.
+
+        """
+        if data_version is None:
+            data_version = get_data_version()
+        params = normalize_query_params(request.query_params)
+        for param in ignored_params:
+            params.pop(param, None)
+        digest = hashlib.sha1(
+            json.dumps([request.get_host(), request.path, params]).encode()
+        ).hexdigest()
+        return f'metrics:{namespace}:{data_version}:{digest}'
+
+    def get(self, key: str) -> Optional[Any]:
+        data = self.cache.get(key)
+        self._increment(HITS_KEY if data is not None else MISSES_KEY)
+        return data
+
+    def set(self, key: str, data: Any):
+        self.cache.set(key, data)
+
+    def get_stats(self) -> dict:
+        hits = self.cache.get(HITS_KEY, 0) if self.enabled else 0
+        misses = self.cache.get(MISSES_KEY, 0) if self.enabled else 0
+        total = hits + misses
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else None,
+            'data_version': get_data_version(),
+        }
+
+    def _increment(self, key: str):
+        # Counters are never expired
+        if not self.cache.add(key, 1, timeout=None):
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                # The counter evicted between `add` and `incr`
+                self.cache.set(key, 1, timeout=None)
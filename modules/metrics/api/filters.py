@@ -1,6 +1,10 @@
+from rest_framework.filters import BaseFilterBackend
+
 from django_countries import countries
 from django_filters.rest_framework import (
+    CharFilter,
     DateFromToRangeFilter,
+    DjangoFilterBackend,
     FilterSet,
     MultipleChoiceFilter,
 )
@@ -11,6 +15,8 @@ from ..models import Metric
 class MetricFilter(FilterSet):
     """Filter for `Metric` model."""
     date_range = DateFromToRangeFilter(field_name='date')
+    # Unknown channels match nothing instead of the invalid choice error
+    channel = CharFilter()
     country = MultipleChoiceFilter(choices=countries)
 
     class Meta:
@@ -20,3 +26,65 @@ class MetricFilter(FilterSet):
             'channel',
             'os',
         )
+
+
+class MetricFilterBackend(DjangoFilterBackend):
+    """Filter the data by `MetricFilter`.
+
+    The date range of a period comparison is left to the aggregation selecting both periods.
+
+    """
+
+    def get_filterset_kwargs(self, request, queryset, view):
+        kwargs = super().get_filterset_kwargs(request, queryset, view)
+        if view.is_aggregation and view.get_comparison():
+            data = kwargs['data'].copy()
+            for name in ('date_range_after', 'date_range_before'):
+                data.pop(name, None)
+            kwargs['data'] = data
+        return kwargs
+
+
+class MetricAggregationFilter(BaseFilterBackend):
+    """Aggregate already filtered data when the view requires aggregation.
+
+    Must be placed after the filtering backends and before the ordering one.
+
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not view.is_aggregation:
+            return queryset
+
+        comparison = view.get_comparison()
+        if comparison:
+            return view.aggregator.aggregate_comparison(
+                queryset,
+                view.get_group_by_columns(),
+                view.get_display_columns(),
+                **comparison,
+            )
+
+        top = view.get_top()
+        totals = view.get_totals()
+        if totals:
+            return view.aggregator.aggregate_with_totals(
+                queryset,
+                view.get_group_by_columns(),
+                view.get_display_columns(),
+                totals,
+            )
+
+        if top:
+            return view.aggregator.aggregate_top(
+                queryset,
+                view.get_group_by_columns(),
+                view.get_display_columns(),
+                **top,
+            )
+
+        return view.aggregator.aggregate(
+            queryset,
+            view.get_group_by_columns(),
+            view.get_display_columns(),
+        )
@@ -0,0 +1,124 @@
+import json
+import logging
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import ContextManager, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections
+from django.template.response import SimpleTemplateResponse
+
+from ..params import normalize_query_params
+
+logger = logging.getLogger('modules.metrics.slow_requests')
+
+COUNT_QUERY_PREFIX = 'SELECT COUNT(*)'
+
+
+class RequestProfile:
+    """Phase timings and SQL queries of a single request.
+
+    The instance is a database execute wrapper recording every executed query and its duration.
+
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.queries: List[dict] = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': [str(param) for param in params or ()] if not many else [],
+                'duration': time.perf_counter() - started_at,
+            })
+
+    @contextmanager
+    def phase(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started_at
+
+    @property
+    def duration(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def sql_duration(self) -> float:
+        return sum(query['duration'] for query in self.queries)
+
+    def get_server_timing(self) -> str:
+        """Format timings as `Server-Timing` header value with durations in milliseconds."""
+        count_queries = [query for query in self.queries if query['sql'].startswith(COUNT_QUERY_PREFIX)]
+        entries = [f'{name};dur={duration * 1000:.2f}' for name, duration in self.phases.items()]
+        entries.append(f'sql;dur={self.sql_duration * 1000:.2f};desc="{len(self.queries)} queries"')
+        if count_queries:
+            count_duration = sum(query['duration'] for query in count_queries)
+            entries.append(f'count;dur={count_duration * 1000:.2f};desc="{len(count_queries)} queries"')
+        entries.append(f'total;dur={self.duration * 1000:.2f}')
+        return ', '.join(entries)
+
+    def get_log_record(self, request, status_code: int) -> dict:
+        return {
+            'path': request.path,
+            'params': normalize_query_params(request.query_params),
+            'status': status_code,
+            'duration_ms': round(self.duration * 1000, 2),
+            'phases_ms': {name: round(duration * 1000, 2) for name, duration in self.phases.items()},
+            'sql_count': len(self.queries),
+            'sql_duration_ms': round(self.sql_duration * 1000, 2),
+            'sql': [
+                dict(query, duration=round(query['duration'] * 1000, 2))
+                for query in self.queries
+            ],
+        }
+
+
+class InstrumentationMixin:
+    """Profile `instrumented_actions` of a view.
+
+    Enabled by `METRICS_INSTRUMENTATION` setting. Phase timings and SQL queries are returned
+    in `Server-Timing` header, requests slower than `METRICS_SLOW_REQUEST_THRESHOLD` seconds
+    are logged to `modules.metrics.slow_requests` logger as JSON.
+    When disabled, the phases are no-op context managers.
+
+    """
+    instrumented_actions = ('list', )
+    profile: Optional[RequestProfile] = None
+
+    def initial(self, request, *args, **kwargs):
+        if getattr(settings, 'METRICS_INSTRUMENTATION', False) and self.action in self.instrumented_actions:
+            self.profile = RequestProfile()
+            self._profile_stack = ExitStack()
+            for connection in connections.all():
+                self._profile_stack.enter_context(connection.execute_wrapper(self.profile))
+        super().initial(request, *args, **kwargs)
+
+    def phase(self, name: str) -> ContextManager:
+        """Measure a phase of the request when the profiling is enabled."""
+        return self.profile.phase(name) if self.profile else nullcontext()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.profile is None:
+            return response
+
+        # Render here to measure rendering, Django does not render the response again
+        if isinstance(response, SimpleTemplateResponse):
+            with self.phase('render'):
+                response.render()
+        self._profile_stack.close()
+
+        response['Server-Timing'] = self.profile.get_server_timing()
+        threshold = getattr(settings, 'METRICS_SLOW_REQUEST_THRESHOLD', None)
+        if threshold is not None and self.profile.duration >= threshold:
+            record = self.profile.get_log_record(request, response.status_code)
+            logger.warning(json.dumps(record), extra={'metrics_request': record})
+        return response
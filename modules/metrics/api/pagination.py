@@ -0,0 +1,288 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from django.db import connections
+from django.db.models import Q, QuerySet
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from ..fields import DimensionOrderBy
+from .cache import MetricResponseCache
+
+
+class MetricKeysetPagination(BasePagination):
+    """Keyset (cursor) pagination by the active ordering.
+
+    The page position is the ordering values of the page boundary row, so a page query is
+    `WHERE (ordering columns) > (position values) ... LIMIT n` and its cost does not depend
+    on the page number. No `COUNT(*)` query is performed.
+
+    Raw rows use `id` as a tie-breaker, aggregated rows use the `group_by` columns.
+    Aggregation results computed in memory are paginated with the same interface.
+
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None) -> Optional[List]:
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.ordering = self.get_ordering(queryset, view)
+        position, reverse = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by(*(self._invert(field) for field in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._get_keyset_filter(position, reverse, self.get_nulls_largest(queryset)))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        first_position = self._get_position(results[0]) if results else position
+        last_position = self._get_position(results[-1]) if results else position
+        if reverse:
+            # The forward filter excludes the boundary row, so the next page starts after the last row
+            self.next_position = last_position
+            self.previous_position = first_position if has_more else None
+        else:
+            self.next_position = last_position if has_more else None
+            self.previous_position = first_position if position is not None else None
+
+        return results
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_limit(self, request) -> int:
+        try:
+            return _positive_int(
+                request.query_params[self.limit_query_param],
+                strict=True,
+                cutoff=self.max_limit,
+            )
+        except (KeyError, ValueError):
+            return self.default_limit
+
+    def get_ordering(self, queryset: QuerySet, view) -> Tuple[str, ...]:
+        """Get the active ordering with unique tie-breaker columns appended."""
+        is_aggregation = getattr(view, 'is_aggregation', False)
+        tie_breakers = view.get_group_by_columns() if is_aggregation else ['pk']
+
+        query_ordering = queryset.query.order_by if isinstance(queryset, QuerySet) else queryset.ordering
+        ordering = [
+            field.ordering if isinstance(field, DimensionOrderBy) else field
+            for field in query_ordering
+        ]
+        ordering = [field for field in ordering if isinstance(field, str)]
+        ordered_fields = {field.lstrip('-') for field in ordering}
+        ordering.extend(field for field in tie_breakers if field not in ordered_fields)
+        return tuple(ordering)
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self) -> Optional[str]:
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def encode_cursor(self, position: List, reverse: bool) -> str:
+        """Build URL with an opaque cursor token."""
+        token = json.dumps({'o': self.ordering, 'p': position, 'r': int(reverse)})
+        encoded = urlsafe_b64encode(token.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request) -> Tuple[Optional[List], bool]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            token = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = token['p'], bool(token['r'])
+            valid = tuple(token['o']) == self.ordering and len(position) == len(self.ordering)
+        except (BinasciiError, UnicodeDecodeError, ValueError, TypeError, KeyError):
+            valid = False
+
+        if not valid:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def get_nulls_largest(queryset) -> bool:
+        """Check if NULL values sort after other values in ascending order, like on PostgreSQL.
+
+        SQLite, MySQL and `AggregationResult` sort them first.
+
+        """
+        if isinstance(queryset, QuerySet):
+            return connections[queryset.db].features.nulls_order_largest
+        return False
+
+    def _get_keyset_filter(self, position: List, reverse: bool, nulls_largest: bool = False) -> Q:
+        """Build `a >= x AND ((a > x) OR (a = x AND b > y) OR ...)` condition.
+
+        The redundant bound on the first ordering column lets the database use an index range scan.
+        Comparisons with NULL values follow the position of NULL values in the ordering.
+
+        """
+        keyset_filter = Q()
+        equal_filter = Q()
+        for field, value in zip(self.ordering, position):
+            column, lookup = self._get_column_lookup(field, reverse)
+            keyset_filter |= equal_filter & self._get_after_filter(column, lookup, value, nulls_largest)
+            equal_filter &= Q(**{f'{column}__isnull': True}) if value is None else Q(**{column: value})
+
+        column, lookup = self._get_column_lookup(self.ordering[0], reverse)
+        value = position[0]
+        first_bound = self._get_after_filter(column, lookup, value, nulls_largest) | (
+            Q(**{f'{column}__isnull': True}) if value is None else Q(**{column: value})
+        )
+        return first_bound & keyset_filter
+
+    @staticmethod
+    def _get_after_filter(column: str, lookup: str, value, nulls_largest: bool) -> Q:
+        """Build the condition of values after `value` in the ordering of `column` by `lookup`."""
+        # NULL values are after all values when the ordering goes towards them
+        nulls_after = (lookup == 'gt') == nulls_largest
+        is_null = Q(**{f'{column}__isnull': True})
+        if value is None:
+            # Everything or nothing is after NULL
+            return Q(**{f'{column}__isnull': False}) if not nulls_after else is_null & ~is_null
+        after = Q(**{f'{column}__{lookup}': value})
+        return after | is_null if nulls_after else after
+
+    @staticmethod
+    def _get_column_lookup(field: str, reverse: bool) -> Tuple[str, str]:
+        descending = field.startswith('-') != reverse
+        return field.lstrip('-'), 'lt' if descending else 'gt'
+
+    def _get_position(self, item) -> List:
+        position = []
+        for field in self.ordering:
+            column = field.lstrip('-')
+            value = item[column] if isinstance(item, dict) else getattr(item, column)
+            position.append(self._encode_value(value))
+        return position
+
+    @staticmethod
+    def _encode_value(value) -> Any:
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        # `Country` and other objects with string representation
+        return str(value)
+
+    @staticmethod
+    def _invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class MetricNoCountPagination(LimitOffsetPagination):
+    """Limit-offset pagination without the exact `COUNT(*)` query.
+
+    A page query selects `limit + 1` rows, the extra row shows whether the next page exists.
+    The `count` query parameter adds the number of rows to the response:
+      - `estimate` - the query planner estimate on PostgreSQL, the cached count on other databases;
+      - `cached` - the exact count computed once per data version and query parameters.
+
+    """
+    count_query_param = 'count'
+    count_modes = ('estimate', 'cached')
+    # Query parameters not changing the number of rows
+    count_ignored_params = ('limit', 'offset', 'ordering', 'pagination', 'count', 'format')
+    response_cache = MetricResponseCache()
+    template = None
+
+    def paginate_queryset(self, queryset, request, view=None) -> List:
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        count_mode = self.get_count_mode(request)
+
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_more = len(results) > self.limit
+        self.count, self.count_estimated = None, False
+        if count_mode == 'estimate':
+            self.count = self.get_estimated_count(queryset)
+            self.count_estimated = self.count is not None
+        if count_mode and self.count is None:
+            self.count = self.get_cached_count(queryset)
+
+        return results[:self.limit]
+
+    def get_paginated_response(self, data) -> Response:
+        response_data = OrderedDict([('has_more', self.has_more)])
+        if self.count is not None:
+            response_data.update(count=self.count, count_estimated=self.count_estimated)
+        response_data.update(
+            next=self.get_next_link(),
+            previous=self.get_previous_link(),
+            results=data,
+        )
+        return Response(response_data)
+
+    def get_count_mode(self, request) -> Optional[str]:
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode and count_mode not in self.count_modes:
+            raise ValidationError({self.count_query_param: f'Unknown count mode: {count_mode}'})
+        return count_mode or None
+
+    def get_next_link(self) -> Optional[str]:
+        if not self.has_more:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_estimated_count(self, queryset) -> Optional[int]:
+        """Get the planner estimate of rows number. Return None when not available."""
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return None
+
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_cached_count(self, queryset) -> int:
+        """Count rows once per data version and query parameters affecting the rows.
+
+        Aggregation results computed in memory are counted without the cache.
+
+        """
+        if not isinstance(queryset, QuerySet) or not self.response_cache.enabled:
+            return queryset.count()
+
+        key = self.response_cache.get_key(self.request, 'count', self.count_ignored_params)
+        count = self.response_cache.cache.get(key)
+        if count is None:
+            count = queryset.count()
+            self.response_cache.cache.set(key, count)
+        return count
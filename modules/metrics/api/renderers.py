@@ -0,0 +1,72 @@
+import csv
+from typing import Any, Iterable, Iterator, List, Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class Echo:
+    """File-like object returning written value instead of buffering it."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+class MetricExportRenderer(BaseRenderer):
+    """Base renderer for metric exports.
+
+    The export is streamed by `iter_render` from rows of values. `render` is used for responses
+    containing ordinary response data, e.g. errors.
+
+    """
+    charset = 'utf-8'
+
+    def iter_render(self, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> bytes:
+        if data is None:
+            return b''
+
+        items = data.get('results', [data]) if isinstance(data, dict) else data
+        columns = self._get_columns(items)
+        rows = ([item.get(column) for column in columns] for item in items)
+        return ''.join(self.iter_render(columns, rows)).encode(self.charset)
+
+    @staticmethod
+    def _get_columns(items: List[dict]) -> List[str]:
+        columns = {}
+        for item in items:
+            columns.update(dict.fromkeys(item))
+        return list(columns)
+
+
+class MetricCSVRenderer(MetricExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def iter_render(self, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+        writer = csv.writer(Echo())
+        yield writer.writerow(columns)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class MetricNDJSONRenderer(MetricExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def iter_render(self, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> Iterator[str]:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+class MetricColumnarRenderer(JSONRenderer):
+    """JSON with column names listed once and rows as arrays of values.
+
+    Selected by `format=columnar` only, the view builds `columns` and `data` of the response.
+
+    """
+    format = 'columnar'
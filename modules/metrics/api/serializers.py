@@ -1,4 +1,12 @@
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, List, Sequence
+
+from django.db.models import QuerySet
+
+from rest_framework import ISO_8601
+from rest_framework import fields as drf_fields
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from ..models import Metric
 
@@ -20,3 +28,85 @@ class MetricSerializer(serializers.ModelSerializer):
             'revenue',
             'cpi',
         )
+
+
+class MetricRowSerializer:
+    """Serialize raw metric rows selected by `values_list()` without model instances.
+
+    Converters of column values are compiled once from `serializer_class` fields.
+    The output is the same as `serializer_class` output for the `Metric` rows.
+
+    """
+    serializer_class = MetricSerializer
+
+    def __init__(self):
+        serializer_fields = self.serializer_class().fields
+        self.fields = tuple(serializer_fields)
+        self.converters = tuple(
+            self._get_converter(field) for field in serializer_fields.values()
+        )
+
+    def get_rows(self, queryset: QuerySet) -> QuerySet:
+        """Select serialized columns and primary key as named tuples.
+
+        The primary key is not serialized and used as the pagination tie-breaker.
+
+        """
+        return queryset.values_list(*self.fields, 'pk', named=True)
+
+    def serialize(self, rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+        fields, converters = self.fields, self.converters
+        return [
+            dict(zip(fields, [
+                None if value is None else convert(value)
+                for convert, value in zip(converters, row)
+            ]))
+            for row in rows
+        ]
+
+    def serialize_values(self, rows: Iterable[Sequence[Any]]) -> List[List[Any]]:
+        """Serialize rows to lists of values in the order of `fields`."""
+        converters = self.converters
+        return [
+            [None if value is None else convert(value) for convert, value in zip(converters, row)]
+            for row in rows
+        ]
+
+    @staticmethod
+    def _get_converter(field: drf_fields.Field) -> Callable[[Any], Any]:
+        """Get the fastest function with the same result as `field.to_representation`."""
+        if isinstance(field, drf_fields.ReadOnlyField):
+            return lambda value: value
+        if isinstance(field, drf_fields.ChoiceField):
+            # Choice keys are strings, dimension values are already the strings
+            return lambda value: field.choice_strings_to_values.get(str(value), value)
+        if isinstance(field, drf_fields.DateField) and api_settings.DATE_FORMAT == ISO_8601:
+            return date.isoformat
+        if type(field) is drf_fields.IntegerField:
+            return int
+        if type(field) is drf_fields.FloatField:
+            return float
+        if type(field) is drf_fields.CharField:
+            return str
+        return field.to_representation
+
+
+class MetricBatchQuerySerializer(serializers.Serializer):
+    """Aggregation spec with the same parameters as the list API query."""
+    group_by = serializers.CharField()
+    display_columns = serializers.CharField()
+    ordering = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def to_internal_value(self, data):
+        data = super().to_internal_value(data)
+        for param in ('group_by', 'display_columns', 'ordering'):
+            if param in data:
+                data[param] = [column.strip() for column in data[param].split(',') if column.strip()]
+        return data
+
+
+class MetricBatchSerializer(serializers.Serializer):
+    """Aggregation specs sharing `MetricFilter` filters."""
+    filters = serializers.DictField(required=False, default=dict)
+    queries = serializers.ListField(child=MetricBatchQuerySerializer(), min_length=1, max_length=50)
@@ -2,11 +2,12 @@ from django.urls import include, path
 
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r'metrics', views.MetricViewSet)
 
 urlpatterns = [
+    path('metrics/async/', async_views.AsyncMetricViewSet.as_async_view(), name='metric-list-async'),
     path('', include(router.urls)),
 ]
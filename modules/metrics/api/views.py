@@ -1,23 +1,88 @@
-from typing import List
+import hashlib
+import uuid
+from functools import cached_property
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import HttpRequest, QueryDict, StreamingHttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    APIException,
+    NotFound,
+    UnsupportedMediaType,
+    ValidationError,
+)
 from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import LimitOffsetPagination, _positive_int
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.status import HTTP_400_BAD_REQUEST
-
-from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.reverse import reverse
+from rest_framework.settings import api_settings
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_202_ACCEPTED,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_409_CONFLICT,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
 
-from ..aggregations import MetricAggregator
-from ..models import Metric
-from .filters import MetricFilter
-from ..exceptions import AggregationError
-from .serializers import MetricSerializer
-from rest_framework.exceptions import APIException
-
-from rest_framework.permissions import AllowAny
+from ..aggregations import (
+    DELTA_SUFFIX,
+    GROUPING,
+    PREVIOUS_SUFFIX,
+    AggregationResult,
+    MetricAggregator,
+    get_aggregator,
+    get_selected_columns,
+)
+from ..exceptions import AggregationError, LoadError
+from ..jobs import JobQueueFull, JobRows, submit_job
+from ..loaders import MetricLoader, iter_csv_batches, iter_ndjson_batches
+from ..models import Metric, MetricQueryJob
+from ..rollups import ADDITIVE_COLUMNS
+from ..routers import replica_reads
+from ..versioning import get_data_version
+from .cache import MetricResponseCache
+from .filters import MetricAggregationFilter, MetricFilter, MetricFilterBackend
+from .instrumentation import InstrumentationMixin
+from .pagination import MetricKeysetPagination, MetricNoCountPagination
+from .renderers import (
+    MetricColumnarRenderer,
+    MetricCSVRenderer,
+    MetricExportRenderer,
+    MetricNDJSONRenderer,
+)
+from .serializers import (
+    MetricBatchSerializer,
+    MetricRowSerializer,
+    MetricSerializer,
+)
 
 GROUP_BY = 'group_by'
 DISPLAY_COLUMNS = 'display_columns'
+PAGINATION = 'pagination'
+TOTALS = 'totals'
+TOP = 'top'
+TOP_BY = 'top_by'
+TOP_PARTITION = 'top_partition'
+COMPARE = 'compare'
+# Parameters of the result pages, not of the query computed by a job
+JOB_RESULT_PARAMS = ('limit', 'offset', 'pagination', 'cursor', 'count', 'format')
+EXPORT_CHUNK_SIZE = 2000
+INGEST_BATCH_SIZE = 2000
+DEFAULT_HTTP_CACHE_MAX_AGE = 60
+# Readers of ingested request bodies by their media types
+INGEST_READERS = {
+    MetricCSVRenderer.media_type: iter_csv_batches,
+    MetricNDJSONRenderer.media_type: iter_ndjson_batches,
+}
 
 
 class AggregationAPIError(APIException):
@@ -25,13 +90,21 @@ class AggregationAPIError(APIException):
 
 
 class MetricViewSet(
+    InstrumentationMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet,
 ):
     queryset = Metric.objects.all()
     serializer_class = MetricSerializer
+    renderer_classes = (
+        *api_settings.DEFAULT_RENDERER_CLASSES,
+        MetricColumnarRenderer,
+        MetricCSVRenderer,
+        MetricNDJSONRenderer,
+    )
     filter_backends = (
-        DjangoFilterBackend,
+        MetricFilterBackend,
+        MetricAggregationFilter,
         OrderingFilter,
     )
     permission_classes = (
@@ -40,6 +113,10 @@ class MetricViewSet(
     filter_class = MetricFilter
     ordering_fields = (
         'date',
+        'date__week',
+        'date__month',
+        'date__quarter',
+        'date__year',
         'channel',
         'country',
         'os',
@@ -48,26 +125,102 @@ class MetricViewSet(
         'installs',
         'spend',
         'revenue',
-        'cpi',
+        GROUPING,
+        *MetricAggregator.ratio_metrics,
+        *(
+            MetricAggregator.get_aggregated_column_name(column, func)
+            for column in ADDITIVE_COLUMNS
+            for func in MetricAggregator.supported_aggregations
+            if func != 'sum'
+        ),
     )
-    aggregator = MetricAggregator()
+    # Previous period values and differences of the value columns for `compare`
+    ordering_fields += tuple(
+        f'{column}{suffix}'
+        for column in ordering_fields[ordering_fields.index('impressions'):]
+        if column != GROUPING
+        for suffix in (PREVIOUS_SUFFIX, DELTA_SUFFIX)
+    )
+    response_cache = MetricResponseCache()
+    row_serializer = MetricRowSerializer()
+    # Names of the row values in the columnar format, set by `get_list_queryset`
+    columns: List[str] = []
+    # Pagination modes available with `pagination` query parameter
+    pagination_classes = {
+        'cursor': MetricKeysetPagination,
+        'nocount': MetricNoCountPagination,
+    }
+
+    # Actions writing the data or reading the jobs, their reads go to `default` too
+    primary_actions = ('ingest', 'jobs', 'job', 'job_results')
+
+    def dispatch(self, request, *args, **kwargs):
+        """Read the data from the replicas configured by `METRICS_DATABASE_REPLICAS`."""
+        if self.action_map.get(request.method.lower()) in self.primary_actions:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
+        """Get data to filter.
+
+        The aggregation performed by `MetricAggregationFilter` on filtered data
+        or by the aggregator for batch requests.
+
+        """
         queryset = super().get_queryset()
-        if not self.is_aggregation:
+        if self.action == 'list' and not self.is_aggregation:
             return queryset.with_cpi().order_by('date')
 
-        group_by = self._get_group_by_columns()
-        display_columns = self._get_display_columns()
-        queryset = self.aggregator.aggregate(queryset, group_by, display_columns)
         return queryset
 
-    def _get_group_by_columns(self) -> List[str]:
+    def get_group_by_columns(self) -> List[str]:
         return self.request.query_params.get(GROUP_BY).split(',')
 
-    def _get_display_columns(self) -> List[str]:
+    def get_display_columns(self) -> List[str]:
         return self.request.query_params.get(DISPLAY_COLUMNS).split(',')
 
+    def get_totals(self) -> Optional[str]:
+        """Get kind of total rows requested with aggregation: `rollup`, `cube` or `grand`."""
+        return self.request.query_params.get(TOTALS) or None
+
+    def get_top(self) -> Optional[dict]:
+        """Get `aggregate_top` arguments for the top rows requested by `top`, `top_by` and `top_partition`."""
+        params = self.request.query_params
+        if not params.get(TOP):
+            return None
+
+        try:
+            top = _positive_int(params[TOP], strict=True)
+        except ValueError:
+            raise ValidationError({TOP: 'A positive integer is required'})
+        if not params.get(TOP_BY):
+            raise ValidationError({TOP_BY: 'A ranking column is required with `top`'})
+        if self.get_totals():
+            raise ValidationError({TOP: 'Top rows are not supported with totals'})
+        return {'top': top, 'top_by': params[TOP_BY], 'top_partition': params.get(TOP_PARTITION) or None}
+
+    def get_comparison(self) -> Optional[dict]:
+        """Get `aggregate_comparison` arguments for the period comparison requested by `compare`.
+
+        The current period is the `date_range` filter, it must have both dates.
+
+        """
+        params = self.request.query_params
+        compare = params.get(COMPARE)
+        if not compare:
+            return None
+
+        form = MetricFilter(data=params).form
+        dates = form.cleaned_data.get('date_range') if form.is_valid() else None
+        if not dates or dates.start is None or dates.stop is None:
+            raise ValidationError({
+                COMPARE: 'Both `date_range_after` and `date_range_before` are required with `compare`',
+            })
+        if self.get_totals() or self.get_top():
+            raise ValidationError({COMPARE: 'Comparison is not supported with totals and top rows'})
+        return {'compare': compare, 'start': dates.start.date(), 'end': dates.stop.date()}
+
     @property
     def is_aggregation(self):
         """Check if aggregation required.
@@ -79,27 +232,375 @@ class MetricViewSet(
         display_columns = self.request.query_params.get(DISPLAY_COLUMNS, '')
         return bool(group_by and display_columns)
 
+    @property
+    def is_columnar(self) -> bool:
+        """Check if the columnar response format requested by `format=columnar`."""
+        return isinstance(getattr(self.request, 'accepted_renderer', None), MetricColumnarRenderer)
+
+    @property
+    def aggregator(self) -> MetricAggregator:
+        return get_aggregator()
+
+    @property
+    def paginator(self):
+        """Get paginator for the pagination mode requested by `pagination` query parameter."""
+        if not hasattr(self, '_paginator'):
+            pagination_class = self.pagination_class
+            pagination_mode = self.request.query_params.get(PAGINATION)
+            if pagination_mode:
+                if pagination_mode not in self.pagination_classes:
+                    raise ValidationError({PAGINATION: f'Unknown pagination mode: {pagination_mode}'})
+                if pagination_mode == 'cursor' and self.is_aggregation and self.get_totals():
+                    raise ValidationError({TOTALS: 'Totals are not supported by the cursor pagination'})
+                if pagination_mode == 'cursor' and self.is_aggregation and self.get_top():
+                    raise ValidationError({TOP: 'Top rows are not supported by the cursor pagination'})
+                pagination_class = self.pagination_classes[pagination_mode]
+            self._paginator = pagination_class() if pagination_class else None
+        return self._paginator
+
     def list(self, request, *args, **kwargs):
+        """List metrics using cached response data when available.
+
+        Export formats are streamed without pagination. Requests with `If-None-Match`
+        of the current entity tag get `304 Not Modified` without querying the data.
+
+        """
+        response = self.get_not_modified_response()
+        if response is None and isinstance(request.accepted_renderer, MetricExportRenderer):
+            response = self.get_export_response()
+        elif response is None:
+            cache_key, response = self.get_cached_response()
+            if response is None:
+                response = self.get_list_response()
+                self.cache_response(cache_key, response)
+        return self.set_http_cache_headers(response)
+
+    @cached_property
+    def data_version(self) -> int:
+        """Version of the data read by the request, the same for all its cache keys."""
+        return get_data_version()
+
+    def get_etag(self) -> str:
+        """Get the entity tag of the list response from the data version, the query parameters and the format."""
+        key = self.response_cache.get_key(self.request, namespace='etag', data_version=self.data_version)
+        digest = hashlib.sha1(f'{key}:{self.request.accepted_renderer.format}'.encode()).hexdigest()
+        return f'"{self.data_version}-{digest[:20]}"'
+
+    def get_not_modified_response(self) -> Optional[HttpResponseBase]:
+        """Get `304 Not Modified` response when `If-None-Match` has the current entity tag."""
+        return get_conditional_response(self.request, etag=self.get_etag())
+
+    def set_http_cache_headers(self, response: HttpResponseBase) -> HttpResponseBase:
+        """Let HTTP caches store successful responses for `METRICS_HTTP_CACHE_MAX_AGE` seconds
+        and revalidate them by the entity tag.
+
+        """
+        if response.status_code not in (HTTP_200_OK, HTTP_304_NOT_MODIFIED):
+            return response
+
+        response['ETag'] = self.get_etag()
+        max_age = getattr(settings, 'METRICS_HTTP_CACHE_MAX_AGE', DEFAULT_HTTP_CACHE_MAX_AGE)
+        if max_age is not None:
+            patch_cache_control(response, public=True, max_age=max_age)
+        return response
+
+    def get_cached_response(self) -> Tuple[Optional[str], Optional[Response]]:
+        """Get the cache key of the request and the cached response, None when not cached."""
+        if not self.response_cache.enabled:
+            return None, None
+
+        # Columnar response data has another structure
+        namespace = 'columnar' if self.is_columnar else 'response'
+        with self.phase('cache'):
+            cache_key = self.response_cache.get_key(self.request, namespace, data_version=self.data_version)
+            data = self.response_cache.get(cache_key)
+        return cache_key, Response(data) if data is not None else None
+
+    def cache_response(self, cache_key: Optional[str], response: Response):
+        if cache_key is not None and response.status_code == HTTP_200_OK:
+            self.response_cache.set(cache_key, response.data)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request, *args, **kwargs):
+        """Aggregate the data filtered once by several `group_by` and `display_columns` specs.
+
+        All specs are computed with a single scan of the filtered data.
+
+        """
+        serializer = MetricBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        filterset = MetricFilter(
+            data=self.get_filter_data(serializer.validated_data['filters']),
+            queryset=self.get_queryset(),
+            request=request,
+        )
+        if not filterset.is_valid():
+            raise ValidationError({'filters': filterset.errors})
+
         try:
-            queryset = self.filter_queryset(self.get_queryset())
+            results = self.get_batch_results(filterset.qs, serializer.validated_data['queries'])
         except AggregationError as error:
+            return self.get_aggregation_error_response(error)
+        return Response({'results': results})
+
+    @staticmethod
+    def get_filter_data(filters: dict) -> QueryDict:
+        data = QueryDict(mutable=True)
+        for name, value in filters.items():
+            data.setlist(name, [str(item) for item in value] if isinstance(value, list) else [str(value)])
+        return data
+
+    def get_batch_results(self, queryset, queries: List[dict]) -> List[List[dict]]:
+        grouping_sets = [tuple(query['group_by']) for query in queries]
+        display_columns = list(dict.fromkeys(
+            column for query in queries for column in query['display_columns']
+        ))
+        grouped_rows = self.aggregator.aggregate_grouping_sets(queryset, grouping_sets, display_columns)
+
+        results = []
+        for query, grouping_set in zip(queries, grouping_sets):
+            columns = self.aggregator.get_columns(query['group_by'], query['display_columns'])
+            rows = AggregationResult([
+                {column: row[column] for column in columns} for row in grouped_rows[grouping_set]
+            ])
+            ordering = query.get('ordering', [])
+            unknown_columns = [field for field in ordering if field.lstrip('-') not in columns]
+            if unknown_columns:
+                raise AggregationError(f'Ordering by not selected columns: {", ".join(unknown_columns)}')
+            if ordering:
+                rows = rows.order_by(*ordering)
+            results.append(list(rows)[:query.get('limit')])
+        return results
+
+    @action(detail=False, url_path='cache-stats')
+    def cache_stats(self, request, *args, **kwargs):
+        """Show response cache hit and miss counters."""
+        return Response(self.response_cache.get_stats())
+
+    @action(detail=False, methods=['post'], permission_classes=(IsAuthenticated, ))
+    def ingest(self, request, *args, **kwargs):
+        """Load CSV or NDJSON rows of the request body by batches read from the body stream.
+
+        Rows replace the stored rows with the same date, channel, country and os,
+        so sending the same data again does not duplicate it. Batches are committed
+        as they are loaded, the rows of a failed request may be sent again.
+
+        """
+        read_batches = INGEST_READERS.get(request.content_type.split(';')[0].strip())
+        if read_batches is None:
+            raise UnsupportedMediaType(request.content_type)
+
+        loader = MetricLoader(upsert=True)
+        stream = request.stream
+        try:
+            progress = loader.load(read_batches(stream, INGEST_BATCH_SIZE) if stream is not None else [])
+        except LoadError as error:
             return Response(
-                data={'error': f'Aggregation error: {error}'},
+                data={'error': f'Load error: {error}', 'rows': loader.progress.rows},
                 status=HTTP_400_BAD_REQUEST,
             )
+        return Response({
+            'rows': progress.rows,
+            'seconds': round(progress.seconds, 3),
+            'rows_per_second': round(progress.rows_per_second),
+        })
+
+    @action(detail=False, methods=['post'])
+    def jobs(self, request, *args, **kwargs):
+        """Submit the list or aggregation of the query parameters as a background job.
+
+        The query parameters are the same as for the list. The job of the same parameters
+        is returned while it is queued or running, or when it is done and the data did not change.
+
+        """
+        filterset = MetricFilter(data=request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        if self.is_aggregation:
+            self.get_top()
+            self.get_comparison()
+
+        try:
+            job, _ = submit_job(request.query_params, type(self).get_job_rows, ignored_params=JOB_RESULT_PARAMS)
+        except JobQueueFull as error:
+            return Response(data={'error': f'Job queue is full: {error}'}, status=HTTP_503_SERVICE_UNAVAILABLE)
+
+        data = self.get_job_data(job)
+        return Response(data, status=HTTP_202_ACCEPTED, headers={'Location': data['url']})
+
+    @action(detail=False, url_path=r'jobs/(?P<job_id>[^/.]+)')
+    def job(self, request, job_id, *args, **kwargs):
+        """Show the status of a job."""
+        return Response(self.get_job_data(self.get_job(job_id)))
+
+    @action(detail=False, url_path=r'jobs/(?P<job_id>[^/.]+)/results')
+    def job_results(self, request, job_id, *args, **kwargs):
+        """Page through the rows of a done job with `limit` and `offset`."""
+        job = self.get_job(job_id)
+        if job.status != MetricQueryJob.Status.DONE:
+            return Response(
+                data={'error': f'Job is {job.status}', **self.get_job_data(job)},
+                status=HTTP_409_CONFLICT,
+            )
+
+        rows = JobRows(job)
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        if page is None:
+            return Response(list(rows))
+        return paginator.get_paginated_response(page)
+
+    @staticmethod
+    def get_job(job_id: str) -> MetricQueryJob:
+        try:
+            return MetricQueryJob.objects.get(pk=uuid.UUID(job_id))
+        except (ValueError, MetricQueryJob.DoesNotExist):
+            raise NotFound('Job not found')
+
+    def get_job_data(self, job: MetricQueryJob) -> dict:
+        kwargs = {'job_id': str(job.pk)}
+        done = job.status == MetricQueryJob.Status.DONE
+        return {
+            'id': str(job.pk),
+            'status': job.status,
+            'error': job.error or None,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'url': reverse('metric-job', kwargs=kwargs, request=self.request),
+            'results': reverse('metric-job-results', kwargs=kwargs, request=self.request) if done else None,
+        }
+
+    @classmethod
+    def get_job_rows(cls, query_string: str) -> Iterator[dict]:
+        """Iterate over all rows of the list or aggregation requested by the query string of a job.
+
+        Runs on a job pool thread, reads go to the replicas like the list reads.
+        Filtered rows are read from a server-side cursor and serialized by chunks.
+
+        """
+        django_request = HttpRequest()
+        django_request.method = 'GET'
+        django_request.GET = QueryDict(query_string)
+
+        self = cls()
+        self.action_map = {'get': 'list'}
+        self.args, self.kwargs, self.format_kwarg = (), {}, None
+        self.request = self.initialize_request(django_request)
+        with replica_reads():
+            queryset = self.get_list_queryset()
+            if self.is_aggregation:
+                yield from self.serialize_data(list(queryset))
+                return
+            rows = queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+            chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+            while chunk:
+                yield from self.serialize_data(chunk)
+                chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+
+    def get_list_response(self) -> Response:
+        try:
+            queryset = self.get_list_queryset()
+        except AggregationError as error:
+            return self.get_aggregation_error_response(error)
+
+        with self.phase('paginate'):
+            page = self.paginate_queryset(queryset)
+        return self.get_page_response(queryset, page)
 
-        page = self.paginate_queryset(queryset)
-        if page:
-            data = self.serialize_data(page)
-            return self.get_paginated_response(data)
+    def get_list_queryset(self):
+        """Get filtered rows or aggregation results to paginate.
 
-        data = self.serialize_data(queryset)
+        Aggregated rows are selected as named tuples for the columnar format.
+
+        """
+        with self.phase('filter'):
+            queryset = self.filter_queryset(self.get_queryset())
+        if not self.is_aggregation:
+            queryset = self.row_serializer.get_rows(queryset)
+            self.columns = list(self.row_serializer.fields)
+        elif self.is_columnar:
+            self.columns = self.get_aggregated_columns(queryset)
+            if isinstance(queryset, QuerySet):
+                queryset = queryset.values_list(*self.columns, named=True)
+        return queryset
+
+    def get_aggregated_columns(self, queryset) -> List[str]:
+        """Get names of the aggregated row columns in their order."""
+        if isinstance(queryset, QuerySet):
+            return get_selected_columns(queryset)
+        if queryset:
+            return list(queryset[0])
+
+        columns = self.aggregator.get_columns(self.get_group_by_columns(), self.get_display_columns())
+        return [*columns, GROUPING] if self.get_totals() else columns
+
+    def get_page_response(self, queryset, page: Optional[list]) -> Response:
+        with self.phase('serialize'):
+            if page is not None:
+                data = self.serialize_data(page)
+                return self.get_paginated_response(data)
+
+            data = self.serialize_data(list(queryset))
         return Response(data)
 
+    @staticmethod
+    def get_aggregation_error_response(error: AggregationError) -> Response:
+        return Response(
+            data={'error': f'Aggregation error: {error}'},
+            status=HTTP_400_BAD_REQUEST,
+        )
+
+    def get_export_response(self):
+        """Stream all rows from a server-side cursor in the requested export format."""
+        try:
+            queryset = self.filter_queryset(self.get_queryset())
+        except AggregationError as error:
+            return self.get_aggregation_error_response(error)
+
+        if self.is_aggregation:
+            columns = self.get_aggregated_columns(queryset)
+            rows = (
+                [row[column] for column in columns]
+                for row in queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+            )
+        else:
+            columns = list(self.get_serializer_class().Meta.fields)
+            rows = queryset.values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        renderer = self.request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.iter_render(columns, rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="metrics.{renderer.format}"'
+        return response
+
+    def get_paginated_response(self, data):
+        """Put `columns` and `data` of the columnar format next to the pagination fields."""
+        response = super().get_paginated_response(data)
+        if self.is_columnar:
+            response.data.update(response.data.pop('results'))
+        return response
+
     def serialize_data(self, queryset):
-        """Serialize data for response."""
+        """Serialize data for response.
+
+        Raw rows selected by `MetricRowSerializer.get_rows` serialized without model instances.
+        The columnar format lists the column names once and the rows as arrays of values.
+
+        """
+        if self.is_columnar:
+            return {'columns': self.columns, 'data': self.serialize_values(queryset)}
         if self.is_aggregation:
             return queryset
 
-        serializer = self.get_serializer(queryset, many=True)
-        return serializer.data
+        return self.row_serializer.serialize(queryset)
+
+    def serialize_values(self, queryset) -> list:
+        if not self.is_aggregation:
+            return self.row_serializer.serialize_values(queryset)
+        if isinstance(queryset, AggregationResult) or queryset and isinstance(queryset[0], dict):
+            return [[row[column] for column in self.columns] for row in queryset]
+        # Plain tuples of named tuples are cached without their classes
+        return [tuple(row) for row in queryset]
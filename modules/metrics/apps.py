@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MetricsConfig(AppConfig):
     name = 'modules.metrics'
+
+    def ready(self):
+        from . import signals  # noqa: F401
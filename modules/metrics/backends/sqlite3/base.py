@@ -0,0 +1,12 @@
+"""
+SQLite backend routing `Metric` queries to monthly partition tables.
+"""
+from django.db.backends.sqlite3 import base, operations
+
+
+class DatabaseOperations(operations.DatabaseOperations):
+    compiler_module = 'modules.metrics.backends.sqlite3.compiler'
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    ops_class = DatabaseOperations
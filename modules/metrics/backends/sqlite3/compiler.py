@@ -0,0 +1,416 @@
+"""
+Compilers routing `Metric` queries to the partition tables.
+
+SELECT queries read `metrics_metric` and the partitions overlapping the date filters
+combined by `UNION ALL`, every table selects the referenced columns filtered by the WHERE clause.
+Rows are selected by a compound `UNION ALL` ordered as a whole, OFFSET pages ordered by `date`
+skip the tables before them. UPDATE and DELETE queries are executed on the same tables.
+Inserted rows go to the partitions of their months or to `metrics_metric`, ids are reserved
+in the `metrics_metric` sequence to stay unique across the tables.
+Rows which `date` changed by UPDATE are moved to the tables of their new months.
+Queries of other models and queries when there are no partitions are compiled as usual.
+"""
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+from django.core.exceptions import EmptyResultSet
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.expressions import Col, RawSQL, Star
+from django.db.models.sql import compiler
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE, MULTI
+from django.db.models.sql.query import Query
+from django.db.models.sql.subqueries import InsertQuery
+from django.db.models.sql.where import ExtraWhere, WhereNode
+
+from ...partitions import (
+    PARTITIONED_TABLE,
+    SQLitePartitionBackend,
+    get_date_bounds,
+    get_month,
+    select_partitions,
+)
+
+
+def is_table_rows(query) -> bool:
+    """Check rows of the query are filtered rows of the table, so they can be counted per table."""
+    return query.group_by is None and not (query.distinct or query.is_sliced or query.combinator)
+
+
+def is_row_query(query) -> bool:
+    return is_table_rows(query) and not any(
+        annotation.contains_aggregate for annotation in query.annotation_select.values()
+    )
+
+
+def is_plain_rows(query) -> bool:
+    """Check the query selects rows of the table, optionally ordered and sliced."""
+    return query.group_by is None and not (query.distinct or query.combinator or query.extra) and not any(
+        annotation.contains_aggregate for annotation in query.annotation_select.values()
+    )
+
+
+def is_count_all(query) -> bool:
+    """Check the query selects only `COUNT(*)`."""
+    annotations = list(query.annotation_select.values())
+    return (
+        len(annotations) == 1
+        and isinstance(annotations[0], Count)
+        and isinstance(annotations[0].get_source_expressions()[0], Star)
+        and not annotations[0].distinct
+        and annotations[0].filter is None
+    )
+
+
+def is_row_count(query) -> bool:
+    """Check the query selects only `COUNT(*)` of the filtered rows."""
+    return is_count_all(query) and not query.select and not query.default_cols and is_table_rows(query)
+
+
+def get_page_tables(table_counts: List[Tuple[str, int]], low_mark: int,
+                    high_mark: Optional[int]) -> Tuple[List[str], int, Optional[int]]:
+    """Get tables holding the rows from `low_mark` to `high_mark` of the tables in order.
+
+    Return the tables and the bounds in their rows, the rows of the tables before are skipped.
+
+    """
+    tables, skipped, start = [], 0, 0
+    for table, count in table_counts:
+        end = start + count
+        if end > low_mark and (high_mark is None or start < high_mark):
+            tables.append(table)
+        elif not tables:
+            skipped += count
+        start = end
+    return tables, low_mark - skipped, None if high_mark is None else high_mark - skipped
+
+
+class RowCount:
+    """Total row count of a statement executed on several tables, used like a cursor."""
+
+    def __init__(self, rowcount: int):
+        self.rowcount = rowcount
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+
+class PartitionRoutingMixin:
+
+    def get_partitions(self) -> dict:
+        model = self.query.model
+        if model is None or model._meta.db_table != PARTITIONED_TABLE:
+            return {}
+        return SQLitePartitionBackend(self.connection).get_partitions()
+
+    def get_partition_tables(self) -> Optional[List[str]]:
+        """Get partition tables matching the date filters, None when the query is not routed."""
+        partitions = self.get_partitions()
+        if not partitions:
+            return None
+        # `base_table` is cached, it is not read before the query has its aliases
+        alias = next(iter(self.query.alias_map), PARTITIONED_TABLE)
+        return select_partitions(partitions, *get_date_bounds(self.query.where, alias))
+
+    def relabel(self, sql: str, table: str) -> str:
+        qn = self.connection.ops.quote_name
+        return sql.replace(qn(PARTITIONED_TABLE), qn(table))
+
+    def execute_on_tables(self, tables: List[str]) -> RowCount:
+        sql, params = self.as_sql()
+        rowcount = 0
+        if not sql:
+            return RowCount(rowcount)
+        with self.connection.cursor() as cursor:
+            for table in (PARTITIONED_TABLE, *tables):
+                cursor.execute(self.relabel(sql, table), params)
+                rowcount += cursor.rowcount
+        return RowCount(rowcount)
+
+
+class SQLCompiler(PartitionRoutingMixin, compiler.SQLCompiler):
+    route_partitions = True
+    # Tables of an OFFSET page and the bounds in their rows, see `get_page_slice`
+    page_slice = None
+
+    def execute_sql(self, result_type=MULTI, chunked_fetch=False, chunk_size=GET_ITERATOR_CHUNK_SIZE):
+        self.page_slice = self.get_page_slice() if self.route_partitions and self.query.low_mark else None
+        try:
+            return super().execute_sql(result_type, chunked_fetch, chunk_size)
+        finally:
+            self.page_slice = None
+
+    def get_page_slice(self) -> Optional[Tuple[List[str], int, Optional[int]]]:
+        """Get the tables of an OFFSET page of rows ordered by `date` and the bounds in their rows.
+
+        Partitions hold rows of their months, so the pages skip the rows of whole tables before them
+        by the row counts of the tables instead of reading them. None when the query is not such a page
+        or `metrics_metric` has matching rows of months without a partition.
+
+        """
+        if not is_plain_rows(self.query):
+            return None
+        tables = self.get_partition_tables()
+        if not tables:
+            return None
+        _, order_by, _ = self.pre_sql_setup()
+        first = order_by[0][0] if order_by else None
+        if not (
+            first is not None
+            and isinstance(first.expression, Col)
+            and first.expression.alias == self.query.base_table
+            and first.expression.target.name == 'date'
+        ):
+            return None
+        where = self.get_table_where()
+        if where is None:
+            return None
+
+        qn, (where_sql, where_params) = self.connection.ops.quote_name, where
+        alias_sql = self.quote_name_unless_alias(self.query.base_table)
+        counts_sql = ', '.join(
+            f'(SELECT COUNT(*) FROM {qn(table)} {alias_sql}{where_sql})' for table in (PARTITIONED_TABLE, *tables)
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT {counts_sql}', where_params * (len(tables) + 1))
+            unpartitioned_count, *counts = cursor.fetchone()
+        if unpartitioned_count:
+            return None
+        table_counts = list(zip(tables, counts))
+        if first.descending:
+            table_counts.reverse()
+        return get_page_tables(table_counts, self.query.low_mark, self.query.high_mark)
+
+    def as_sql(self, with_limits=True, with_col_aliases=False):
+        """Select rows by a compound `UNION ALL` and sum counts of the tables instead of counting
+        rows of their union.
+
+        SQLite counts rows of a table by its smallest index but reads every row of a `UNION ALL`.
+
+        """
+        if self.route_partitions and is_plain_rows(self.query) and not is_row_count(self.query):
+            tables = self.get_partition_tables()
+            if tables is not None:
+                union = self.get_rows_union_sql(tables, with_limits, with_col_aliases)
+                if union is not None:
+                    return union
+
+        tables = self.get_partition_tables() if self.route_partitions and is_row_count(self.query) else None
+        if tables is None:
+            return super().as_sql(with_limits, with_col_aliases)
+
+        self.route_partitions = False
+        sql, params = super().as_sql(with_limits, with_col_aliases)
+        alias = self.connection.ops.quote_name(next(iter(self.query.annotation_select)))
+        counts = ' UNION ALL '.join(self.relabel(sql, table) for table in (PARTITIONED_TABLE, *tables))
+        return f'SELECT SUM({alias}) FROM ({counts}) table_counts', params * (len(tables) + 1)
+
+    def get_rows_union_sql(self, tables: List[str], with_limits: bool, with_col_aliases: bool) -> Optional[tuple]:
+        """Select rows of every table by a compound `UNION ALL` ordered and sliced as a whole.
+
+        SQLite merges the tables read in the order of their indexes instead of sorting
+        all rows of a union subquery, so deep pages do not sort the whole table.
+        None when the ordering is not by the selected columns.
+
+        """
+        query = self.query.clone()
+        query.clear_ordering(force_empty=True)
+        query.clear_limits()
+        table_compiler = query.get_compiler(using=self.using, connection=self.connection)
+        table_compiler.route_partitions = False
+        sql, params = table_compiler.as_sql(with_col_aliases=with_col_aliases)
+
+        # Positions of the ordering in the selected columns, the compound ORDER BY refers to them
+        _, order_by, _ = self.pre_sql_setup()
+        selected = [expression for expression, _, _ in table_compiler.select]
+        aliases = [alias for _, _, alias in table_compiler.select]
+        ordering = []
+        for order, (_, _, is_ref) in order_by:
+            source = order.expression
+            if order.nulls_first or order.nulls_last:
+                return None
+            if is_ref and source.refs in aliases:
+                position = aliases.index(source.refs)
+            elif source in selected:
+                position = selected.index(source)
+            else:
+                return None
+            ordering.append(f'{position + 1} {"DESC" if order.descending else "ASC"}')
+
+        tables, low_mark, high_mark = [PARTITIONED_TABLE, *tables], self.query.low_mark, self.query.high_mark
+        if with_limits and self.page_slice is not None:
+            page_tables, low_mark, high_mark = self.page_slice
+            tables = page_tables or [PARTITIONED_TABLE]
+        union = ' UNION ALL '.join(self.relabel(sql, table) for table in tables)
+        if ordering:
+            union += f' ORDER BY {", ".join(ordering)}'
+        if with_limits and (high_mark is not None or low_mark):
+            union += f' {self.connection.ops.limit_offset_sql(low_mark, high_mark)}'
+        return union, tuple(params) * len(tables)
+
+    def pre_sql_setup(self):
+        extra_select, order_by, group_by = super().pre_sql_setup()
+        self.order_by_expressions = [expression for expression, _ in order_by]
+        return extra_select, order_by, group_by
+
+    def get_from_clause(self):
+        """Replace `metrics_metric` by `UNION ALL` of the tables matching the date filters.
+
+        Every table selects only the referenced columns and applies the WHERE clause of the query,
+        so the tables are searched and covered by their own indexes.
+
+        """
+        result, params = super().get_from_clause()
+        tables = self.get_partition_tables() if self.route_partitions else None
+        if tables is None:
+            return result, params
+
+        qn = self.connection.ops.quote_name
+        columns = self.get_referenced_columns() or [field.column for field in self.query.model._meta.concrete_fields]
+        columns_sql = ', '.join(qn(column) for column in columns)
+        where_sql, where_params = self.get_table_where() or ('', [])
+        table_sql = qn(PARTITIONED_TABLE)
+        for index, clause in enumerate(result):
+            if clause == table_sql or clause.startswith(f'{table_sql} '):
+                alias_sql = clause[len(table_sql):] or f' {table_sql}'
+                union = ' UNION ALL '.join(
+                    f'SELECT {columns_sql} FROM {qn(table)}{alias_sql}{where_sql}'
+                    for table in (PARTITIONED_TABLE, *tables)
+                )
+                result[index] = f'({union}){alias_sql}'
+                return result, [*where_params * (len(tables) + 1), *params]
+        return result, params
+
+    def get_referenced_columns(self) -> Optional[List[str]]:
+        """Get columns of the table referenced by the query in the model order.
+
+        None when the query may reference columns not resolved to `Col`, e.g. by raw SQL or subqueries.
+
+        """
+        alias, columns = self.query.base_table, set()
+        expressions = [
+            *(expression for expression, _, _ in self.select),
+            *self.order_by_expressions,
+            self.where,
+            self.having,
+        ]
+        while expressions:
+            expression = expressions.pop()
+            if expression is None:
+                continue
+            if isinstance(expression, Col):
+                if expression.alias != alias:
+                    return None
+                columns.add(expression.target.column)
+            elif isinstance(expression, WhereNode):
+                expressions.extend(expression.children)
+            elif isinstance(expression, (Query, RawSQL, ExtraWhere)):
+                return None
+            elif not hasattr(expression, 'get_source_expressions'):
+                return None
+            else:
+                expressions.extend(expression.get_source_expressions())
+        return [field.column for field in self.query.model._meta.concrete_fields if field.column in columns]
+
+    def get_table_where(self) -> Optional[Tuple[str, list]]:
+        """Get WHERE clause of the query applied to every table.
+
+        None when it references other tables or matches nothing, the outer query still applies it.
+
+        """
+        if len([alias for alias, count in self.query.alias_refcount.items() if count]) > 1:
+            return None
+        if self.where is None:
+            return '', []
+        try:
+            sql, params = self.compile(self.where)
+        except EmptyResultSet:
+            return None
+        return (f' WHERE {sql}', list(params)) if sql else ('', [])
+
+
+class SQLInsertCompiler(PartitionRoutingMixin, compiler.SQLInsertCompiler):
+
+    def execute_sql(self, returning_fields=None):
+        partitions = self.get_partitions()
+        if not partitions or self.query.raw:
+            return super().execute_sql(returning_fields)
+
+        date_field = self.query.get_meta().get_field('date')
+        objs_by_table = defaultdict(list)
+        for obj in self.query.objs:
+            month = get_month(date_field.to_python(getattr(obj, date_field.attname)))
+            objs_by_table[partitions.get(month, PARTITIONED_TABLE)].append(obj)
+        if list(objs_by_table) == [PARTITIONED_TABLE]:
+            return super().execute_sql(returning_fields)
+
+        pk, fields = self.query.get_meta().pk, self.query.fields
+        with transaction.atomic(using=self.using, savepoint=False):
+            if pk not in fields:
+                pk_values = SQLitePartitionBackend(self.connection).reserve_ids(len(self.query.objs))
+                for obj, pk_value in zip(self.query.objs, pk_values):
+                    setattr(obj, pk.attname, pk_value)
+                fields = [pk, *fields]
+
+            with self.connection.cursor() as cursor:
+                for table, objs in objs_by_table.items():
+                    query = InsertQuery(self.query.model, ignore_conflicts=self.query.ignore_conflicts)
+                    query.insert_values(fields, objs)
+                    for sql, params in compiler.SQLInsertCompiler(query, self.connection, self.using).as_sql():
+                        cursor.execute(self.relabel(sql, table), params)
+
+        if not returning_fields:
+            return []
+        return [tuple(getattr(self.query.objs[0], field.attname) for field in returning_fields)]
+
+
+class SQLDeleteCompiler(PartitionRoutingMixin, compiler.SQLDeleteCompiler):
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        tables = self.get_partition_tables()
+        if tables is None:
+            return super().execute_sql(result_type, *args, **kwargs)
+        return self.execute_on_tables(tables)
+
+
+class SQLUpdateCompiler(PartitionRoutingMixin, compiler.SQLUpdateCompiler):
+
+    def execute_sql(self, result_type):
+        tables = self.get_partition_tables()
+        if tables is None:
+            return super().execute_sql(result_type)
+        if not any(field.name == 'date' for field, _, _ in self.query.values):
+            return self.execute_on_tables(tables).rowcount
+
+        with transaction.atomic(using=self.using, savepoint=False):
+            rowcount = self.execute_on_tables(tables).rowcount
+            SQLitePartitionBackend(self.connection).move_misplaced_rows((PARTITIONED_TABLE, *tables))
+        return rowcount
+
+
+class SQLAggregateCompiler(compiler.SQLAggregateCompiler):
+
+    def as_sql(self):
+        """Sum counts of the tables when counting rows of a not grouped subquery."""
+        inner_query = self.query.inner_query
+        inner_compiler = inner_query.get_compiler(self.using)
+        if not (is_count_all(self.query) and is_row_query(inner_query) and isinstance(inner_compiler, SQLCompiler)):
+            return super().as_sql()
+        tables = inner_compiler.get_partition_tables()
+        if tables is None:
+            return super().as_sql()
+
+        self.col_count = 1
+        inner_compiler.route_partitions = False
+        inner_sql, inner_params = inner_compiler.as_sql(with_col_aliases=True)
+        counts = ' UNION ALL '.join(
+            f'SELECT COUNT(*) AS table_count FROM ({inner_compiler.relabel(inner_sql, table)}) subquery'
+            for table in (PARTITIONED_TABLE, *tables)
+        )
+        return f'SELECT SUM(table_count) FROM ({counts}) table_counts', inner_params * (len(tables) + 1)
@@ -0,0 +1,239 @@
+"""
+Benchmarks of the metrics API on the loaded data.
+"""
+import asyncio
+import platform
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import cycle, islice
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIRequestFactory
+
+from .api.views import MetricViewSet
+from .loaders import MetricLoader
+from .models import Metric
+from .synthetic import SyntheticMetricGenerator
+from .use_cases import README_USE_CASES
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    timings: List[float] = field(default_factory=list)
+    rows: Optional[int] = None
+
+    @property
+    def best_ms(self) -> float:
+        return min(self.timings) * 1000
+
+    @property
+    def median_ms(self) -> float:
+        return statistics.median(self.timings) * 1000
+
+    def to_dict(self) -> dict:
+        data = {'best_ms': self.best_ms, 'median_ms': self.median_ms, 'runs': len(self.timings)}
+        if self.rows is not None:
+            data['rows_per_second'] = self.rows / min(self.timings)
+        return data
+
+
+@dataclass
+class Comparison:
+    name: str
+    best_ms: float
+    baseline_ms: float
+
+    @property
+    def ratio(self) -> float:
+        return self.best_ms / self.baseline_ms if self.baseline_ms else float('inf')
+
+
+class MetricBenchmark:
+    """Time README use-cases, raw list paging and ingestion.
+
+    API requests are handled by `MetricViewSet` with the response cache disabled
+    and rendered to JSON, so timings include filtering, aggregation, pagination and rendering.
+    Ingestion loads synthetic rows in a transaction rolled back after every run.
+
+    """
+
+    def __init__(self, sample: TextIO, repeat: int = 5, ingestion_rows: int = 10000):
+        self.repeat = repeat
+        self.ingestion_rows = ingestion_rows
+        self.generator = SyntheticMetricGenerator(sample)
+        self.factory = APIRequestFactory()
+        self.view = MetricViewSet.as_view({'get': 'list'})
+
+    def get_benchmarks(self) -> Dict[str, Callable[[], None]]:
+        benchmarks = {
+            f'use_case:{use_case["name"]}': self._get_request(use_case['params'])
+            for use_case in README_USE_CASES
+        }
+        last_page_offset = max(Metric.objects.count() - 100, 0)
+        benchmarks.update({
+            'raw_list:first_page': self._get_request({'limit': 100}),
+            'raw_list:last_page': self._get_request({'limit': 100, 'offset': last_page_offset}),
+            'raw_list:cursor_next_page': self._get_cursor_next_page_request({'limit': 100}),
+            'ingestion': self._ingest,
+        })
+        return benchmarks
+
+    def run(self, names: Iterable[str] = ()) -> List[BenchmarkResult]:
+        """Run benchmarks which names start with any of `names`, all when empty."""
+        names = tuple(names)
+        results = []
+        with override_settings(METRICS_RESPONSE_CACHE=None):
+            for name, func in self.get_benchmarks().items():
+                if names and not name.startswith(names):
+                    continue
+                result = BenchmarkResult(name, rows=self.ingestion_rows if name == 'ingestion' else None)
+                func()  # warm up
+                for _ in range(self.repeat):
+                    started_at = time.perf_counter()
+                    func()
+                    result.timings.append(time.perf_counter() - started_at)
+                results.append(result)
+        return results
+
+    def get_report(self, results: List[BenchmarkResult]) -> dict:
+        return {
+            'environment': {
+                'vendor': connection.vendor,
+                'rows': Metric.objects.count(),
+                'aggregator': getattr(settings, 'METRICS_AGGREGATOR', None),
+                'python': platform.python_version(),
+            },
+            'benchmarks': {result.name: result.to_dict() for result in results},
+        }
+
+    @staticmethod
+    def compare(report: dict, baseline: dict) -> List[Comparison]:
+        """Compare best timings of benchmarks present in both reports."""
+        return [
+            Comparison(name, data['best_ms'], baseline['benchmarks'][name]['best_ms'])
+            for name, data in report['benchmarks'].items()
+            if name in baseline['benchmarks']
+        ]
+
+    def _get_request(self, params: dict) -> Callable[[], None]:
+        def request():
+            response = self.view(self.factory.get('/metrics/', params, format='json'))
+            response.render()
+            if response.status_code != 200:
+                raise ValueError(f'Benchmark request failed with {response.status_code}: {params}')
+        return request
+
+    def _get_cursor_next_page_request(self, params: dict) -> Callable[[], None]:
+        response = self.view(self.factory.get('/metrics/', dict(params, pagination='cursor')))
+        next_link = response.data['next']
+        if next_link is None:
+            return self._get_request(dict(params, pagination='cursor'))
+
+        def request():
+            next_response = self.view(self.factory.get(next_link))
+            next_response.render()
+            if next_response.status_code != 200:
+                raise ValueError(f'Benchmark request failed with {next_response.status_code}: {next_link}')
+        return request
+
+    def _ingest(self):
+        # Rows of the days after the loaded data, the dimensions of a day are unique
+        last_date = Metric.objects.aggregate(last_date=Max('date'))['last_date']
+        self.generator.start_date = last_date + timedelta(days=1) if last_date else self.generator.start_date
+        with transaction.atomic():
+            MetricLoader().load(self.generator.iter_batches(self.ingestion_rows))
+            transaction.set_rollback(True)
+
+
+@dataclass
+class LoadTestResult:
+    interface: str
+    duration: float
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+
+    @property
+    def requests_per_second(self) -> float:
+        return len(self.latencies) / self.duration
+
+    def get_latency_ms(self, percentile: int) -> float:
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) * percentile // 100, len(latencies) - 1)] * 1000
+
+
+class MetricLoadTest:
+    """Compare the WSGI and the ASGI metrics API under concurrent requests.
+
+    Requests cycle through README use-cases and the raw list first page with the response cache
+    disabled. WSGI requests to `MetricViewSet` are sent by `concurrency` threads like the workers
+    of a threaded WSGI server. ASGI requests to `AsyncMetricViewSet` are awaited on one event loop,
+    at most `concurrency` at a time, their queries run on the `METRICS_ASYNC_DB_WORKERS` pool.
+
+    """
+    interfaces = ('wsgi', 'asgi')
+
+    def __init__(self, concurrency: int = 8, requests: int = 200):
+        self.concurrency = concurrency
+        self.requests = requests
+        params_list = [use_case['params'] for use_case in README_USE_CASES] + [{'limit': 100}]
+        self.query_strings = list(islice(cycle(urlencode(params) for params in params_list), requests))
+
+    def run(self, interfaces: Iterable[str] = interfaces) -> List[LoadTestResult]:
+        with override_settings(METRICS_RESPONSE_CACHE=None):
+            return [getattr(self, f'run_{interface}')() for interface in interfaces]
+
+    def run_wsgi(self) -> LoadTestResult:
+        url = reverse('metric-list')
+        clients = {}
+
+        def request(query_string: str):
+            # The test client is not thread-safe, every worker thread has its own
+            client = clients.setdefault(threading.get_ident(), Client())
+            started_at = time.perf_counter()
+            response = client.get(f'{url}?{query_string}')
+            return response.status_code, time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            responses = list(executor.map(request, self.query_strings))
+        return self._get_result('wsgi', time.perf_counter() - started_at, responses)
+
+    def run_asgi(self) -> LoadTestResult:
+        url = reverse('metric-list-async')
+
+        async def run_requests():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def request(query_string: str):
+                async with semaphore:
+                    started_at = time.perf_counter()
+                    response = await client.get(f'{url}?{query_string}')
+                    return response.status_code, time.perf_counter() - started_at
+
+            return await asyncio.gather(*(request(query_string) for query_string in self.query_strings))
+
+        started_at = time.perf_counter()
+        responses = asyncio.run(run_requests())
+        return self._get_result('asgi', time.perf_counter() - started_at, responses)
+
+    @staticmethod
+    def _get_result(interface: str, duration: float, responses) -> LoadTestResult:
+        result = LoadTestResult(interface, duration)
+        for status_code, latency in responses:
+            result.latencies.append(latency)
+            if status_code != 200:
+                result.errors += 1
+        return result
@@ -1,2 +1,10 @@
 class AggregationError(Exception):
     """Error occurred during aggregation."""
+
+
+class LoadError(Exception):
+    """Error occurred during data loading."""
+
+
+class PartitionError(Exception):
+    """Error occurred during partition management."""
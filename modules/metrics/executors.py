@@ -0,0 +1,44 @@
+"""
+Thread pool running database work of the async views.
+
+Django database connections are per thread, so every pool thread keeps its own connections.
+They are closed after each call like after a request, following `CONN_MAX_AGE`.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_DB_WORKERS = 8
+
+_executors: Dict[int, ThreadPoolExecutor] = {}
+
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Get the thread pool sized by `METRICS_ASYNC_DB_WORKERS` setting."""
+    workers = getattr(settings, 'METRICS_ASYNC_DB_WORKERS', DEFAULT_DB_WORKERS)
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metrics-db')
+    return _executors[workers]
+
+
+def call_with_connections(func: Callable, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_db_thread(func: Callable, *args, **kwargs):
+    """Run a function doing database queries on the pool without blocking the event loop."""
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_db_executor(),
+        partial(context.run, call_with_connections, func, *args, **kwargs),
+    )
@@ -0,0 +1,189 @@
+from typing import Optional, Union
+
+from django.conf import settings
+from django.core import exceptions
+from django.db import models
+from django.db.models import F, OrderBy, Transform
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual, LessThan, LessThanOrEqual, Range
+from django.utils.translation import gettext_lazy as _
+
+
+class DimensionField(models.CharField):
+    """Dimension value stored as a small integer code of the `DimensionCode` table.
+
+    Python values are the readable strings: lookups encode them to codes and loaded codes
+    are decoded back, so models, filters and serializers work with the strings.
+    A code is created when a value is saved for the first time, lookups with an unknown value
+    match nothing. Codes do not follow the order of values: range lookups compare the values
+    of the codes and `DimensionQuerySet` orders by them.
+    With `METRICS_DIMENSION_CODES` disabled the values are stored as text.
+
+    """
+    description = _('Dimension value stored as a small integer code')
+
+    def __init__(self, *args, dimension: str, **kwargs):
+        self.dimension = dimension
+        kwargs.setdefault('max_length', 250)
+        super().__init__(*args, **kwargs)
+
+    @property
+    def stores_codes(self) -> bool:
+        return getattr(settings, 'METRICS_DIMENSION_CODES', True)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['dimension'] = self.dimension
+        # Values are validated by the forms and serializers, the storage does not depend on them
+        kwargs.pop('choices', None)
+        if kwargs.get('max_length') == 250:
+            del kwargs['max_length']
+        return name, path, args, kwargs
+
+    def get_internal_type(self) -> str:
+        return 'PositiveSmallIntegerField' if self.stores_codes else 'CharField'
+
+    def encode(self, value, using: Optional[str] = None, create: bool = False) -> int:
+        """Get code of a value, 0 matching no rows for unknown values unless `create` adds it."""
+        from .models import DimensionCode
+
+        return DimensionCode.objects.get_code(self.dimension, str(value), using, create) or 0
+
+    def decode(self, code: Optional[int], using: Optional[str] = None) -> Optional[str]:
+        """Get value of a code, None for the unknown value code 0."""
+        from .models import DimensionCode
+
+        return DimensionCode.objects.get_value(self.dimension, code, using) if code else None
+
+    def from_db_value(self, value, expression, connection):
+        if isinstance(value, int):
+            return self.decode(value, connection.alias if connection else None)
+        return value
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        if not (isinstance(value, int) and self.stores_codes):
+            return str(value)
+        decoded = self.decode(value)
+        if decoded is None:
+            raise exceptions.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return decoded
+
+    def get_prep_value(self, value):
+        if value is None or not self.stores_codes:
+            return super().get_prep_value(value)
+        if isinstance(value, int):
+            return value
+        return self.encode(value)
+
+    def get_db_prep_save(self, value, connection):
+        if value is not None and self.stores_codes and not isinstance(value, int):
+            return self.encode(value, connection.alias, create=True)
+        return super().get_db_prep_save(value, connection)
+
+
+@DimensionField.register_lookup
+class DimensionValue(Transform):
+    """Value of a dimension code selected from `DimensionCode` table, e.g. `channel__value`."""
+    lookup_name = 'value'
+    output_field = models.CharField()
+
+    def as_sql(self, compiler, connection):
+        from .models import DimensionCode
+
+        lhs_sql, params = compiler.compile(self.lhs)
+        if not self.lhs.output_field.stores_codes:
+            return lhs_sql, params
+        qn = connection.ops.quote_name
+        table, pk = DimensionCode._meta.db_table, DimensionCode._meta.pk.column
+        return f'(SELECT {qn("value")} FROM {qn(table)} WHERE {qn(pk)} = {lhs_sql})', params
+
+    def get_group_by_cols(self, alias=None):
+        return self.lhs.get_group_by_cols()
+
+
+class DimensionOrderBy(OrderBy):
+    """Ordering by the values of a dimension stored as codes.
+
+    `ordering` keeps the field name in the `order_by()` syntax, e.g. `-channel`.
+
+    """
+
+    def __init__(self, field_name: str, descending: bool = False, **kwargs):
+        super().__init__(DimensionValue(F(field_name)), descending=descending, **kwargs)
+        self.field_name = field_name
+
+    @property
+    def ordering(self) -> str:
+        return f'-{self.field_name}' if self.descending else self.field_name
+
+
+def get_value_ordering(model, ordering: Union[str, OrderBy], **kwargs) -> Union[str, OrderBy]:
+    """Replace ordering by a dimension stored as codes with `DimensionOrderBy`.
+
+    Other orderings are kept, `kwargs` are `OrderBy` arguments like `nulls_last`.
+
+    """
+    if not isinstance(ordering, str):
+        return ordering
+    name = ordering.lstrip('-')
+    try:
+        field = model._meta.get_field(name)
+    except exceptions.FieldDoesNotExist:
+        return ordering
+    if isinstance(field, DimensionField) and field.stores_codes:
+        return DimensionOrderBy(name, descending=ordering.startswith('-'), **kwargs)
+    return ordering
+
+
+class DimensionValueRangeMixin:
+    """Compare values of the dimension codes selected by their unique index.
+
+    Builds `code IN (SELECT id FROM <codes> WHERE dimension = ... AND value > ...)`,
+    so the condition still uses indexes of the code column.
+
+    """
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        from .models import DimensionCode
+
+        field = self.lhs.output_field
+        if not field.stores_codes:
+            return super().as_sql(compiler, connection)
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        qn = connection.ops.quote_name
+        table, pk = DimensionCode._meta.db_table, DimensionCode._meta.pk.column
+        condition = f'{qn("value")} {self.get_rhs_op(connection, rhs_sql)}'
+        sql = f'{lhs_sql} IN (SELECT {qn(pk)} FROM {qn(table)} WHERE {qn("dimension")} = %s AND {condition})'
+        return sql, (*lhs_params, field.dimension, *rhs_params)
+
+
+@DimensionField.register_lookup
+class DimensionGreaterThan(DimensionValueRangeMixin, GreaterThan):
+    pass
+
+
+@DimensionField.register_lookup
+class DimensionGreaterThanOrEqual(DimensionValueRangeMixin, GreaterThanOrEqual):
+    pass
+
+
+@DimensionField.register_lookup
+class DimensionLessThan(DimensionValueRangeMixin, LessThan):
+    pass
+
+
+@DimensionField.register_lookup
+class DimensionLessThanOrEqual(DimensionValueRangeMixin, LessThanOrEqual):
+    pass
+
+
+@DimensionField.register_lookup
+class DimensionRange(DimensionValueRangeMixin, Range):
+    pass
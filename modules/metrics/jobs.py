@@ -0,0 +1,188 @@
+"""
+Query jobs running heavy metrics API requests in the background.
+
+A job runs a list or aggregation request on a bounded thread pool of the process and stores
+the rows of the result in `MetricQueryJobPage` pages, clients poll the job and page through the rows
+loading only the pages they read.
+Jobs of the same query parameters and data version are deduplicated while they are queued
+or running, a finished job is reused until the data changes or its result expires.
+"""
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import count, islice
+from typing import Callable, Dict, Iterable, Iterator, Tuple, Union
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from .exceptions import AggregationError
+from .executors import call_with_connections
+from .models import MetricQueryJob, MetricQueryJobPage
+from .params import normalize_query_params
+from .versioning import get_data_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_QUEUED_JOBS = 100
+DEFAULT_JOB_TIMEOUT = 3600
+DEFAULT_JOB_RESULT_SECONDS = 86400
+DEFAULT_JOB_PAGE_SIZE = 1000
+
+_executors: Dict[int, ThreadPoolExecutor] = {}
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are waiting for a worker."""
+
+
+class JobRows:
+    """Rows of a done job, slices select only the pages of their rows.
+
+    Supports counting and slicing for `LimitOffsetPagination`, iteration loads the pages in turn.
+
+    """
+
+    def __init__(self, job: MetricQueryJob):
+        self.job = job
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, int):
+            rows = self[item:item + 1 or None]
+            if not rows:
+                raise IndexError('Job row index out of range')
+            return rows[0]
+
+        start, stop, step = item.indices(len(self))
+        if step != 1:
+            return list(self)[item]
+        if start >= stop:
+            return []
+        page_size = self.job.page_size
+        first = start // page_size
+        pages = self.job.pages.filter(number__range=(first, (stop - 1) // page_size))
+        rows = [row for page in pages.order_by('number').values_list('rows', flat=True) for row in page]
+        return rows[start - first * page_size:stop - first * page_size]
+
+    def __len__(self) -> int:
+        return self.job.row_count or 0
+
+    def __iter__(self) -> Iterator[dict]:
+        pages = self.job.pages.order_by('number').values_list('rows', flat=True)
+        for rows in pages.iterator(chunk_size=1):
+            yield from rows
+
+    def count(self) -> int:
+        return len(self)
+
+
+def get_job_executor() -> ThreadPoolExecutor:
+    """Get the thread pool sized by `METRICS_JOB_WORKERS` setting."""
+    workers = getattr(settings, 'METRICS_JOB_WORKERS', DEFAULT_JOB_WORKERS)
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metrics-jobs')
+    return _executors[workers]
+
+
+def get_job_key(query_params: QueryDict, ignored_params: Iterable[str] = ()) -> str:
+    """Build a key from the data version and normalized query parameters except `ignored_params`."""
+    params = normalize_query_params(query_params)
+    for param in ignored_params:
+        params.pop(param, None)
+    digest = hashlib.sha1(json.dumps(params).encode()).hexdigest()
+    return f'{get_data_version()}:{digest}'
+
+
+def expire_jobs():
+    """Fail jobs running longer than `METRICS_JOB_TIMEOUT` and delete results older than
+    `METRICS_JOB_RESULT_SECONDS`.
+
+    Jobs of a stopped process never finish, the timeout lets identical jobs run again.
+
+    """
+    now = timezone.now()
+    timeout = getattr(settings, 'METRICS_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    MetricQueryJob.objects.filter(
+        status__in=MetricQueryJob.IN_FLIGHT_STATUSES,
+        created_at__lt=now - timedelta(seconds=timeout),
+    ).update(status=MetricQueryJob.Status.FAILED, error='Timed out', finished_at=now)
+
+    result_seconds = getattr(settings, 'METRICS_JOB_RESULT_SECONDS', DEFAULT_JOB_RESULT_SECONDS)
+    MetricQueryJob.objects.filter(finished_at__lt=now - timedelta(seconds=result_seconds)).delete()
+
+
+def submit_job(query_params: QueryDict, run: Callable[[str], Iterable[dict]],
+               ignored_params: Iterable[str] = ()) -> Tuple[MetricQueryJob, bool]:
+    """Get the job of the query parameters, submitting a new one when there is none.
+
+    `run` is called on a pool thread with the query string of the job and returns the rows,
+    an iterator keeps only one page of rows in memory.
+    Return the job and whether it was created. Raise `JobQueueFull` when
+    `METRICS_MAX_QUEUED_JOBS` jobs are waiting.
+
+    """
+    expire_jobs()
+    key = get_job_key(query_params, ignored_params)
+    job = MetricQueryJob.objects.filter(key=key).exclude(
+        status=MetricQueryJob.Status.FAILED,
+    ).order_by('-created_at').first()
+    if job is not None:
+        return job, False
+
+    max_queued = getattr(settings, 'METRICS_MAX_QUEUED_JOBS', DEFAULT_MAX_QUEUED_JOBS)
+    if MetricQueryJob.objects.filter(status=MetricQueryJob.Status.PENDING).count() >= max_queued:
+        raise JobQueueFull(f'{max_queued} jobs are waiting')
+
+    try:
+        with transaction.atomic():
+            job = MetricQueryJob.objects.create(key=key, query_string=query_params.urlencode())
+    except IntegrityError:
+        # The same job was submitted concurrently
+        return MetricQueryJob.objects.get(key=key, status__in=MetricQueryJob.IN_FLIGHT_STATUSES), False
+
+    transaction.on_commit(lambda: get_job_executor().submit(call_with_connections, run_job, job.pk, run))
+    return job, True
+
+
+def run_job(job_id, run: Callable[[str], Iterable[dict]]):
+    """Run a pending job and store its rows by pages of `METRICS_JOB_PAGE_SIZE` rows, or its error."""
+    started = MetricQueryJob.objects.filter(pk=job_id, status=MetricQueryJob.Status.PENDING).update(
+        status=MetricQueryJob.Status.RUNNING, started_at=timezone.now(),
+    )
+    if not started:
+        return
+
+    query_string = MetricQueryJob.objects.values_list('query_string', flat=True).get(pk=job_id)
+    page_size = getattr(settings, 'METRICS_JOB_PAGE_SIZE', DEFAULT_JOB_PAGE_SIZE)
+    try:
+        row_count = save_pages(job_id, run(query_string), page_size)
+    except AggregationError as error:
+        changes = {'status': MetricQueryJob.Status.FAILED, 'error': f'Aggregation error: {error}'}
+    except Exception as error:
+        logger.exception('Metrics query job %s failed', job_id)
+        changes = {'status': MetricQueryJob.Status.FAILED, 'error': str(error)}
+    else:
+        changes = {'status': MetricQueryJob.Status.DONE, 'row_count': row_count, 'page_size': page_size}
+    if changes['status'] == MetricQueryJob.Status.FAILED:
+        MetricQueryJobPage.objects.filter(job_id=job_id).delete()
+    # A job failed by the timeout keeps its status
+    MetricQueryJob.objects.filter(pk=job_id, status=MetricQueryJob.Status.RUNNING).update(
+        finished_at=timezone.now(), **changes,
+    )
+
+
+def save_pages(job_id, rows: Iterable[dict], page_size: int) -> int:
+    """Store the rows of a job by pages of `page_size` rows, return the number of rows."""
+    rows, row_count = iter(rows), 0
+    for number in count():
+        page = list(islice(rows, page_size))
+        if not page:
+            break
+        MetricQueryJobPage.objects.create(job_id=job_id, number=number, rows=page)
+        row_count += len(page)
+    return row_count
@@ -0,0 +1,313 @@
+import csv
+import io
+import json
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from functools import partial
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.db import connection, transaction
+
+from .exceptions import LoadError
+from .fields import DimensionField
+from .models import Metric
+from .partitions import PARTITIONED_TABLE, SQLitePartitionBackend, get_month, get_partition_backend
+from .rollups import refresh_rollups
+from .versioning import bump_data_version
+
+
+# Metric fields loaded from files with converters from text values
+COLUMN_CONVERTERS = {
+    'date': date.fromisoformat,
+    'channel': str,
+    'country': str,
+    'os': str,
+    'impressions': int,
+    'clicks': int,
+    'installs': int,
+    'spend': float,
+    'revenue': float,
+}
+COLUMNS = tuple(COLUMN_CONVERTERS)
+# Columns identifying a row, rows with the same key are replaced by upserts
+KEY_COLUMNS = ('date', 'channel', 'country', 'os')
+# Columns of the rollups without the `date` dimension
+DIMENSIONS = COLUMNS[1:4]
+
+
+@dataclass
+class Batch:
+    """Rows of text values in `COLUMNS` order and a file position after the last row."""
+    rows: List[List[str]]
+    end_offset: int = 0
+
+
+@dataclass
+class LoadProgress:
+    rows: int = 0
+    offset: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+    dates: Set[date] = field(default_factory=set)
+    # Loaded `(channel, country, os)` values
+    dimensions: Set[Tuple[str, str, str]] = field(default_factory=set)
+
+    @property
+    def seconds(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.seconds
+        return self.rows / elapsed if elapsed else 0.0
+
+
+def iter_csv_batches(
+        file: BinaryIO,
+        batch_size: int,
+        delimiter: str = ',',
+        offset: int = 0,
+        encoding: str = 'utf-8',
+) -> Iterator[Batch]:
+    """Read CSV file opened in binary mode by batches of `batch_size` rows.
+
+    The header is always read from the file beginning, the data rows are read from `offset`.
+    A batch end offset may be used as `offset` to resume loading after the batch.
+    Without `offset` the file is read sequentially, so it may be a stream like a request body.
+
+    """
+    header_line = file.readline()
+    header = next(csv.reader([header_line.decode(encoding)], delimiter=delimiter), [])
+    missing_columns = set(COLUMNS).difference(header)
+    if missing_columns:
+        raise LoadError(f'Missing columns in the file header: {", ".join(sorted(missing_columns))}')
+    column_indexes = [header.index(column) for column in COLUMNS]
+
+    position = len(header_line)
+    if offset > position:
+        file.seek(offset)
+        position = offset
+
+    def iter_lines():
+        nonlocal position
+        for line in file:
+            position += len(line)
+            yield line.decode(encoding)
+
+    rows = []
+    for row in csv.reader(iter_lines(), delimiter=delimiter):
+        if not row:
+            continue
+        if len(row) != len(header):
+            raise LoadError(f'Expected {len(header)} values in a row, got {len(row)}')
+        rows.append([row[index] for index in column_indexes])
+        if len(rows) == batch_size:
+            yield Batch(rows, position)
+            rows = []
+
+    if rows:
+        yield Batch(rows, position)
+
+
+def iter_ndjson_batches(file: BinaryIO, batch_size: int, encoding: str = 'utf-8') -> Iterator[Batch]:
+    """Read newline delimited JSON objects with `COLUMNS` keys by batches of `batch_size` rows.
+
+    Values are converted to text, so they are checked by the same converters as CSV values.
+
+    """
+    rows, position = [], 0
+    for line in file:
+        position += len(line)
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line.decode(encoding))
+            rows.append([str(data[column]) for column in COLUMNS])
+        except (ValueError, TypeError) as error:
+            raise LoadError(f'Invalid JSON row: {error}') from error
+        except KeyError as error:
+            raise LoadError(f'Missing column in a JSON row: {error}') from error
+        if len(rows) == batch_size:
+            yield Batch(rows, position)
+            rows = []
+
+    if rows:
+        yield Batch(rows, position)
+
+
+def convert_batch(rows: List[List[str]]) -> List[Tuple]:
+    """Convert text values column by column."""
+    if not rows:
+        return []
+
+    try:
+        columns = [
+            list(map(converter, values))
+            for converter, values in zip(COLUMN_CONVERTERS.values(), zip(*rows))
+        ]
+    except ValueError as error:
+        raise LoadError(f'Invalid value: {error}') from error
+
+    return list(zip(*columns))
+
+
+class MetricLoader:
+    """Load `Metric` data by batches committed in transactions.
+
+    Every transaction commits `transaction_batches` batches.
+    PostgreSQL data inserted by the `COPY` command, other databases use `bulk_create`.
+    With `upsert` rows replace the stored rows with the same `KEY_COLUMNS` values,
+    so loading the same data again changes nothing.
+
+    """
+
+    def __init__(
+            self,
+            transaction_batches: int = 10,
+            progress_callback: Optional[Callable[[LoadProgress], None]] = None,
+            upsert: bool = False,
+    ):
+        self.transaction_batches = transaction_batches
+        self.progress_callback = progress_callback
+        self.upsert = upsert
+        self.progress = LoadProgress()
+        self.partition_months: Set[date] = set()
+
+    def load(self, batches: Iterable[Batch], offset: int = 0) -> LoadProgress:
+        """Load batches, refresh rollups for loaded dimensions and bump the data version.
+
+        Rollups and the data version are updated for committed data even when loading failed.
+        `LoadProgress.offset` is the end offset of the last committed batch,
+        the `progress` attribute keeps it when loading failed.
+
+        """
+        progress = self.progress = LoadProgress(offset=offset)
+        batches = iter(batches)
+        try:
+            while self._load_transaction(batches, progress):
+                if self.progress_callback:
+                    self.progress_callback(progress)
+        finally:
+            if progress.dates:
+                refresh_rollups(
+                    dates=progress.dates,
+                    rows=(dict(zip(DIMENSIONS, dimensions)) for dimensions in progress.dimensions),
+                )
+                bump_data_version(append_only=not self.upsert)
+
+        return progress
+
+    def _load_transaction(self, batches: Iterator[Batch], progress: LoadProgress) -> bool:
+        """Load next batches in a single transaction. Return False when nothing to load."""
+        rows_count, dates, dimensions, end_offset = 0, set(), set(), progress.offset
+        with transaction.atomic():
+            for _ in range(self.transaction_batches):
+                batch = next(batches, None)
+                if batch is None:
+                    break
+
+                rows = convert_batch(batch.rows)
+                self.insert(rows)
+                rows_count += len(rows)
+                dates.update(row[0] for row in rows)
+                dimensions.update(row[1:4] for row in rows)
+                end_offset = batch.end_offset
+
+        if not rows_count:
+            return False
+
+        progress.rows += rows_count
+        progress.dates.update(dates)
+        progress.dimensions.update(dimensions)
+        progress.offset = end_offset
+        return True
+
+    def insert(self, rows: List[Tuple]):
+        if connection.vendor == 'postgresql':
+            self._ensure_partitions(rows)
+        if self.upsert:
+            self._upsert(rows)
+        elif connection.vendor == 'postgresql':
+            self._copy(rows)
+        else:
+            Metric.objects.bulk_create(
+                Metric(**dict(zip(COLUMNS, row))) for row in rows
+            )
+
+    def _ensure_partitions(self, rows: List[Tuple]):
+        """Create PostgreSQL partitions for months of the rows, the table has no default partition."""
+        months = {get_month(row[0]) for row in rows}.difference(self.partition_months)
+        if months:
+            get_partition_backend().ensure_partitions(months)
+            self.partition_months.update(months)
+
+    def _copy(self, rows: List[Tuple]):
+        """Insert rows using PostgreSQL `COPY ... FROM STDIN`.
+
+        `COPY` bypasses the model fields, so dimension values are encoded to their codes here.
+
+        """
+        fields = [Metric._meta.get_field(name) for name in COLUMNS]
+        encoders = [
+            partial(field.get_db_prep_save, connection=connection) if isinstance(field, DimensionField) else None
+            for field in fields
+        ]
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [value if encode is None else encode(value) for encode, value in zip(encoders, row)]
+            for row in rows
+        )
+        buffer.seek(0)
+
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(field.column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {qn(Metric._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+
+    def _upsert(self, rows: List[Tuple]):
+        """Insert rows by multi-row `INSERT ... ON CONFLICT DO UPDATE` statements.
+
+        A statement can not update a row twice, so the last row of a key in the batch wins.
+        SQLite partitions are separate tables, rows are inserted to the tables of their months
+        with ids reserved in the `metrics_metric` sequence.
+
+        """
+        fields = [Metric._meta.get_field(name) for name in COLUMNS]
+        key_indexes = [COLUMNS.index(column) for column in KEY_COLUMNS]
+        rows_by_key = {tuple(row[index] for index in key_indexes): row for row in rows}
+
+        tables: Dict[str, List[list]] = {}
+        partitions = SQLitePartitionBackend(connection).get_partitions() if connection.vendor == 'sqlite' else {}
+        for row in rows_by_key.values():
+            table = partitions.get(get_month(row[0]), PARTITIONED_TABLE)
+            tables.setdefault(table, []).append(
+                [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+            )
+
+        qn = connection.ops.quote_name
+        updates = ', '.join(
+            f'{qn(field.column)} = excluded.{qn(field.column)}'
+            for field in fields if field.name not in KEY_COLUMNS
+        )
+        key = ', '.join(qn(Metric._meta.get_field(name).column) for name in KEY_COLUMNS)
+        with connection.cursor() as cursor:
+            for table, table_rows in tables.items():
+                columns = [field.column for field in fields]
+                if table != PARTITIONED_TABLE:
+                    columns.insert(0, Metric._meta.pk.column)
+                    ids = SQLitePartitionBackend(connection).reserve_ids(len(table_rows))
+                    table_rows = [[pk, *row] for pk, row in zip(ids, table_rows)]
+
+                batch_size = connection.ops.bulk_batch_size(columns, table_rows) or len(table_rows)
+                placeholders = f'({", ".join(["%s"] * len(columns))})'
+                for start in range(0, len(table_rows), batch_size):
+                    batch = table_rows[start:start + batch_size]
+                    cursor.execute(
+                        f'INSERT INTO {qn(table)} ({", ".join(qn(column) for column in columns)}) '
+                        f'VALUES {", ".join([placeholders] * len(batch))} '
+                        f'ON CONFLICT ({key}) DO UPDATE SET {updates}',
+                        [value for row in batch for value in row],
+                    )
@@ -0,0 +1,90 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import MetricBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Time README use-cases, raw list paging and ingestion and compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks',
+            nargs='*',
+            help='run only benchmarks with names starting with these prefixes'
+        )
+        parser.add_argument(
+            '-r',
+            '--repeat',
+            type=int,
+            default=5,
+            help='number of measurements of every benchmark'
+        )
+        parser.add_argument(
+            '--ingestion-rows',
+            type=int,
+            default=10000,
+            help='number of synthetic rows loaded by the ingestion benchmark'
+        )
+        parser.add_argument(
+            '-s',
+            '--sample',
+            type=str,
+            default=str(settings.BASE_DIR / 'dataset.csv'),
+            help='csv file with the sample data for ingestion'
+        )
+        parser.add_argument(
+            '-o',
+            '--output',
+            type=str,
+            help='write results to json file'
+        )
+        parser.add_argument(
+            '--baseline',
+            type=str,
+            help='json file with results to compare with'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='allowed slowdown relative to the baseline, 0.2 is 20%%'
+        )
+
+    def handle(self, *args, **options):
+        with open(options['sample']) as sample:
+            benchmark = MetricBenchmark(
+                sample,
+                repeat=options['repeat'],
+                ingestion_rows=options['ingestion_rows'],
+            )
+        results = benchmark.run(options['benchmarks'])
+        report = benchmark.get_report(results)
+
+        self.stdout.write(f'{"benchmark":<50} {"best, ms":>10} {"median, ms":>11}')
+        for result in results:
+            self.stdout.write(f'{result.name:<50} {result.best_ms:>10.2f} {result.median_ms:>11.2f}')
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                self.compare(benchmark, report, json.load(baseline), options['threshold'])
+
+    def compare(self, benchmark: MetricBenchmark, report: dict, baseline: dict, threshold: float):
+        self.stdout.write(f'\n{"benchmark":<50} {"baseline, ms":>12} {"ratio":>7}')
+        regressions = []
+        for comparison in benchmark.compare(report, baseline):
+            line = f'{comparison.name:<50} {comparison.baseline_ms:>12.2f} {comparison.ratio:>6.2f}x'
+            if comparison.ratio > 1 + threshold:
+                regressions.append(comparison.name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+
+        if regressions:
+            raise CommandError(f'Slower than the baseline: {", ".join(regressions)}')
@@ -0,0 +1,55 @@
+import timeit
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...api.serializers import MetricRowSerializer, MetricSerializer
+from ...models import Metric
+
+
+class Command(BaseCommand):
+    help = 'Compare serialization time of MetricSerializer and MetricRowSerializer per page size'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-p',
+            '--page-sizes',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000, 10000],
+            help='page sizes to benchmark'
+        )
+        parser.add_argument(
+            '-r',
+            '--repeat',
+            type=int,
+            default=5,
+            help='number of measurements, the best one reported'
+        )
+
+    def handle(self, *args, **options):
+        queryset = Metric.objects.with_cpi().order_by('date')
+        row_serializer = MetricRowSerializer()
+        total = queryset.count()
+
+        self.stdout.write(f'{"page size":>10} {"model, ms":>12} {"rows, ms":>12} {"speedup":>8}')
+        for page_size in options['page_sizes']:
+            if page_size > total:
+                raise CommandError(f'Not enough data for page size {page_size}, load more data')
+
+            page = queryset[:page_size]
+            model_time = self._measure(
+                lambda: MetricSerializer(list(page), many=True).data,
+                options['repeat'],
+            )
+            rows_time = self._measure(
+                lambda: row_serializer.serialize(list(row_serializer.get_rows(page))),
+                options['repeat'],
+            )
+            self.stdout.write(
+                f'{page_size:>10} {model_time * 1000:>12.2f} {rows_time * 1000:>12.2f} '
+                f'{model_time / rows_time:>7.1f}x'
+            )
+
+    @staticmethod
+    def _measure(func, repeat: int) -> float:
+        return min(timeit.repeat(func, number=1, repeat=repeat))
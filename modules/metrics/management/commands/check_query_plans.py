@@ -0,0 +1,103 @@
+import re
+from typing import List, Optional, Pattern
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import RequestFactory
+
+from rest_framework.request import Request
+
+from ...api.views import MetricViewSet
+from ...models import Metric
+from ...use_cases import README_USE_CASES
+
+# Patterns of a query plan line that reads a whole table of `Metric`, its partitions or rollups:
+# all of them are named with the `metrics_metric` prefix. The name of the table is the first group
+FULL_SCAN_PATTERNS = {
+    # SQLite: `SCAN [TABLE] metrics_metric...` reads every row, or every entry of a covering index,
+    # only `SEARCH` reads a range
+    'sqlite': r'\bSCAN (?:TABLE )?({table}\w*)',
+    'postgresql': r'\bSeq Scan on ({table}\w*)',
+}
+# A full scan of a covering index reads every index entry but not the table rows,
+# it is reported separately and does not fail the check
+COVERING_SCAN_PATTERN = re.compile(r'\bUSING COVERING INDEX\b')
+# SQLite subqueries read by their own plan lines, e.g. the `UNION ALL` of partitions as `metrics_metric`
+SUBQUERY_PATTERN = re.compile(r'\b(?:CO-ROUTINE|MATERIALIZE) (\S+)')
+
+
+def get_full_scan_pattern(vendor: str) -> Optional[Pattern]:
+    """Compile the full scan pattern of a database vendor, None when the vendor is not supported."""
+    pattern = FULL_SCAN_PATTERNS.get(vendor)
+    return re.compile(pattern.format(table=re.escape(Metric._meta.db_table))) if pattern else None
+
+
+def get_full_scans(plan: str, full_scan: Pattern) -> List[str]:
+    """Get plan lines reading a whole table.
+
+    Scans of SQLite subqueries are skipped: a `SCAN` of a `CO-ROUTINE` or `MATERIALIZE` name
+    with the same parent node reads the rows of the subquery, its tables have their own lines.
+
+    """
+    scans, subqueries = [], set()
+    for line in plan.splitlines():
+        # SQLite plan lines are `<id> <parent id> <unused> <detail>`
+        parent = line.split(' ', 2)[1] if line[:1].isdigit() else None
+        subquery = SUBQUERY_PATTERN.search(line)
+        if subquery:
+            subqueries.add((parent, subquery.group(1)))
+            continue
+        scan = full_scan.search(line)
+        if scan and (parent, scan.group(1)) not in subqueries:
+            scans.append(line)
+    return scans
+
+
+def get_use_case_queryset(params: dict):
+    """Build the queryset exactly the way `MetricViewSet.list` does."""
+    request = Request(RequestFactory().get('/metrics/', params))
+    view = MetricViewSet(request=request, format_kwarg=None, action='list')
+    return view.filter_queryset(view.get_queryset())
+
+
+class Command(BaseCommand):
+    help = (
+        'Run EXPLAIN on the documented API use-cases and check that no full table scan used, '
+        'full scans of covering indexes are reported separately'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plan',
+            action='store_true',
+            help='print query plans',
+        )
+
+    def handle(self, *args, **options):
+        full_scan = get_full_scan_pattern(connection.vendor)
+        if full_scan is None:
+            raise CommandError(f'Query plan check is not supported for "{connection.vendor}"')
+
+        failed = []
+        for use_case in README_USE_CASES:
+            queryset = get_use_case_queryset(use_case['params'])
+            if not isinstance(queryset, QuerySet):
+                self.stdout.write(self.style.SUCCESS(f'OK {use_case["name"]} (aggregated in memory)'))
+                continue
+
+            plan = queryset.explain()
+            if options['verbose_plan']:
+                self.stdout.write(f'{use_case["name"]}:\n{plan}\n')
+
+            scans = get_full_scans(plan, full_scan)
+            if any(not COVERING_SCAN_PATTERN.search(scan) for scan in scans):
+                failed.append(use_case['name'])
+                self.stdout.write(self.style.ERROR(f'FULL SCAN {use_case["name"]}'))
+            elif scans:
+                self.stdout.write(self.style.WARNING(f'INDEX SCAN {use_case["name"]}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'OK {use_case["name"]}'))
+
+        if failed:
+            raise CommandError(f'Full table scan in: {", ".join(failed)}')
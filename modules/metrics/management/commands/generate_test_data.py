@@ -0,0 +1,106 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...loaders import LoadProgress, MetricLoader
+from ...synthetic import DEFAULT_ROWS_PER_DAY, SyntheticMetricGenerator
+
+ROWS_SUFFIXES = {'K': 10 ** 3, 'M': 10 ** 6}
+
+
+def parse_rows(value: str) -> int:
+    """Parse number of rows like `1000`, `1M` or `100M`."""
+    multiplier = ROWS_SUFFIXES.get(value[-1:].upper(), 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        rows = int(number) * multiplier
+    except ValueError:
+        raise CommandError(f'Invalid number of rows: {value}')
+    if rows <= 0:
+        raise CommandError(f'Invalid number of rows: {value}')
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic data with distributions of the sample file and load it or write to csv file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rows', type=str, help='number of rows, e.g. 1M, 10M, 100M')
+        parser.add_argument(
+            '-s',
+            '--sample',
+            type=str,
+            default=str(settings.BASE_DIR / 'dataset.csv'),
+            help='csv file with the sample data'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='write rows to csv file instead of loading them'
+        )
+        parser.add_argument(
+            '--start-date',
+            type=date.fromisoformat,
+            default=date(2017, 5, 1),
+            help='date of the first rows'
+        )
+        parser.add_argument(
+            '--rows-per-day',
+            type=int,
+            default=DEFAULT_ROWS_PER_DAY,
+            help='number of rows for every date, larger days than the sample allows add channel variants'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='random seed, the same seed generates the same data'
+        )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='number of rows generated and inserted at once'
+        )
+        parser.add_argument(
+            '-t',
+            '--transaction-batches',
+            type=int,
+            default=10,
+            help='number of batches committed in a single transaction'
+        )
+
+    def handle(self, *args, **options):
+        rows = parse_rows(options['rows'])
+        with open(options['sample']) as sample:
+            try:
+                generator = SyntheticMetricGenerator(
+                    sample,
+                    start_date=options['start_date'],
+                    rows_per_day=options['rows_per_day'],
+                    seed=options['seed'],
+                )
+            except ValueError as error:
+                raise CommandError(str(error))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                generator.write(output, rows, batch_size=options['batch_size'])
+            if options['verbosity']:
+                self.stdout.write(self.style.SUCCESS(f'Written {rows} rows to {options["output"]}'))
+            return
+
+        loader = MetricLoader(
+            transaction_batches=options['transaction_batches'],
+            progress_callback=self.report_progress if options['verbosity'] else None,
+        )
+        progress = loader.load(generator.iter_batches(rows, batch_size=options['batch_size']))
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Loaded {progress.rows} rows, {progress.rows_per_second:.0f} rows/sec'
+            ))
+
+    def report_progress(self, progress: LoadProgress):
+        self.stdout.write(f'{progress.rows} rows, {progress.rows_per_second:.0f} rows/sec')
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...benchmarks import MetricLoadTest
+
+
+class Command(BaseCommand):
+    help = 'Compare the WSGI and the ASGI metrics API under concurrent README use-case requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'interfaces',
+            nargs='*',
+            help='interfaces to test: wsgi, asgi, both by default'
+        )
+        parser.add_argument(
+            '-c',
+            '--concurrency',
+            type=int,
+            default=8,
+            help='number of requests in flight'
+        )
+        parser.add_argument(
+            '-n',
+            '--requests',
+            type=int,
+            default=200,
+            help='total number of requests to every interface'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('Concurrency and number of requests must be positive')
+        unknown_interfaces = set(options['interfaces']).difference(MetricLoadTest.interfaces)
+        if unknown_interfaces:
+            raise CommandError(f'Unknown interfaces: {", ".join(sorted(unknown_interfaces))}')
+
+        load_test = MetricLoadTest(concurrency=options['concurrency'], requests=options['requests'])
+        results = load_test.run(options['interfaces'] or MetricLoadTest.interfaces)
+
+        self.stdout.write(f'{"interface":<10} {"requests/s":>11} {"p50, ms":>9} {"p95, ms":>9} {"errors":>7}')
+        for result in results:
+            self.stdout.write(
+                f'{result.interface:<10} {result.requests_per_second:>11.1f} '
+                f'{result.get_latency_ms(50):>9.2f} {result.get_latency_ms(95):>9.2f} {result.errors:>7}'
+            )
+        if any(result.errors for result in results):
+            raise CommandError('Some requests failed')
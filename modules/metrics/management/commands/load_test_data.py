@@ -1,8 +1,6 @@
-import csv
+from django.core.management.base import BaseCommand, CommandError
 
-from django.core.management.base import BaseCommand
-
-from ...models import Metric
+from ...loaders import LoadProgress, MetricLoader, iter_csv_batches
 
 
 class Command(BaseCommand):
@@ -17,14 +15,62 @@ class Command(BaseCommand):
             default=',',
             help='custom delimiter'
         )
+        parser.add_argument(
+            '-b',
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='number of rows read and inserted at once'
+        )
+        parser.add_argument(
+            '-t',
+            '--transaction-batches',
+            type=int,
+            default=10,
+            help='number of batches committed in a single transaction'
+        )
+        parser.add_argument(
+            '-o',
+            '--offset',
+            type=int,
+            default=0,
+            help='byte offset in the file to resume loading from'
+        )
+        parser.add_argument(
+            '--upsert',
+            action='store_true',
+            help='replace stored rows with the same date, channel, country and os instead of failing'
+        )
 
     def handle(self, *args, **options):
-        filename = options['filename']
-        delimiter = options['delimiter']
+        loader = MetricLoader(
+            transaction_batches=options['transaction_batches'],
+            progress_callback=self.report_progress if options['verbosity'] else None,
+            upsert=options['upsert'],
+        )
+
+        with open(options['filename'], 'rb') as csv_file:
+            batches = iter_csv_batches(
+                csv_file,
+                batch_size=options['batch_size'],
+                delimiter=options['delimiter'],
+                offset=options['offset'],
+            )
+            try:
+                progress = loader.load(batches, offset=options['offset'])
+            except Exception as error:
+                raise CommandError(
+                    f'Loading failed: {error}. '
+                    f'Use `--offset {loader.progress.offset}` to resume loading'
+                ) from error
 
-        with open(filename) as csv_file:
-            reader = csv.DictReader(csv_file, delimiter=delimiter)
+        if options['verbosity']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Loaded {progress.rows} rows, {progress.rows_per_second:.0f} rows/sec'
+            ))
 
-            Metric.objects.bulk_create([
-                Metric(**entry) for entry in reader
-            ])
+    def report_progress(self, progress: LoadProgress):
+        self.stdout.write(
+            f'{progress.rows} rows, {progress.rows_per_second:.0f} rows/sec, '
+            f'offset {progress.offset}'
+        )
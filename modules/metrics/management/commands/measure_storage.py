@@ -0,0 +1,66 @@
+from typing import Dict, List, Tuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...models import Metric
+from ...partitions import get_partition_backend
+from ...rollups import ROLLUP_MODELS
+
+
+def get_sqlite_sizes(tables: List[str]) -> Tuple[int, int]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name IN ({})".format(
+                ', '.join(['%s'] * len(tables))
+            ),
+            tables,
+        )
+        indexes = [name for name, in cursor.fetchall()]
+        cursor.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')
+        sizes: Dict[str, int] = dict(cursor.fetchall())
+    return sum(sizes.get(table, 0) for table in tables), sum(sizes.get(index, 0) for index in indexes)
+
+
+def get_postgresql_sizes(tables: List[str]) -> Tuple[int, int]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT SUM(pg_table_size(relid)), SUM(pg_indexes_size(relid)) '
+            'FROM pg_partition_tree(%s)',
+            [tables[0]],
+        )
+        return cursor.fetchone()
+
+
+def get_tables(model) -> List[str]:
+    """Get the model table and, for partitioned `Metric` on SQLite, its partition tables."""
+    tables = [model._meta.db_table]
+    if model is Metric and connection.vendor == 'sqlite':
+        tables.extend(get_partition_backend().get_partitions().values())
+    return tables
+
+
+SIZE_GETTERS = {
+    'sqlite': get_sqlite_sizes,
+    'postgresql': get_postgresql_sizes,
+}
+
+
+class Command(BaseCommand):
+    help = 'Show disk size of metric tables and their indexes including partitions'
+
+    def handle(self, *args, **options):
+        get_sizes = SIZE_GETTERS.get(connection.vendor)
+        if get_sizes is None:
+            raise CommandError(f'Size measurement is not supported for "{connection.vendor}"')
+
+        self.stdout.write(f'{"table":<45} {"rows":>12} {"table, MB":>10} {"indexes, MB":>12} {"bytes/row":>10}')
+        for model in (Metric, *ROLLUP_MODELS):
+            table = model._meta.db_table
+            rows = model.objects.count()
+            table_size, indexes_size = get_sizes(get_tables(model))
+            bytes_per_row = (table_size + indexes_size) / rows if rows else 0
+            self.stdout.write(
+                f'{table:<45} {rows:>12} {table_size / 2 ** 20:>10.2f} {indexes_size / 2 ** 20:>12.2f} '
+                f'{bytes_per_row:>10.1f}'
+            )
@@ -0,0 +1,79 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...exceptions import PartitionError
+from ...partitions import add_months, get_month, get_partition_backend
+from ...rollups import expire_rollups
+from ...versioning import bump_data_version
+
+
+class Command(BaseCommand):
+    help = 'Create monthly partitions of Metric data ahead and detach or drop expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='number of months after the current one to create partitions for'
+        )
+        parser.add_argument(
+            '--start-date',
+            type=date.fromisoformat,
+            help='create partitions starting from the month of this date, e.g. to partition existing data'
+        )
+        parser.add_argument(
+            '--retention-months',
+            type=int,
+            help='remove partitions older than this number of months before the current one'
+        )
+        parser.add_argument(
+            '--detach',
+            action='store_true',
+            help='detach expired partitions keeping their tables instead of dropping them'
+        )
+        parser.add_argument(
+            '--date',
+            type=date.fromisoformat,
+            help='date of the current month, today by default'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            backend = get_partition_backend()
+        except PartitionError as error:
+            raise CommandError(error)
+
+        report = self.stdout.write if options['verbosity'] else lambda message: None
+        today = options['date'] or date.today()
+        current_month = get_month(today)
+        month = get_month(options['start_date'] or today)
+        last_month = add_months(current_month, options['months_ahead'])
+        while month <= last_month:
+            if backend.create_partition(month):
+                report(f'Created partition for {month:%Y-%m}')
+            month = add_months(month, 1)
+
+        if options['retention_months'] is None:
+            return
+
+        cutoff = add_months(current_month, -options['retention_months'])
+        expired_months = sorted(month for month in backend.get_partitions() if month < cutoff)
+        with transaction.atomic():
+            for month in expired_months:
+                if options['detach']:
+                    table = backend.detach_partition(month)
+                    report(f'Detached partition for {month:%Y-%m} as {table}')
+                else:
+                    backend.drop_partition(month)
+                    report(f'Dropped partition for {month:%Y-%m}')
+
+            deleted_rows = backend.delete_unpartitioned_rows(cutoff)
+            if deleted_rows:
+                report(f'Deleted {deleted_rows} rows before {cutoff} outside of partitions')
+
+            if expired_months or deleted_rows:
+                expire_rollups(cutoff)
+                bump_data_version()
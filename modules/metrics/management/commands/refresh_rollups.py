@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from ...rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild pre-aggregated rollup tables from Metric data'
+
+    def handle(self, *args, **options):
+        refresh_rollups()
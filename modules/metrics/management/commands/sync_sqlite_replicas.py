@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ...routers import get_replicas
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the default SQLite database to the replicas of METRICS_DATABASE_REPLICAS, '
+        'a stand-in for replication in local testing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'replicas',
+            nargs='*',
+            help='replica database aliases, all from METRICS_DATABASE_REPLICAS by default'
+        )
+
+    def handle(self, *args, **options):
+        replicas = options['replicas'] or get_replicas()
+        if not replicas:
+            raise CommandError('No replicas, set METRICS_DATABASE_REPLICAS or pass replica aliases')
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in (DEFAULT_DB_ALIAS, *replicas):
+            if alias not in connections.databases:
+                raise CommandError(f'Unknown database "{alias}"')
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f'Database "{alias}" is not SQLite, use the replication of the database')
+
+        primary.ensure_connection()
+        for alias in replicas:
+            replica = connections[alias]
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f'Copied {primary.settings_dict["NAME"]} to {replica.settings_dict["NAME"]}')
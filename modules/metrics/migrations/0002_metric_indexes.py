@@ -0,0 +1,33 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['date', 'country', 'os', 'channel'], name='metric_date_dims_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['country', 'date'], name='metric_country_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['os', 'date'], name='metric_os_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['channel', 'date'], name='metric_channel_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['channel', 'country', 'os', 'date'], name='metric_dims_date_idx'),
+        ),
+    ]
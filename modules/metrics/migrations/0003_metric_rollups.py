@@ -0,0 +1,86 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:25
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django_countries.fields
+
+ROLLUP_DIMENSIONS = {
+    'MetricChannelCountryOSRollup': ('channel', 'country', 'os'),
+    'MetricDateCountryRollup': ('date', 'country'),
+    'MetricDateOSRollup': ('date', 'os'),
+}
+ADDITIVE_COLUMNS = ('impressions', 'clicks', 'installs', 'spend', 'revenue')
+
+
+def populate_rollups(apps, schema_editor):
+    Metric = apps.get_model('metrics', 'Metric')
+    db_alias = schema_editor.connection.alias
+    for model_name, dimensions in ROLLUP_DIMENSIONS.items():
+        rollup_model = apps.get_model('metrics', model_name)
+        totals = Metric.objects.using(db_alias).values(*dimensions).annotate(
+            **{column: Sum(column) for column in ADDITIVE_COLUMNS}
+        ).order_by()
+        rollup_model.objects.using(db_alias).bulk_create(
+            (rollup_model(**row) for row in totals.iterator()),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0002_metric_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricDateOSRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('impressions', models.BigIntegerField()),
+                ('clicks', models.BigIntegerField()),
+                ('installs', models.BigIntegerField()),
+                ('spend', models.FloatField()),
+                ('revenue', models.FloatField()),
+                ('date', models.DateField()),
+                ('os', models.CharField(choices=[('android', 'Android'), ('ios', 'iOS')], max_length=10)),
+            ],
+            options={
+                'unique_together': {('date', 'os')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricDateCountryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('impressions', models.BigIntegerField()),
+                ('clicks', models.BigIntegerField()),
+                ('installs', models.BigIntegerField()),
+                ('spend', models.FloatField()),
+                ('revenue', models.FloatField()),
+                ('date', models.DateField()),
+                ('country', django_countries.fields.CountryField(max_length=2)),
+            ],
+            options={
+                'unique_together': {('date', 'country')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricChannelCountryOSRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('impressions', models.BigIntegerField()),
+                ('clicks', models.BigIntegerField()),
+                ('installs', models.BigIntegerField()),
+                ('spend', models.FloatField()),
+                ('revenue', models.FloatField()),
+                ('channel', models.CharField(max_length=250)),
+                ('country', django_countries.fields.CountryField(max_length=2)),
+                ('os', models.CharField(choices=[('android', 'Android'), ('ios', 'iOS')], max_length=10)),
+            ],
+            options={
+                'unique_together': {('channel', 'country', 'os')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
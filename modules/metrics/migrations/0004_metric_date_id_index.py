@@ -0,0 +1,17 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0003_metric_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['date', 'id'], name='metric_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0005_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataversion',
+            name='rewrite_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
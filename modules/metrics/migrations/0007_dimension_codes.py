@@ -0,0 +1,156 @@
+# Generated by Django 3.2.12 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+import django_countries.fields
+
+import modules.metrics.fields
+
+# Dimension fields of the models converted to codes
+MODEL_DIMENSIONS = {
+    'metric': ('channel', 'country', 'os'),
+    'metricchannelcountryosrollup': ('channel', 'country', 'os'),
+    'metricdatecountryrollup': ('country', ),
+    'metricdateosrollup': ('os', ),
+}
+
+METRIC_DIMENSION_INDEXES = (
+    models.Index(fields=['date', 'country', 'os', 'channel'], name='metric_date_dims_idx'),
+    models.Index(fields=['country', 'date'], name='metric_country_date_idx'),
+    models.Index(fields=['os', 'date'], name='metric_os_date_idx'),
+    models.Index(fields=['channel', 'date'], name='metric_channel_date_idx'),
+    models.Index(fields=['channel', 'country', 'os', 'date'], name='metric_dims_date_idx'),
+)
+
+# Text fields made nullable before removal, so the migration can be reversed
+NULLABLE_TEXT_FIELDS = {
+    'channel': lambda: models.CharField(max_length=250, null=True),
+    'country': lambda: django_countries.fields.CountryField(max_length=2, null=True),
+    'os': lambda: models.CharField(choices=[('android', 'Android'), ('ios', 'iOS')], max_length=10, null=True),
+}
+
+ROLLUP_UNIQUE_TOGETHER = {
+    'metricchannelcountryosrollup': {('channel', 'country', 'os')},
+    'metricdatecountryrollup': {('date', 'country')},
+    'metricdateosrollup': {('date', 'os')},
+}
+
+
+def encode_dimensions(apps, schema_editor):
+    """Set codes of the stored values by a single UPDATE per column.
+
+    Codes of the values are created in alphabetical order. With `METRICS_DIMENSION_CODES`
+    disabled the code columns are text and the values are copied.
+
+    """
+    db_alias = schema_editor.connection.alias
+    DimensionCode = apps.get_model('metrics', 'DimensionCode')
+    for model_name, dimensions in MODEL_DIMENSIONS.items():
+        model = apps.get_model('metrics', model_name)
+        for dimension in dimensions:
+            if not model._meta.get_field(f'{dimension}_code').stores_codes:
+                model.objects.using(db_alias).update(**{f'{dimension}_code': F(dimension)})
+                continue
+            stored_values = sorted({
+                str(value)
+                for value in model.objects.using(db_alias).values_list(dimension, flat=True).distinct().order_by()
+            })
+            codes = {
+                value: DimensionCode.objects.using(db_alias).get_or_create(dimension=dimension, value=value)[0].pk
+                for value in stored_values
+            }
+            model.objects.using(db_alias).update(**{f'{dimension}_code': Case(*(
+                When(**{dimension: value, 'then': Value(code)})
+                for value, code in codes.items()
+            ))})
+
+
+def decode_dimensions(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    DimensionCode = apps.get_model('metrics', 'DimensionCode')
+    for model_name, dimensions in MODEL_DIMENSIONS.items():
+        model = apps.get_model('metrics', model_name)
+        for dimension in dimensions:
+            if not model._meta.get_field(f'{dimension}_code').stores_codes:
+                model.objects.using(db_alias).update(**{dimension: F(f'{dimension}_code')})
+                continue
+            codes = DimensionCode.objects.using(db_alias).filter(dimension=dimension).values_list('pk', 'value')
+            model.objects.using(db_alias).update(**{dimension: Case(*(
+                When(**{f'{dimension}_code': code, 'then': Value(value)})
+                for code, value in codes
+            ))})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0006_data_rewrite_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DimensionCode',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('dimension', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=250)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dimensioncode',
+            constraint=models.UniqueConstraint(fields=('dimension', 'value'), name='dimension_code_value'),
+        ),
+        *(
+            migrations.RemoveIndex(model_name='metric', name=index.name)
+            for index in METRIC_DIMENSION_INDEXES
+        ),
+        *(
+            migrations.AlterUniqueTogether(name=model_name, unique_together=set())
+            for model_name in ROLLUP_UNIQUE_TOGETHER
+        ),
+        *(
+            migrations.AddField(
+                model_name=model_name,
+                name=f'{dimension}_code',
+                field=modules.metrics.fields.DimensionField(dimension=dimension, null=True),
+            )
+            for model_name, dimensions in MODEL_DIMENSIONS.items()
+            for dimension in dimensions
+        ),
+        *(
+            migrations.AlterField(
+                model_name=model_name,
+                name=dimension,
+                field=NULLABLE_TEXT_FIELDS[dimension](),
+            )
+            for model_name, dimensions in MODEL_DIMENSIONS.items()
+            for dimension in dimensions
+        ),
+        migrations.RunPython(encode_dimensions, decode_dimensions),
+        *(
+            operation
+            for model_name, dimensions in MODEL_DIMENSIONS.items()
+            for dimension in dimensions
+            for operation in (
+                migrations.RemoveField(model_name=model_name, name=dimension),
+                migrations.RenameField(model_name=model_name, old_name=f'{dimension}_code', new_name=dimension),
+                migrations.AlterField(
+                    model_name=model_name,
+                    name=dimension,
+                    field=modules.metrics.fields.DimensionField(
+                        dimension=dimension,
+                        **({'default': 'android'} if model_name == 'metric' and dimension == 'os' else {}),
+                    ),
+                ),
+            )
+        ),
+        *(
+            migrations.AddIndex(model_name='metric', index=index)
+            for index in METRIC_DIMENSION_INDEXES
+        ),
+        *(
+            migrations.AlterUniqueTogether(name=model_name, unique_together=unique_together)
+            for model_name, unique_together in ROLLUP_UNIQUE_TOGETHER.items()
+        ),
+    ]
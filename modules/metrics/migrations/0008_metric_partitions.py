@@ -0,0 +1,73 @@
+# Generated by Django 3.2.12 on 2026-10-18 10:05
+
+from django.db import migrations
+
+TABLE = 'metrics_metric'
+
+
+def get_partition_table(month) -> str:
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def add_month(month):
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def recreate_table(apps, schema_editor, partition_by: str = ''):
+    """Copy `metrics_metric` to a new table, partitioned by months of `date` when `partition_by` passed.
+
+    The primary key of a partitioned table must include the partition key, so it is `(id, date)`.
+    The id sequence is moved to the new table, the indexes are created on the new table.
+
+    """
+    metric_model = apps.get_model('metrics', 'Metric')
+    old_table = f'{TABLE}_old'
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [TABLE, 'id'])
+        sequence, = cursor.fetchone()
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {old_table}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {old_table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) {partition_by}'
+        )
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id')
+
+        if partition_by:
+            cursor.execute(f"SELECT DISTINCT DATE_TRUNC('month', date)::date FROM {old_table}")
+            for month, in cursor.fetchall():
+                cursor.execute(
+                    f'CREATE TABLE {get_partition_table(month)} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+                    [month, add_month(month)],
+                )
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {old_table}')
+        cursor.execute(f'DROP TABLE {old_table}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY {"(id, date)" if partition_by else "(id)"}')
+
+    for index in metric_model._meta.indexes:
+        schema_editor.add_index(metric_model, index)
+
+
+def partition_metric_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        recreate_table(apps, schema_editor, partition_by='PARTITION BY RANGE (date)')
+
+
+def unpartition_metric_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        recreate_table(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+    """Partition `Metric` table by months on PostgreSQL.
+
+    Other databases keep the table, SQLite partitions are created by `partition_metrics` command.
+
+    """
+
+    dependencies = [
+        ('metrics', '0007_dimension_codes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_metric_table, unpartition_metric_table),
+    ]
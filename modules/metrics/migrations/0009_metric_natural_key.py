@@ -0,0 +1,108 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:20
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Sum
+
+TABLE = 'metrics_metric'
+PARTITION_PREFIX = f'{TABLE}_p'
+NATURAL_KEY = ('date', 'country', 'os', 'channel')
+ADDITIVE_COLUMNS = ('impressions', 'clicks', 'installs', 'spend', 'revenue')
+ROLLUP_DIMENSIONS = {
+    'metricchannelcountryosrollup': ('channel', 'country', 'os'),
+    'metricdatecountryrollup': ('date', 'country'),
+    'metricdateosrollup': ('date', 'os'),
+}
+
+
+def delete_duplicates(apps, schema_editor):
+    """Keep the last loaded row of every natural key.
+
+    Rollups are rebuilt and the data version is bumped as a rewrite when rows were deleted.
+
+    """
+    db_alias = schema_editor.connection.alias
+    metrics = apps.get_model('metrics', 'Metric').objects.using(db_alias)
+    duplicates = metrics.values(*NATURAL_KEY).annotate(
+        last_id=Max('id'), rows=Count('id'),
+    ).filter(rows__gt=1).order_by()
+
+    deleted = 0
+    for duplicate in list(duplicates):
+        last_id = duplicate.pop('last_id')
+        del duplicate['rows']
+        deleted += metrics.filter(**duplicate).exclude(id=last_id).delete()[0]
+    if not deleted:
+        return
+
+    for model_name, dimensions in ROLLUP_DIMENSIONS.items():
+        rollups = apps.get_model('metrics', model_name).objects.using(db_alias)
+        rollups.all().delete()
+        rollups.bulk_create(
+            rollups.model(**totals)
+            for totals in metrics.values(*dimensions).annotate(
+                **{column: Sum(column) for column in ADDITIVE_COLUMNS}
+            ).order_by()
+        )
+    apps.get_model('metrics', 'DataVersion').objects.using(db_alias).update(
+        version=F('version') + 1,
+        rewrite_version=F('version') + 1,
+    )
+
+
+def get_sqlite_partitions(schema_editor) -> list:
+    if schema_editor.connection.vendor != 'sqlite':
+        return []
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s", [f'{PARTITION_PREFIX}%'])
+        tables = [table for table, in cursor.fetchall()]
+    return [table for table in tables if table[len(PARTITION_PREFIX):].isdigit()]
+
+
+def add_partition_unique_indexes(apps, schema_editor):
+    """Replace the index of SQLite partition tables by the unique one.
+
+    Partition tables copied the schema of `metrics_metric` when they were created,
+    new partitions copy the constraint.
+
+    """
+    qn = schema_editor.quote_name
+    columns = ', '.join(qn(column) for column in NATURAL_KEY)
+    for table in get_sqlite_partitions(schema_editor):
+        suffix = table[len(PARTITION_PREFIX):]
+        schema_editor.execute(f'DROP INDEX IF EXISTS {qn(f"metric_date_dims_idx_p{suffix}")}')
+        schema_editor.execute(f'CREATE UNIQUE INDEX {qn(f"metric_natural_key_p{suffix}")} ON {qn(table)} ({columns})')
+
+
+def remove_partition_unique_indexes(apps, schema_editor):
+    qn = schema_editor.quote_name
+    columns = ', '.join(qn(column) for column in NATURAL_KEY)
+    for table in get_sqlite_partitions(schema_editor):
+        suffix = table[len(PARTITION_PREFIX):]
+        schema_editor.execute(f'DROP INDEX IF EXISTS {qn(f"metric_natural_key_p{suffix}")}')
+        schema_editor.execute(f'CREATE INDEX {qn(f"metric_date_dims_idx_p{suffix}")} ON {qn(table)} ({columns})')
+
+
+class Migration(migrations.Migration):
+    """Make `(date, channel, country, os)` the unique key of `Metric` rows.
+
+    Duplicated rows are deleted before adding the constraint. The unique index replaces
+    `metric_date_dims_idx` having the same columns.
+
+    """
+
+    dependencies = [
+        ('metrics', '0008_metric_partitions'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='metric',
+            name='metric_date_dims_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='metric',
+            constraint=models.UniqueConstraint(fields=('date', 'country', 'os', 'channel'), name='metric_natural_key'),
+        ),
+        migrations.RunPython(add_partition_unique_indexes, remove_partition_unique_indexes),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:05
+
+import django.core.serializers.json
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0009_metric_natural_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricQueryJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=64)),
+                ('query_string', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('rows', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='metricqueryjob',
+            index=models.Index(fields=['key', 'created_at'], name='metric_query_job_key_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='metricqueryjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('pending', 'running'))), fields=('key',), name='metric_query_job_in_flight_key'),
+        ),
+    ]
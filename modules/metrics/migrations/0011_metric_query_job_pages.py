@@ -0,0 +1,49 @@
+# Generated by Django 3.2.12 on 2026-10-18 13:40
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_done_jobs(apps, schema_editor):
+    """Delete done jobs, their rows are not moved to pages: the same query submits a new job."""
+    db_alias = schema_editor.connection.alias
+    apps.get_model('metrics', 'MetricQueryJob').objects.using(db_alias).filter(status='done').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('metrics', '0010_metric_query_jobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_done_jobs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='metricqueryjob',
+            name='rows',
+        ),
+        migrations.AddField(
+            model_name='metricqueryjob',
+            name='page_size',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='metricqueryjob',
+            name='row_count',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name='MetricQueryJobPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('rows', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='metrics.metricqueryjob')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricqueryjobpage',
+            constraint=models.UniqueConstraint(fields=('job', 'number'), name='metric_query_job_page_number'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.2.12 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+PARTITION_PREFIX = 'metrics_metric_p'
+DIMS_DATE_COLUMNS = ('channel', 'country', 'os', 'date')
+ADDITIVE_COLUMNS = ('impressions', 'clicks', 'installs', 'spend', 'revenue')
+
+
+def get_sqlite_partitions(schema_editor) -> list:
+    if schema_editor.connection.vendor != 'sqlite':
+        return []
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE %s", [f'{PARTITION_PREFIX}%'])
+        tables = [table for table, in cursor.fetchall()]
+    return [table for table in tables if table[len(PARTITION_PREFIX):].isdigit()]
+
+
+def replace_partition_indexes(schema_editor, columns):
+    """Replace `metric_dims_date_idx` of SQLite partition tables.
+
+    Existing partitions keep the index they were created with, new partitions
+    copy the index of `metrics_metric`.
+
+    """
+    qn = schema_editor.quote_name
+    for table in get_sqlite_partitions(schema_editor):
+        index = qn(f'metric_dims_date_idx_p{table[len(PARTITION_PREFIX):]}')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index}')
+        schema_editor.execute(f'CREATE INDEX {index} ON {qn(table)} ({", ".join(qn(column) for column in columns)})')
+
+
+def add_partition_covering_indexes(apps, schema_editor):
+    replace_partition_indexes(schema_editor, DIMS_DATE_COLUMNS + ADDITIVE_COLUMNS)
+
+
+def remove_partition_covering_indexes(apps, schema_editor):
+    replace_partition_indexes(schema_editor, DIMS_DATE_COLUMNS)
+
+
+class Migration(migrations.Migration):
+    """Indexes covering the summed columns.
+
+    `metric_dims_date_idx` gets the additive columns, so groups by the leading dimensions
+    are summed from the index. The rollup indexes serve the Readme use-cases.
+
+    """
+
+    dependencies = [
+        ('metrics', '0011_metric_query_job_pages'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='metric',
+            name='metric_dims_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='metric',
+            index=models.Index(fields=['channel', 'country', 'os', 'date', 'impressions', 'clicks', 'installs', 'spend', 'revenue'], name='metric_dims_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metricchannelcountryosrollup',
+            index=models.Index(fields=['country', 'channel', 'spend', 'installs'], name='rollup_country_cpi_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='metricdateosrollup',
+            index=models.Index(fields=['os', 'date', 'installs'], name='rollup_os_installs_idx'),
+        ),
+        migrations.RunPython(add_partition_covering_indexes, remove_partition_covering_indexes),
+    ]
@@ -1,13 +1,30 @@
-from django.db import models
+import uuid
+from typing import Dict, Optional, Set, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, router, transaction
+from django.db.models.functions import NullIf
 from django.utils.translation import gettext_lazy as _
 
-from django_countries.fields import CountryField
+from django_countries import countries
+
+from .fields import DimensionField, get_value_ordering
+
 
+class DimensionQuerySet(models.QuerySet):
+    def order_by(self, *field_names):
+        """Order dimensions stored as codes by their values."""
+        return super().order_by(*(get_value_ordering(self.model, name) for name in field_names))
 
-class MetricQuerySet(models.QuerySet):
+
+class MetricQuerySet(DimensionQuerySet):
     def with_cpi(self):
-        """Compute CPI (cost per install) = spend / installs for every Metric."""
-        return self.annotate(cpi=models.F('spend') / models.F('installs'))
+        """Compute CPI (cost per install) = spend / installs for every Metric.
+
+        CPI is NULL when there are no installs.
+
+        """
+        return self.annotate(cpi=models.F('spend') / NullIf(models.F('installs'), 0))
 
 
 class Metric(models.Model):
@@ -17,12 +34,10 @@ class Metric(models.Model):
         IOS = 'ios', _('iOS')
 
     date = models.DateField()
-    channel = models.CharField(
-        max_length=250,
-    )
-    country = CountryField()
-    os = models.CharField(
-        max_length=10,
+    channel = DimensionField(dimension='channel')
+    country = DimensionField(dimension='country', choices=countries)
+    os = DimensionField(
+        dimension='os',
         choices=OSChoices.choices,
         default=OSChoices.ANDROID,
     )
@@ -33,3 +48,263 @@ class Metric(models.Model):
     revenue = models.FloatField()
 
     objects = MetricQuerySet.as_manager()
+
+    class Meta:
+        constraints = (
+            # The natural key, a row per date and dimensions. Its index serves filtering
+            # by `date` / `date_range` with optional equality filters
+            models.UniqueConstraint(
+                fields=('date', 'country', 'os', 'channel'),
+                name='metric_natural_key',
+            ),
+        )
+        indexes = (
+            # Equality filter on a single dimension combined with `date_range`,
+            # the same indexes serve GROUP BY on a single dimension
+            models.Index(fields=('country', 'date'), name='metric_country_date_idx'),
+            models.Index(fields=('os', 'date'), name='metric_os_date_idx'),
+            models.Index(fields=('channel', 'date'), name='metric_channel_date_idx'),
+            # Keyset pagination by the default ordering
+            models.Index(fields=('date', 'id'), name='metric_date_id_idx'),
+            # GROUP BY on any leading subset of `channel,country,os`, the additive columns
+            # make it covering: the totals are summed from the index without reading the table
+            models.Index(
+                fields=('channel', 'country', 'os', 'date', 'impressions', 'clicks', 'installs', 'spend', 'revenue'),
+                name='metric_dims_date_idx',
+            ),
+        )
+
+
+class MetricRollup(models.Model):
+    """Pre-aggregated totals of the additive `Metric` columns.
+
+    Concrete rollups add dimension fields named the same way as in `Metric` and list them
+    in the `dimensions` attribute. Rollups are rebuilt from `Metric` by `refresh_rollups`.
+
+    """
+    dimensions: Tuple[str, ...] = ()
+
+    impressions = models.BigIntegerField()
+    clicks = models.BigIntegerField()
+    installs = models.BigIntegerField()
+    spend = models.FloatField()
+    revenue = models.FloatField()
+
+    objects = DimensionQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class MetricChannelCountryOSRollup(MetricRollup):
+    """Totals per (channel, country, os) for all dates."""
+    dimensions = ('channel', 'country', 'os')
+
+    channel = DimensionField(dimension='channel')
+    country = DimensionField(dimension='country', choices=countries)
+    os = DimensionField(dimension='os', choices=Metric.OSChoices.choices)
+
+    class Meta:
+        unique_together = ('channel', 'country', 'os')
+        indexes = (
+            # Covers CPI and spend by channel of a country
+            models.Index(
+                fields=('country', 'channel', 'spend', 'installs'),
+                name='rollup_country_cpi_idx',
+            ),
+        )
+
+
+class MetricDateCountryRollup(MetricRollup):
+    """Daily totals per country."""
+    dimensions = ('date', 'country')
+
+    date = models.DateField()
+    country = DimensionField(dimension='country', choices=countries)
+
+    class Meta:
+        unique_together = ('date', 'country')
+
+
+class MetricDateOSRollup(MetricRollup):
+    """Daily totals per operating system."""
+    dimensions = ('date', 'os')
+
+    date = models.DateField()
+    os = DimensionField(dimension='os', choices=Metric.OSChoices.choices)
+
+    class Meta:
+        unique_together = ('date', 'os')
+        indexes = (
+            # Covers daily installs of an operating system
+            models.Index(fields=('os', 'date', 'installs'), name='rollup_os_installs_idx'),
+        )
+
+
+class PendingDimensionCode:
+    """Code created by a transaction, cached for other connections after the commit."""
+
+    def __init__(self, db: str, dimension: str, value: str, code: int):
+        self.db, self.dimension, self.value, self.code = db, dimension, value, code
+
+    def __call__(self):
+        # Callbacks executed before the commit, e.g. by tests, leave the code not cached
+        if not connections[self.db].in_atomic_block:
+            DimensionCodeManager.uncommitted.discard((self.db, self.dimension, self.value, self.code))
+            DimensionCodeManager.add_to_cache(self.db, self.dimension, {self.value: self.code})
+
+
+class DimensionCodeManager(models.Manager):
+    """Codes of dimension values cached per database like `ContentType` objects.
+
+    A connection uses codes created by its transaction right away, other connections
+    cache them after the commit, so codes of rolled back rows are never used.
+    The cache is cleared after migrations and by `flush`.
+
+    """
+    # {database: {dimension: ({value: code}, {code: value})}}
+    cache: Dict[str, Dict[str, Tuple[Dict[str, int], Dict[int, str]]]] = {}
+    # (database, dimension, value, code) created by transactions not known to be committed
+    uncommitted: Set[Tuple[str, str, str, int]] = set()
+
+    @classmethod
+    def add_to_cache(cls, db: str, dimension: str, codes: Dict[str, int]):
+        cached_codes, cached_values = cls.cache.setdefault(db, {}).setdefault(dimension, ({}, {}))
+        cached_codes.update(codes)
+        cached_values.update((code, value) for value, code in codes.items())
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.uncommitted.clear()
+
+    def get_code(self, dimension: str, value: str, using: Optional[str] = None, create: bool = False) -> Optional[int]:
+        """Get code of a value, None for unknown values unless `create` adds the value."""
+        db = using or (router.db_for_write(self.model) if create else router.db_for_read(self.model))
+        try:
+            return self.cache[db][dimension][0][value]
+        except KeyError:
+            pass
+        codes = self._get_pending(db, dimension)
+        if value not in codes:
+            codes = self._load(db, dimension)
+        if value not in codes and create:
+            codes[value] = self._create(db, dimension, value)
+        return codes.get(value)
+
+    def get_value(self, dimension: str, code: int, using: Optional[str] = None) -> Optional[str]:
+        """Get value of a code, None for unknown codes."""
+        db = using or router.db_for_read(self.model)
+        try:
+            return self.cache[db][dimension][1][code]
+        except KeyError:
+            pass
+        values = {code: value for value, code in self._get_pending(db, dimension).items()}
+        if code not in values:
+            values = {code: value for value, code in self._load(db, dimension).items()}
+        return values.get(code)
+
+    @staticmethod
+    def _get_pending(db: str, dimension: str) -> Dict[str, int]:
+        """Get codes created by the current transaction of the connection."""
+        return {
+            pending.value: pending.code
+            for _, pending in connections[db].run_on_commit
+            if isinstance(pending, PendingDimensionCode) and pending.dimension == dimension
+        }
+
+    def _load(self, db: str, dimension: str) -> Dict[str, int]:
+        """Get stored codes of the dimension, cache the committed ones."""
+        codes = dict(self.using(db).filter(dimension=dimension).values_list('value', 'id'))
+        self.add_to_cache(db, dimension, {
+            value: code for value, code in codes.items()
+            if (db, dimension, value, code) not in self.uncommitted
+        })
+        return codes
+
+    def _create(self, db: str, dimension: str, value: str) -> int:
+        code = self.db_manager(db).get_or_create(dimension=dimension, value=value)[0].pk
+        self.uncommitted.add((db, dimension, value, code))
+        transaction.on_commit(PendingDimensionCode(db, dimension, value, code), using=db)
+        return code
+
+
+class DimensionCode(models.Model):
+    """Small integer code of a `Metric` dimension value, see `DimensionField`.
+
+    Codes are created when a value is saved for the first time and never change.
+
+    """
+    id = models.SmallAutoField(primary_key=True)
+    dimension = models.CharField(max_length=20)
+    value = models.CharField(max_length=250)
+
+    objects = DimensionCodeManager()
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('dimension', 'value'), name='dimension_code_value'),
+        )
+
+
+class DataVersion(models.Model):
+    """Counter of `Metric` data changes.
+
+    The only row is created on the first change. Use `versioning` functions to access it.
+
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    # Version of the last change other than adding new rows
+    rewrite_version = models.PositiveBigIntegerField(default=0)
+
+
+class MetricQueryJob(models.Model):
+    """Metrics API query run in the background by `jobs`.
+
+    Jobs with the same key, i.e. the same data version and query parameters, share the work:
+    there is at most one queued or running job per key. The rows of a done job are stored
+    in `MetricQueryJobPage` pages of `page_size` rows.
+
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    IN_FLIGHT_STATUSES = (Status.PENDING, Status.RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    key = models.CharField(max_length=64)
+    query_string = models.TextField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    row_count = models.PositiveIntegerField(null=True)
+    page_size = models.PositiveIntegerField(null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('key', ),
+                condition=models.Q(status__in=('pending', 'running')),
+                name='metric_query_job_in_flight_key',
+            ),
+        )
+        indexes = (
+            models.Index(fields=('key', 'created_at'), name='metric_query_job_key_idx'),
+        )
+
+
+class MetricQueryJobPage(models.Model):
+    """Page of the rows of a done `MetricQueryJob`, pages are numbered from 0."""
+    job = models.ForeignKey(MetricQueryJob, on_delete=models.CASCADE, related_name='pages')
+    number = models.PositiveIntegerField()
+    rows = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(fields=('job', 'number'), name='metric_query_job_page_number'),
+        )
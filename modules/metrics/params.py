@@ -0,0 +1,52 @@
+from typing import Dict, List, Union
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.http import QueryDict
+
+# Parameters with comma-separated columns. The order of columns is kept: it is the order
+# of the response columns, and of the rolled up columns and `grouping` bits with `totals`
+COLUMN_LIST_PARAMS = (
+    'group_by',
+    'display_columns',
+)
+# Parameters with multiple values, the order of values does not change the result
+MULTIPLE_VALUE_PARAMS = (
+    'country',
+)
+DATE_PARAMS = (
+    'date',
+    'date_range_after',
+    'date_range_before',
+)
+
+
+def normalize_query_params(query_params: QueryDict) -> Dict[str, Union[str, List[str]]]:
+    """Get canonical form of query parameters.
+
+    Requests with the same normalized parameters return the same data.
+
+    """
+    normalized = {}
+    for param in sorted(query_params):
+        values = query_params.getlist(param)
+        if param in COLUMN_LIST_PARAMS:
+            normalized[param] = ','.join(
+                column.strip() for column in values[-1].split(',') if column.strip()
+            )
+        elif param in MULTIPLE_VALUE_PARAMS:
+            normalized[param] = sorted(set(values))
+        elif param in DATE_PARAMS:
+            normalized[param] = _normalize_date(values[-1])
+        else:
+            normalized[param] = values[-1]
+    return normalized
+
+
+def _normalize_date(value: str) -> str:
+    """Convert date in any format accepted by filters to ISO format."""
+    try:
+        date = forms.DateField().clean(value)
+    except ValidationError:
+        return value
+    return date.isoformat() if date else value
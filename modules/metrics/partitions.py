@@ -0,0 +1,356 @@
+"""
+Monthly partitions of the `Metric` table.
+
+PostgreSQL partitions the table natively by ranges of `date`, the planner skips partitions
+not matching date filters. SQLite has no partitioning: per-month tables hold rows of their months,
+the `metrics_metric` table holds rows of months without a table, and the compilers of
+`modules.metrics.backends.sqlite3` route queries to the tables matching date filters.
+"""
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection as default_connection
+from django.db import transaction
+from django.db.models.expressions import Col
+from django.db.models.lookups import Lookup
+from django.db.models.sql.where import AND, WhereNode
+
+from .exceptions import PartitionError
+from .models import Metric
+
+PARTITIONED_TABLE = Metric._meta.db_table
+PARTITION_PREFIX = f'{PARTITIONED_TABLE}_p'
+DETACHED_PREFIX = f'{PARTITIONED_TABLE}_detached_p'
+SQLITE_BACKEND = 'modules.metrics.backends.sqlite3'
+# Rows moved between SQLite partitions by a statement, below the limit of query parameters
+MOVED_ROWS_BATCH_SIZE = 500
+
+
+def get_month(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def get_partition_table(month: date) -> str:
+    return f'{PARTITION_PREFIX}{month:%Y%m}'
+
+
+def get_detached_table(month: date) -> str:
+    return f'{DETACHED_PREFIX}{month:%Y%m}'
+
+
+def parse_partition_table(table: str) -> Optional[date]:
+    """Get month of a partition table name, None for other tables."""
+    suffix = table[len(PARTITION_PREFIX):]
+    if not table.startswith(PARTITION_PREFIX) or len(suffix) != 6 or not suffix.isdigit():
+        return None
+    return date(int(suffix[:4]), int(suffix[4:]), 1)
+
+
+def get_date_bounds(where: WhereNode, alias: str = PARTITIONED_TABLE) -> Tuple[Optional[date], Optional[date]]:
+    """Get the first and the last date matching the WHERE clause, None when not bounded.
+
+    Only lookups on `date` combined by AND are taken into account, other conditions
+    can only narrow the matching rows.
+
+    """
+    lower, upper = None, None
+    if where.connector != AND or where.negated:
+        return lower, upper
+
+    for child in where.children:
+        if isinstance(child, WhereNode):
+            child_lower, child_upper = get_date_bounds(child, alias)
+        elif (
+            isinstance(child, Lookup)
+            and isinstance(child.lhs, Col)
+            and child.lhs.alias == alias
+            and child.lhs.target.name == 'date'
+            and child.rhs_is_direct_value()
+        ):
+            child_lower, child_upper = _get_lookup_bounds(child.lookup_name, child.rhs)
+        else:
+            continue
+
+        if child_lower is not None:
+            lower = child_lower if lower is None else max(lower, child_lower)
+        if child_upper is not None:
+            upper = child_upper if upper is None else min(upper, child_upper)
+
+    return lower, upper
+
+
+def _get_lookup_bounds(lookup_name: str, value) -> Tuple[Optional[date], Optional[date]]:
+    if lookup_name == 'exact':
+        return value, value
+    if lookup_name in ('gt', 'gte'):
+        return value, None
+    if lookup_name in ('lt', 'lte'):
+        return None, value
+    if lookup_name == 'range':
+        return tuple(value)
+    if lookup_name == 'in' and value:
+        return min(value), max(value)
+    return None, None
+
+
+def select_partitions(
+        partitions: Dict[date, str],
+        lower: Optional[date],
+        upper: Optional[date],
+) -> List[str]:
+    """Get tables of the partitions overlapping the date range in the month order."""
+    return [
+        table for month, table in sorted(partitions.items())
+        if (upper is None or month <= upper) and (lower is None or add_months(month, 1) > lower)
+    ]
+
+
+class PartitionBackend:
+    """Create, list, detach and drop monthly partitions of `Metric` on a database."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get_partitions(self) -> Dict[date, str]:
+        """Get tables of the attached partitions by their months."""
+        raise NotImplementedError
+
+    def create_partition(self, month: date) -> bool:
+        """Create the partition of a month. Return False when it already exists."""
+        raise NotImplementedError
+
+    def detach_partition(self, month: date) -> str:
+        """Exclude the partition from `Metric` keeping its table renamed. Return the new table name."""
+        raise NotImplementedError
+
+    def drop_partition(self, month: date):
+        raise NotImplementedError
+
+    def delete_unpartitioned_rows(self, before: date) -> int:
+        """Delete rows before the date stored outside of the partitions. Return the number of rows."""
+        return 0
+
+    def ensure_partitions(self, dates: Iterable[date]) -> List[date]:
+        """Create missing partitions required to insert rows of the dates. Return created months."""
+        existing = self.get_partitions()
+        months = sorted({get_month(day) for day in dates}.difference(existing))
+        return [month for month in months if self.create_partition(month)]
+
+    def quote_name(self, name: str) -> str:
+        return self.connection.ops.quote_name(name)
+
+
+class PostgreSQLPartitionBackend(PartitionBackend):
+    """Declarative partitions `PARTITION OF metrics_metric FOR VALUES FROM (...) TO (...)`.
+
+    There is no default partition, rows can be inserted only for dates having a partition.
+
+    """
+
+    def get_partitions(self) -> Dict[date, str]:
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'WHERE parent.relname = %s',
+                [PARTITIONED_TABLE],
+            )
+            tables = [table for table, in cursor.fetchall()]
+        return {
+            month: table for month, table in ((parse_partition_table(table), table) for table in tables)
+            if month is not None
+        }
+
+    def create_partition(self, month: date) -> bool:
+        if month in self.get_partitions():
+            return False
+
+        qn = self.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE {qn(get_partition_table(month))} PARTITION OF {qn(PARTITIONED_TABLE)} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [month, add_months(month, 1)],
+            )
+        return True
+
+    def detach_partition(self, month: date) -> str:
+        qn, table, detached_table = self.quote_name, get_partition_table(month), get_detached_table(month)
+        with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {qn(PARTITIONED_TABLE)} DETACH PARTITION {qn(table)}')
+            cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(detached_table)}')
+        return detached_table
+
+    def drop_partition(self, month: date):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {self.quote_name(get_partition_table(month))}')
+
+
+class SQLitePartitionBackend(PartitionBackend):
+    """Per-month tables with the `Metric` columns and indexes.
+
+    A created partition takes rows of its month from `metrics_metric`.
+    The list of partitions is cached for the connection until the database schema changes.
+
+    """
+
+    def get_partitions(self) -> Dict[date, str]:
+        # The raw connection keeps the lookups out of the queries log
+        self.connection.ensure_connection()
+        database = self.connection.connection
+        schema_version = database.execute('PRAGMA schema_version').fetchone()[0]
+        cached_version, partitions = getattr(self.connection, 'metric_partitions', (None, {}))
+        if cached_version != schema_version:
+            tables = database.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                [f'{PARTITION_PREFIX}%'],
+            ).fetchall()
+            partitions = {
+                month: table for month, table in ((parse_partition_table(table), table) for table, in tables)
+                if month is not None
+            }
+            self.connection.metric_partitions = (schema_version, partitions)
+        return partitions
+
+    def create_partition(self, month: date) -> bool:
+        if not self.connection.ops.compiler_module.startswith(SQLITE_BACKEND):
+            raise PartitionError(
+                f'Partitions are not queried by the SQLite backend, set ENGINE to "{SQLITE_BACKEND}"'
+            )
+        if month in self.get_partitions():
+            return False
+
+        qn, table = self.quote_name, get_partition_table(month)
+        columns = ', '.join(qn(field.column) for field in Metric._meta.concrete_fields)
+        params = [month, add_months(month, 1)]
+        with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+            for statement in self.get_partition_schema(table):
+                cursor.execute(statement)
+            cursor.execute(
+                f'INSERT INTO {qn(table)} ({columns}) SELECT {columns} FROM {qn(PARTITIONED_TABLE)} '
+                f'WHERE {qn("date")} >= %s AND {qn("date")} < %s',
+                params,
+            )
+            cursor.execute(
+                f'DELETE FROM {qn(PARTITIONED_TABLE)} WHERE {qn("date")} >= %s AND {qn("date")} < %s',
+                params,
+            )
+        return True
+
+    def detach_partition(self, month: date) -> str:
+        qn, detached_table = self.quote_name, get_detached_table(month)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {qn(get_partition_table(month))} RENAME TO {qn(detached_table)}')
+        return detached_table
+
+    def drop_partition(self, month: date):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {self.quote_name(get_partition_table(month))}')
+
+    def delete_unpartitioned_rows(self, before: date) -> int:
+        qn = self.quote_name
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {qn(PARTITIONED_TABLE)} WHERE {qn("date")} < %s', [before])
+            return cursor.rowcount
+
+    def ensure_partitions(self, dates: Iterable[date]) -> List[date]:
+        """Rows of months without partitions stay in `metrics_metric`, nothing to create."""
+        return []
+
+    def move_misplaced_rows(self, tables: Iterable[str]) -> int:
+        """Move rows of the tables to the tables of their months, e.g. after an UPDATE of `date`.
+
+        Return the number of moved rows.
+
+        """
+        partitions = self.get_partitions()
+        qn = self.quote_name
+        columns = ', '.join(qn(field.column) for field in Metric._meta.concrete_fields)
+        moved = 0
+        with transaction.atomic(using=self.connection.alias, savepoint=False), self.connection.cursor() as cursor:
+            for table in tables:
+                month = parse_partition_table(table)
+                if month is not None:
+                    condition, params = f'{qn("date")} < %s OR {qn("date")} >= %s', [month, add_months(month, 1)]
+                elif partitions:
+                    placeholders = ', '.join(['%s'] * len(partitions))
+                    condition, params = f"strftime('%%Y-%%m-01', {qn('date')}) IN ({placeholders})", list(partitions)
+                else:
+                    continue
+                cursor.execute(f'SELECT {qn("id")}, {qn("date")} FROM {qn(table)} WHERE {condition}', params)
+
+                ids_by_table = {}
+                for pk, day in cursor.fetchall():
+                    target = partitions.get(get_month(date.fromisoformat(str(day)[:10])), PARTITIONED_TABLE)
+                    ids_by_table.setdefault(target, []).append(pk)
+                for target, ids in ids_by_table.items():
+                    for start in range(0, len(ids), MOVED_ROWS_BATCH_SIZE):
+                        batch = ids[start:start + MOVED_ROWS_BATCH_SIZE]
+                        id_list = f'{qn("id")} IN ({", ".join(["%s"] * len(batch))})'
+                        cursor.execute(
+                            f'INSERT INTO {qn(target)} ({columns}) SELECT {columns} FROM {qn(table)} WHERE {id_list}',
+                            batch,
+                        )
+                        cursor.execute(f'DELETE FROM {qn(table)} WHERE {id_list}', batch)
+                    moved += len(ids)
+        return moved
+
+    def reserve_ids(self, count: int) -> range:
+        """Reserve ids of rows inserted to partitions in the `AUTOINCREMENT` sequence of `metrics_metric`."""
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [PARTITIONED_TABLE])
+            row = cursor.fetchone()
+            last_id = row[0] if row else 0
+            if row:
+                cursor.execute(
+                    'UPDATE sqlite_sequence SET seq = %s WHERE name = %s',
+                    [last_id + count, PARTITIONED_TABLE],
+                )
+            else:
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                    [PARTITIONED_TABLE, last_id + count],
+                )
+        return range(last_id + 1, last_id + count + 1)
+
+    def get_partition_schema(self, table: str) -> List[str]:
+        """Get statements creating a table and indexes like the ones of `metrics_metric`.
+
+        The index names get the partition suffix, SQLite index names are unique in the database.
+
+        """
+        qn, suffix = self.quote_name, table[len(PARTITION_PREFIX):]
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT type, name, sql FROM sqlite_master WHERE tbl_name = %s AND sql IS NOT NULL '
+                "ORDER BY type = 'index'",
+                [PARTITIONED_TABLE],
+            )
+            schema = cursor.fetchall()
+
+        statements = []
+        for object_type, name, sql in schema:
+            sql = sql.replace(qn(PARTITIONED_TABLE), qn(table), 1)
+            if object_type == 'index':
+                sql = sql.replace(qn(name), qn(f'{name}_p{suffix}'), 1)
+            statements.append(sql)
+        return statements
+
+
+PARTITION_BACKENDS = {
+    'postgresql': PostgreSQLPartitionBackend,
+    'sqlite': SQLitePartitionBackend,
+}
+
+
+def get_partition_backend(connection=default_connection) -> PartitionBackend:
+    backend_class = PARTITION_BACKENDS.get(connection.vendor)
+    if backend_class is None:
+        raise PartitionError(f'Partitioning is not supported for "{connection.vendor}"')
+    return backend_class(connection)
@@ -0,0 +1,123 @@
+from datetime import date
+from functools import reduce
+from operator import or_
+from typing import Iterable, Optional, Tuple, Type
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+
+from .models import (
+    Metric,
+    MetricChannelCountryOSRollup,
+    MetricDateCountryRollup,
+    MetricDateOSRollup,
+    MetricRollup,
+)
+
+ROLLUP_MODELS: Tuple[Type[MetricRollup], ...] = (
+    MetricChannelCountryOSRollup,
+    MetricDateCountryRollup,
+    MetricDateOSRollup,
+)
+
+ADDITIVE_COLUMNS = (
+    'impressions',
+    'clicks',
+    'installs',
+    'spend',
+    'revenue',
+)
+DIMENSIONS = ('date', 'channel', 'country', 'os')
+# Rollup keys refreshed by a query, bounded by the expression depth limit of SQLite
+KEYS_BATCH_SIZE = 100
+
+
+def refresh_rollups(dates: Optional[Iterable] = None, rows: Optional[Iterable[dict]] = None):
+    """Rebuild rollup tables from `Metric` data.
+
+    When `dates` passed, rollups having the `date` dimension are rebuilt only for these dates.
+    When `rows` passed, dicts with `channel`, `country` and `os` of the changed rows, rollups
+    without the `date` dimension are rebuilt only for their values, otherwise completely.
+
+    """
+    dates = None if dates is None else list(dates)
+    rows = None if rows is None else list(rows)
+    with transaction.atomic():
+        for rollup_model in ROLLUP_MODELS:
+            if 'date' in rollup_model.dimensions:
+                refresh_rollup(rollup_model, dates)
+            elif rows is not None:
+                refresh_rollup_keys(rollup_model, rows)
+            else:
+                refresh_rollup(rollup_model)
+
+
+def refresh_rollups_for_rows(rows: Iterable[dict]):
+    """Rebuild the rollup rows covering changed `Metric` rows, e.g. their old and new values.
+
+    `rows` are dicts with `date`, `channel`, `country` and `os` of the changed rows.
+    Only the rollup rows with the same dimension values are recomputed, from the `Metric` rows
+    having these values.
+
+    """
+    rows = list(rows)
+    with transaction.atomic():
+        for rollup_model in ROLLUP_MODELS:
+            refresh_rollup_keys(rollup_model, rows)
+
+
+def expire_rollups(before: date):
+    """Remove rollup rows before the date and rebuild rollups without the `date` dimension.
+
+    Used after removing all `Metric` rows before the date.
+
+    """
+    with transaction.atomic():
+        for rollup_model in ROLLUP_MODELS:
+            if 'date' in rollup_model.dimensions:
+                rollup_model.objects.filter(date__lt=before).delete()
+            else:
+                refresh_rollup(rollup_model)
+
+
+def refresh_rollup_keys(rollup_model: Type[MetricRollup], rows: list):
+    """Rebuild the rollup rows with the dimension values of `rows` by batches of keys."""
+    keys = list({tuple(row[name] for name in rollup_model.dimensions) for row in rows})
+    for start in range(0, len(keys), KEYS_BATCH_SIZE):
+        refresh_rollup(rollup_model, keys=keys[start:start + KEYS_BATCH_SIZE])
+
+
+def refresh_rollup(rollup_model: Type[MetricRollup], dates: Optional[list] = None, keys: Optional[list] = None):
+    """Replace rollup rows with totals computed by a single INSERT ... SELECT query.
+
+    `dates` or `keys`, tuples of values of the rollup dimensions, limit the replaced rows.
+
+    """
+    rollup_rows = rollup_model.objects.all()
+    metrics = Metric.objects.all()
+    if dates is not None:
+        rollup_rows = rollup_rows.filter(date__in=dates)
+        metrics = metrics.filter(date__in=dates)
+    if keys is not None:
+        if not keys:
+            return
+        condition = reduce(or_, (Q(**dict(zip(rollup_model.dimensions, key))) for key in keys))
+        rollup_rows = rollup_rows.filter(condition)
+        metrics = metrics.filter(condition)
+    rollup_rows.delete()
+
+    totals = metrics.values(*rollup_model.dimensions).annotate(
+        **{column: Sum(column) for column in ADDITIVE_COLUMNS}
+    ).order_by()
+    select_sql, params = totals.query.sql_with_params()
+
+    qn = connection.ops.quote_name
+    columns = ', '.join(
+        qn(rollup_model._meta.get_field(name).column)
+        for name in (*rollup_model.dimensions, *ADDITIVE_COLUMNS)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {qn(rollup_model._meta.db_table)} ({columns}) {select_sql}',
+            params,
+        )
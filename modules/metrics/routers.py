@@ -0,0 +1,185 @@
+"""
+Routing of the metrics API reads to read replicas of the `default` database.
+
+Only reads inside `replica_reads()`, i.e. of the metrics API views, go to the replicas
+listed in `METRICS_DATABASE_REPLICAS`. Writes, management commands and the admin
+always use `default`. After a write of a metrics model, reads of the same client are pinned
+to `default` for `METRICS_REPLICA_PIN_SECONDS` to hide the replication lag.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Callable, List, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.decorators import sync_and_async_middleware
+
+APP_LABEL = 'metrics'
+REPLICA_SELECTIONS = ('round_robin', 'least_loaded')
+DEFAULT_PIN_SECONDS = 5.0
+PIN_COOKIE_NAME = 'metrics_primary_until'
+
+
+class PrimaryPin:
+    """Time until which reads of a request go to `default`, shared by the threads of the request."""
+
+    def __init__(self, until: float = 0.0):
+        self.until = until
+
+    @property
+    def active(self) -> bool:
+        return time.time() < self.until
+
+    def extend(self, seconds: float):
+        self.until = max(self.until, time.time() + seconds)
+
+
+class ReplicaChoice:
+    """Replica selected for all reads of a request, so its queries see the same replication state."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alias: Optional[str] = None
+
+    def get_alias(self, select: Callable[[], str]) -> str:
+        with self.lock:
+            if self.alias is None:
+                self.alias = select()
+            return self.alias
+
+
+_replica_choice: ContextVar[Optional[ReplicaChoice]] = ContextVar('metrics_replica_choice', default=None)
+_primary_pin: ContextVar[Optional[PrimaryPin]] = ContextVar('metrics_primary_pin', default=None)
+
+
+@contextmanager
+def replica_reads():
+    """Send reads of the metrics models to a replica."""
+    token = _replica_choice.set(ReplicaChoice())
+    try:
+        yield
+    finally:
+        _replica_choice.reset(token)
+
+
+@contextmanager
+def primary_pin(pin: PrimaryPin):
+    token = _primary_pin.set(pin)
+    try:
+        yield pin
+    finally:
+        _primary_pin.reset(token)
+
+
+def get_replicas() -> List[str]:
+    return list(getattr(settings, 'METRICS_DATABASE_REPLICAS', []))
+
+
+def get_pin_seconds() -> float:
+    return getattr(settings, 'METRICS_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+class ReplicaLoad:
+    """Number of queries in progress on every replica of the process.
+
+    The instance is a database execute wrapper installed on the replica connections.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        alias = context['connection'].alias
+        with self.lock:
+            self.in_flight[alias] += 1
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.in_flight[alias] -= 1
+
+    def get(self, alias: str) -> int:
+        return self.in_flight[alias]
+
+
+replica_load = ReplicaLoad()
+
+
+class MetricReplicaRouter:
+    """Database router sending the metrics API reads to the replicas.
+
+    A replica is selected once per `replica_reads()` block by `METRICS_REPLICA_SELECTION`:
+      - `round_robin` - the replicas in turn;
+      - `least_loaded` - the replica with the fewest queries in progress, in turn on ties.
+
+    The replicas are copies of `default`, they are not migrated.
+
+    """
+
+    def __init__(self):
+        self.counter = count()
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        replicas, choice, pin = get_replicas(), _replica_choice.get(), _primary_pin.get()
+        if not replicas or model._meta.app_label != APP_LABEL or choice is None:
+            return None
+        if pin is not None and pin.active:
+            return None
+        return choice.get_alias(lambda: self.select_replica(replicas))
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        pin = _primary_pin.get()
+        if pin is not None and model._meta.app_label == APP_LABEL:
+            pin.extend(get_pin_seconds())
+        return None
+
+    def allow_migrate(self, db, app_label, **hints) -> Optional[bool]:
+        return False if db in get_replicas() else None
+
+    def select_replica(self, replicas: List[str]) -> str:
+        start = next(self.counter)
+        ordered = [replicas[(start + index) % len(replicas)] for index in range(len(replicas))]
+        selection = getattr(settings, 'METRICS_REPLICA_SELECTION', 'round_robin')
+        if selection not in REPLICA_SELECTIONS:
+            raise ImproperlyConfigured(f'Unknown METRICS_REPLICA_SELECTION: {selection}')
+        if selection == 'least_loaded':
+            return min(ordered, key=replica_load.get)
+        return ordered[0]
+
+
+@sync_and_async_middleware
+def primary_pinning_middleware(get_response):
+    """Pin reads of a client to `default` after its writes by a cookie with the pin end time."""
+
+    def get_pin(request) -> PrimaryPin:
+        try:
+            return PrimaryPin(float(request.COOKIES.get(PIN_COOKIE_NAME, 0)))
+        except ValueError:
+            return PrimaryPin()
+
+    def set_cookie(response, pin: PrimaryPin, initial_until: float):
+        if pin.until > initial_until:
+            response.set_cookie(PIN_COOKIE_NAME, f'{pin.until:.3f}', max_age=get_pin_seconds() + 1)
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with primary_pin(get_pin(request)) as pin:
+                initial_until = pin.until
+                response = await get_response(request)
+            return set_cookie(response, pin, initial_until)
+    else:
+        def middleware(request):
+            with primary_pin(get_pin(request)) as pin:
+                initial_until = pin.until
+                response = get_response(request)
+            return set_cookie(response, pin, initial_until)
+
+    return middleware
@@ -0,0 +1,84 @@
+import threading
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import DimensionCode, Metric
+from .rollups import DIMENSIONS, refresh_rollups_for_rows
+from .routers import get_replicas, replica_load
+from .versioning import bump_data_version
+
+
+class PendingMetricChanges:
+    """Dimension values of the `Metric` rows changed in a transaction.
+
+    Rollups are refreshed and the data version is bumped once, after the commit,
+    so e.g. a bulk delete in admin does not recompute rollups per row.
+
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.append_only = True
+
+    def add(self, rows, append_only: bool):
+        self.rows.extend(rows)
+        self.append_only = self.append_only and append_only
+
+    def __call__(self):
+        _pending.changes = None
+        refresh_rollups_for_rows(self.rows)
+        bump_data_version(append_only=self.append_only)
+
+
+_pending = threading.local()
+
+
+def add_metric_changes(rows, append_only: bool):
+    changes = getattr(_pending, 'changes', None)
+    # Callbacks of rolled back transactions are discarded
+    if changes is None or not any(func is changes for _, func in transaction.get_connection().run_on_commit):
+        changes = _pending.changes = PendingMetricChanges()
+        changes.add(rows, append_only)
+        transaction.on_commit(changes)
+    else:
+        changes.add(rows, append_only)
+
+
+def get_dimensions(instance: Metric) -> dict:
+    """Get dimension values of a metric converted like values loaded from the database."""
+    return {name: Metric._meta.get_field(name).to_python(getattr(instance, name)) for name in DIMENSIONS}
+
+
+@receiver(pre_save, sender=Metric)
+def metric_saving(sender, instance: Metric, **kwargs):
+    """Remember dimensions of a changed metric, its old rollup rows are refreshed too."""
+    instance._stored_dimensions = None
+    if instance.pk is not None:
+        instance._stored_dimensions = Metric.objects.filter(pk=instance.pk).values(*DIMENSIONS).first()
+
+
+@receiver(post_save, sender=Metric)
+@receiver(post_delete, sender=Metric)
+def metric_changed(sender, instance: Metric, created: bool = False, **kwargs):
+    """Keep rollups and the data version up to date on changes of single metrics, e.g. in admin."""
+    rows = [get_dimensions(instance)]
+    stored = getattr(instance, '_stored_dimensions', None)
+    if stored is not None and stored != rows[0]:
+        rows.append(stored)
+    add_metric_changes(rows, append_only=created)
+
+
+@receiver(connection_created)
+def replica_connection_created(sender, connection, **kwargs):
+    """Count queries in progress on the replicas for the `least_loaded` replica selection."""
+    if connection.alias in get_replicas() and replica_load not in connection.execute_wrappers:
+        connection.execute_wrappers.append(replica_load)
+
+
+@receiver(post_migrate)
+def clear_dimension_codes(sender, **kwargs):
+    """Forget cached dimension codes, migrations and `flush` may change the stored codes."""
+    DimensionCode.objects.clear_cache()
@@ -0,0 +1,121 @@
+"""
+Synthetic `Metric` data for benchmarks.
+"""
+import csv
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+from .loaders import COLUMNS, Batch
+
+DIMENSIONS = ('channel', 'country', 'os')
+COUNT_COLUMNS = ('impressions', 'clicks', 'installs')
+MONEY_COLUMNS = ('spend', 'revenue')
+
+
+DEFAULT_ROWS_PER_DAY = 1000
+
+
+class SyntheticMetricGenerator:
+    """Generate rows resembling a sample file.
+
+    A date has a row per dimensions like the stored data, so the rows of a day are distinct
+    `(channel, country, os)`. They are drawn by systematic sampling with the probability
+    of dimensions proportional to their number of sample rows, so the channel, country and os
+    distributions of the sample are kept. Such probabilities limit a day to the sample rows divided
+    by the rows of the most frequent dimensions: larger days add channel variants like `facebook_1`,
+    every variant has all the sample dimensions of its channel with the same weights.
+    Numeric values are taken from a random sample row with the drawn dimensions and scaled
+    by a log-normal factor. Every day has `rows_per_day` rows starting from `start_date`.
+
+    """
+
+    def __init__(
+            self,
+            sample: TextIO,
+            start_date: date = date(2017, 5, 1),
+            rows_per_day: int = DEFAULT_ROWS_PER_DAY,
+            seed: int = 0,
+            noise: float = 0.5,
+    ):
+        if rows_per_day <= 0:
+            raise ValueError(f'Invalid number of rows per day: {rows_per_day}')
+
+        self.random = random.Random(seed)
+        self.sample_rows = self._read_sample(sample)
+        sample_weights = {dimensions: len(rows) for dimensions, rows in self.sample_rows.items()}
+        max_variant_rows = sum(sample_weights.values()) // max(sample_weights.values())
+
+        # Drawn dimensions mapped to the sample dimensions of their values
+        self.sample_dimensions: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self.weights: Dict[Tuple[str, ...], int] = {}
+        for variant in range(-(-rows_per_day // max_variant_rows)):
+            for (channel, *other), weight in sample_weights.items():
+                dimensions = (f'{channel}_{variant}' if variant else channel, *other)
+                self.sample_dimensions[dimensions] = (channel, *other)
+                self.weights[dimensions] = weight
+        self.dimensions = list(self.weights)
+        self.total_weight = sum(self.weights.values())
+
+        self.start_date = start_date
+        self.rows_per_day = rows_per_day
+        self.noise = noise
+        self.day: Optional[date] = None
+        self.day_dimensions: List[Tuple[str, ...]] = []
+
+    def iter_batches(self, rows: int, batch_size: int = 5000) -> Iterator[Batch]:
+        """Generate `rows` rows of text values in `COLUMNS` order by batches."""
+        self.day = None
+        for start in range(0, rows, batch_size):
+            yield Batch([self.get_row(index) for index in range(start, min(start + batch_size, rows))])
+
+    def write(self, file: TextIO, rows: int, batch_size: int = 5000):
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for batch in self.iter_batches(rows, batch_size):
+            writer.writerows(batch.rows)
+
+    def get_row(self, index: int) -> List[str]:
+        day = self.start_date + timedelta(days=index // self.rows_per_day)
+        if day != self.day:
+            self.day = day
+            self.day_dimensions = self._draw_day_dimensions()
+
+        dimensions = self.day_dimensions[index % self.rows_per_day]
+        values = self.random.choice(self.sample_rows[self.sample_dimensions[dimensions]])
+        scale = self.random.lognormvariate(0, self.noise)
+        return [
+            day.isoformat(),
+            *dimensions,
+            *(str(round(values[column] * scale)) for column in COUNT_COLUMNS),
+            *(f'{values[column] * scale:.2f}' for column in MONEY_COLUMNS),
+        ]
+
+    def _draw_day_dimensions(self) -> List[Tuple[str, ...]]:
+        """Draw `rows_per_day` distinct dimensions of a day.
+
+        Dimensions in random order take intervals of `rows_per_day * weight` on a line
+        of `rows_per_day * total_weight`, the points `total_weight` apart starting from a random one
+        select the dimensions. An interval is not longer than the step, so it holds one point at most.
+
+        """
+        point, end = self.random.randrange(self.total_weight), 0
+        drawn = []
+        for dimensions in self.random.sample(self.dimensions, len(self.dimensions)):
+            end += self.rows_per_day * self.weights[dimensions]
+            if end > point:
+                drawn.append(dimensions)
+                point += self.total_weight
+        return drawn
+
+    @staticmethod
+    def _read_sample(sample: TextIO) -> Dict[Tuple[str, ...], List[Dict[str, float]]]:
+        """Group numeric values of sample rows by dimensions."""
+        sample_rows = defaultdict(list)
+        for row in csv.DictReader(sample):
+            dimensions = tuple(row[column] for column in DIMENSIONS)
+            sample_rows[dimensions].append({
+                column: float(row[column]) for column in COUNT_COLUMNS + MONEY_COLUMNS
+            })
+        return dict(sample_rows)
@@ -8,7 +8,7 @@ metric_data = [
     dict(date='2017-05-18', channel='adcolony',         country='CA', os='ios',     impressions=3, clicks=7, installs=4, spend=4, revenue=11,),  # noqa
     dict(date='2017-05-17', channel='apple_search_ads', country='GB', os='android', impressions=4, clicks=6, installs=4, spend=3, revenue=12,),  # noqa
     dict(date='2017-05-17', channel='apple_search_ads', country='GB', os='ios',     impressions=5, clicks=4, installs=5, spend=4, revenue=14,),  # noqa
-    dict(date='2017-05-17', channel='apple_search_ads', country='GB', os='android', impressions=6, clicks=5, installs=6, spend=6, revenue=16,),  # noqa
+    dict(date='2017-05-18', channel='apple_search_ads', country='GB', os='android', impressions=6, clicks=5, installs=6, spend=6, revenue=16,),  # noqa
     dict(date='2017-05-17', channel='chartboost',       country='FR', os='ios',     impressions=7, clicks=3, installs=7, spend=4, revenue=18,),  # noqa
     dict(date='2017-05-17', channel='chartboost',       country='GB', os='android', impressions=8, clicks=2, installs=8, spend=8, revenue=20,),  # noqa
     dict(date='2017-05-17', channel='chartboost',       country='US', os='ios',     impressions=9, clicks=1, installs=9, spend=8, revenue=22,),  # noqa
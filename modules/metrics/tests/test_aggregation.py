@@ -1,9 +1,18 @@
+import operator
+from datetime import date
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+
+from django.db import connection
+from django.db.models import Q, Sum
 from django.db.utils import NotSupportedError
 from django.test import TestCase
 
-from ..aggregations import MetricAggregator
+from ..aggregations import AggregationResult, MetricAggregator, NumpyMetricAggregator, np
 from ..exceptions import AggregationError
-from ..models import Metric
+from ..models import Metric, MetricDateOSRollup
+from ..rollups import refresh_rollups
+from ..versioning import bump_data_version
 from .data import metric_data
 
 
@@ -14,6 +23,7 @@ class MetricAggregatorTestCase(TestCase):
         cls.metrics = Metric.objects.bulk_create([
             Metric(**data) for data in metric_data
         ])
+        refresh_rollups()
         cls.aggregator = MetricAggregator()
         cls.queryset = Metric.objects.all()
 
@@ -210,4 +220,527 @@ class MetricAggregatorTestCase(TestCase):
             with self.subTest(expected=expected_data[i], actual=result[i]):
                 self.assertDictEqual(expected_data[i], result[i])
 
+    def test_ratio_metrics(self):
+        """Ratio metrics computed from sums of their columns."""
+        display_columns = ['clicks', 'ctr', 'cr', 'roas', 'cpi']
+        queryset = self.aggregator.aggregate(self.queryset, ['channel'], display_columns)
+        with self.assertNumQueries(1):
+            result = list(queryset.order_by('channel'))
+
+        for row, metrics in zip(result, (self.metrics[0:3], self.metrics[3:6], self.metrics[6:9])):
+            totals = {
+                column: sum(getattr(metric, column) for metric in metrics)
+                for column in ('impressions', 'clicks', 'installs', 'spend', 'revenue')
+            }
+            expected = dict(
+                channel=metrics[0].channel,
+                clicks=totals['clicks'],
+                ctr=totals['clicks'] / totals['impressions'],
+                cr=totals['installs'] / totals['clicks'],
+                roas=totals['revenue'] / totals['spend'],
+                cpi=totals['spend'] / totals['installs'],
+            )
+            with self.subTest(channel=expected['channel']):
+                self.assertListEqual(list(row), list(expected))
+                self.assertEqual(row['clicks'], expected['clicks'])
+                for column in ('ctr', 'cr', 'roas', 'cpi'):
+                    self.assertAlmostEqual(row[column], expected[column])
+
+    def test_ratio_metrics_division_by_zero(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Metric.objects.create(
+                date='2017-05-17', channel='vungle', country='US', os='ios',
+                impressions=0, clicks=0, installs=0, spend=0, revenue=0,
+            )
+        queryset = self.queryset.filter(channel='vungle')
+        result = self.aggregator.aggregate(queryset, ['channel'], ['ctr', 'cr', 'roas', 'cpi'])
+        self.assertDictEqual(result[0], dict(channel='vungle', ctr=None, cr=None, roas=None, cpi=None))
+
+    def test_other_aggregations(self):
+        display_columns = ['clicks__avg', 'clicks__max', 'spend__min', 'installs__count', 'clicks', 'ctr']
+        queryset = self.aggregator.aggregate(self.queryset, ['channel'], display_columns)
+        with self.assertNumQueries(1):
+            result = list(queryset.order_by('channel'))
+
+        metrics = self.metrics[0:3]
+        clicks = [metric.clicks for metric in metrics]
+        self.assertDictEqual(result[0], dict(
+            channel='adcolony',
+            clicks_avg=sum(clicks) / len(clicks),
+            clicks_max=max(clicks),
+            spend_min=min(metric.spend for metric in metrics),
+            installs_count=len(metrics),
+            clicks=sum(clicks),
+            ctr=sum(clicks) / sum(metric.impressions for metric in metrics),
+        ))
+
+    def test_ordering_by_derived_metric(self):
+        for column in ('ctr', 'roas', 'clicks_avg'):
+            with self.subTest(ordering=column):
+                result = self.aggregator.aggregate(
+                    self.queryset, ['channel', 'country'], ['roas', 'ctr', 'clicks__avg'],
+                ).order_by(f'-{column}')
+                values = [row[column] for row in result]
+                self.assertListEqual(values, sorted(values, reverse=True))
+
+    def test_aggregation_error_not_supported_ratio_aggregation(self):
+        for display_columns in (['cpi__avg'], ['ctr__max'], ['unknown']):
+            with self.subTest(display_columns=display_columns):
+                with self.assertRaises(AggregationError):
+                    self.aggregator.aggregate(self.queryset, ['channel'], display_columns)
+
+
+class GroupingSetsAggregationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**dict(data, date=data['date'].replace('2017-05', month)))
+            for month in ('2017-05', '2017-06')
+            for data in metric_data
+        ])
+        refresh_rollups()
+        cls.aggregator = MetricAggregator()
+        cls.queryset = Metric.objects.filter(country__in=['US', 'GB', 'CA'])
+        cls.grouping_sets = [('channel', ), ('country', 'os'), ('date__month', 'channel'), ('channel', )]
+        cls.display_columns = [
+            'clicks', 'cpi', 'spend__avg', 'installs__max', 'revenue__min', 'impressions__count',
+        ]
+
+    def assertSameRows(self, expected, actual, key):
+        self.assertEqual(len(expected), len(actual))
+        actual = {tuple(row[column] for column in key): row for row in actual}
+        for expected_row in expected:
+            actual_row = actual[tuple(expected_row[column] for column in key)]
+            self.assertCountEqual(expected_row, actual_row)
+            for column, value in expected_row.items():
+                self.assertAlmostEqual(value, actual_row[column])
+
+    def test_same_results_as_separate_aggregations(self):
+        with self.assertNumQueries(1):
+            result = self.aggregator.aggregate_grouping_sets(
+                self.queryset, self.grouping_sets, self.display_columns,
+            )
+
+        for grouping_set in self.grouping_sets:
+            with self.subTest(grouping_set=grouping_set):
+                expected = self.aggregator.aggregate(self.queryset, list(grouping_set), self.display_columns)
+                self.assertSameRows(list(expected), result[grouping_set], grouping_set)
+
+    def test_grand_total(self):
+        result = self.aggregator.aggregate_grouping_sets(self.queryset, [()], ['installs', 'ctr'])
+        expected = self.queryset.aggregate(
+            installs=Sum('installs'), clicks=Sum('clicks'), impressions=Sum('impressions'),
+        )
+        self.assertListEqual(result[()], [{
+            'installs': expected['installs'],
+            'ctr': expected['clicks'] / expected['impressions'],
+        }])
+
+        queryset = self.queryset.filter(channel='unknown')
+        result = self.aggregator.aggregate_grouping_sets(queryset, [(), ('os', )], ['installs', 'ctr'])
+        self.assertDictEqual(result, {(): [{'installs': None, 'ctr': None}], ('os', ): []})
+
+    @skipUnless(connection.vendor in MetricAggregator.grouping_sets_vendors, 'GROUPING SETS not supported')
+    def test_grouping_sets_same_as_python(self):
+        result = self.aggregator.aggregate_grouping_sets(
+            self.queryset, self.grouping_sets, self.display_columns,
+        )
+        with patch.object(MetricAggregator, 'grouping_sets_vendors', ()):
+            expected = self.aggregator.aggregate_grouping_sets(
+                self.queryset, self.grouping_sets, self.display_columns,
+            )
+
+        for grouping_set in self.grouping_sets:
+            with self.subTest(grouping_set=grouping_set):
+                self.assertSameRows(expected[grouping_set], result[grouping_set], grouping_set)
+
+
+class TotalsAggregationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.aggregator = MetricAggregator()
+        cls.queryset = Metric.objects.all()
+        cls.group_by = ['channel', 'country']
+        cls.display_columns = ['clicks', 'cpi']
+
+    def get_expected_rows(self, group_by: list, grouping: int) -> list:
+        if group_by:
+            rows = self.aggregator.aggregate(self.queryset, group_by, self.display_columns)
+        else:
+            rows = [self.queryset.aggregate(clicks=Sum('clicks'), spend=Sum('spend'), installs=Sum('installs'))]
+        return [
+            {
+                'channel': row.get('channel'),
+                'country': row.get('country'),
+                'clicks': row['clicks'],
+                'cpi': row['cpi'] if 'cpi' in row else row['spend'] / row['installs'],
+                'grouping': grouping,
+            }
+            for row in rows
+        ]
+
+    def aggregate(self, totals: str) -> list:
+        with self.assertNumQueries(1):
+            return list(self.aggregator.aggregate_with_totals(
+                self.queryset, self.group_by, self.display_columns, totals,
+            ))
+
+    def assertSameRows(self, expected, actual):
+        key = operator.itemgetter('grouping', 'channel', 'country')
+        expected, actual = sorted(expected, key=str), sorted(actual, key=str)
+        self.assertListEqual([key(row) for row in expected], [key(row) for row in actual])
+        for expected_row, row in zip(expected, actual):
+            self.assertEqual(expected_row['clicks'], row['clicks'])
+            self.assertAlmostEqual(expected_row['cpi'], row['cpi'])
+
+    def test_rollup(self):
+        result = self.aggregate('rollup')
+        expected = [
+            *self.get_expected_rows(['channel', 'country'], 0),
+            *self.get_expected_rows(['channel'], 1),
+            *self.get_expected_rows([], 3),
+        ]
+        self.assertSameRows(expected, result)
+        # Totals follow their groups
+        self.assertListEqual(
+            [(row['channel'], row['grouping']) for row in result],
+            [
+                ('adcolony', 0), ('adcolony', 0), ('adcolony', 1),
+                ('apple_search_ads', 0), ('apple_search_ads', 1),
+                ('chartboost', 0), ('chartboost', 0), ('chartboost', 0), ('chartboost', 1),
+                (None, 3),
+            ],
+        )
+
+    def test_cube(self):
+        expected = [
+            *self.get_expected_rows(['channel', 'country'], 0),
+            *self.get_expected_rows(['channel'], 1),
+            *self.get_expected_rows(['country'], 2),
+            *self.get_expected_rows([], 3),
+        ]
+        self.assertSameRows(expected, self.aggregate('cube'))
+
+    def test_grand_total(self):
+        expected = [
+            *self.get_expected_rows(['channel', 'country'], 0),
+            *self.get_expected_rows([], 3),
+        ]
+        self.assertSameRows(expected, self.aggregate('grand'))
+
+    def test_not_supported_totals(self):
+        with self.assertRaises(AggregationError):
+            self.aggregator.aggregate_with_totals(self.queryset, self.group_by, self.display_columns, 'all')
+
+
+class TopAggregationTestCase(TestCase):
 
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        cls.aggregator = MetricAggregator(use_rollups=False)
+        cls.queryset = Metric.objects.all()
+        cls.group_by = ['channel', 'country']
+        cls.display_columns = ['installs', 'cpi']
+
+    def aggregate_top(self, top, top_by, top_partition=None) -> list:
+        with self.assertNumQueries(1):
+            result = self.aggregator.aggregate_top(
+                self.queryset, self.group_by, self.display_columns, top, top_by, top_partition,
+            )
+        return [(row['channel'], row['country']) for row in result]
+
+    def test_top_per_partition(self):
+        self.assertListEqual(self.aggregate_top(2, '-installs', 'channel'), [
+            ('adcolony', 'CA'), ('adcolony', 'US'),
+            ('apple_search_ads', 'GB'),
+            ('chartboost', 'US'), ('chartboost', 'GB'),
+        ])
+
+    def test_top_by_cpi(self):
+        self.assertListEqual(self.aggregate_top(1, 'cpi', 'channel'), [
+            ('adcolony', 'CA'), ('apple_search_ads', 'GB'), ('chartboost', 'FR'),
+        ])
+
+    def test_top_without_partition(self):
+        self.assertListEqual(self.aggregate_top(3, '-installs'), [
+            ('apple_search_ads', 'GB'), ('chartboost', 'US'), ('chartboost', 'GB'),
+        ])
+
+    def test_values_same_as_aggregation(self):
+        expected = self.aggregator.aggregate(self.queryset, self.group_by, self.display_columns)
+        result = self.aggregator.aggregate_top(self.queryset, self.group_by, self.display_columns, 10, 'cpi')
+        self.assertListEqual(list(expected.order_by('cpi')), list(result))
+
+    def test_same_as_in_memory(self):
+        cases = ((2, '-installs', 'channel'), (1, 'cpi', 'country'), (4, '-cpi', None))
+        for top, top_by, top_partition in cases:
+            with self.subTest(top=top, top_by=top_by, top_partition=top_partition):
+                expected = self.aggregator.aggregate_top(
+                    self.queryset, self.group_by, self.display_columns, top, top_by, top_partition,
+                )
+                rows = AggregationResult(list(
+                    self.aggregator.aggregate(self.queryset, self.group_by, self.display_columns)
+                ))
+                with patch.object(self.aggregator, 'aggregate', return_value=rows):
+                    result = self.aggregator.aggregate_top(
+                        self.queryset, self.group_by, self.display_columns, top, top_by, top_partition,
+                    )
+                self.assertIsInstance(result, AggregationResult)
+                self.assertListEqual(list(expected), list(result))
+
+    def test_errors(self):
+        for top_by, top_partition in (('-clicks', None), ('installs', 'os'), ('installs', 'installs')):
+            with self.subTest(top_by=top_by, top_partition=top_partition):
+                with self.assertRaises(AggregationError):
+                    self.aggregator.aggregate_top(
+                        self.queryset, self.group_by, self.display_columns, 1, top_by, top_partition,
+                    )
+
+
+class ComparisonAggregationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            *(Metric(**data) for data in metric_data),
+            *(Metric(**dict(data, date='2016-05-18', installs=1)) for data in metric_data[:3]),
+        ])
+        refresh_rollups()
+        cls.aggregator = MetricAggregator()
+        cls.queryset = Metric.objects.all()
+
+    def aggregate(self, compare, start, end, group_by=('channel', ), display_columns=('installs', 'cpi')):
+        with self.assertNumQueries(1):
+            return {
+                row['channel']: row
+                for row in self.aggregator.aggregate_comparison(
+                    self.queryset, list(group_by), list(display_columns), compare, start, end,
+                )
+            }
+
+    def test_previous_period(self):
+        rows = self.aggregate('previous_period', date(2017, 5, 18), date(2017, 5, 18))
+        self.assertListEqual(list(rows), ['adcolony', 'apple_search_ads', 'chartboost'])
+        self.assertListEqual(list(rows['adcolony']), [
+            'channel', 'installs', 'cpi', 'installs_previous', 'cpi_previous', 'installs_delta', 'cpi_delta',
+        ])
+        adcolony = rows['adcolony']
+        self.assertEqual((adcolony['installs'], adcolony['installs_previous'], adcolony['installs_delta']), (4, 3, 1))
+        self.assertAlmostEqual(adcolony['cpi'], 1.0)
+        self.assertAlmostEqual(adcolony['cpi_previous'], 10 / 3)
+        self.assertAlmostEqual(adcolony['cpi_delta'], 1.0 - 10 / 3)
+        # No data in the current period
+        chartboost = rows['chartboost']
+        self.assertEqual((chartboost['installs'], chartboost['installs_previous']), (None, 24))
+        self.assertIsNone(chartboost['installs_delta'])
+        self.assertAlmostEqual(chartboost['cpi_previous'], 20 / 24)
+
+    def test_previous_year(self):
+        rows = self.aggregate('previous_year', date(2017, 5, 17), date(2017, 5, 18), display_columns=['installs'])
+        self.assertDictEqual(rows['adcolony'], {
+            'channel': 'adcolony', 'installs': 7, 'installs_previous': 3, 'installs_delta': 4,
+        })
+        self.assertListEqual(list(rows['adcolony']), ['channel', 'installs', 'installs_previous', 'installs_delta'])
+        self.assertDictEqual(rows['apple_search_ads'], {
+            'channel': 'apple_search_ads', 'installs': 15, 'installs_previous': None, 'installs_delta': None,
+        })
+
+    def test_other_aggregations(self):
+        rows = self.aggregate('previous_period', date(2017, 5, 18), date(2017, 5, 18), display_columns=['clicks__max'])
+        self.assertEqual(rows['adcolony']['clicks_max'], 7)
+        self.assertEqual(rows['adcolony']['clicks_max_previous'], 9)
+        self.assertEqual(rows['adcolony']['clicks_max_delta'], -2)
+
+    def test_comparison_periods(self):
+        periods = MetricAggregator.comparison_periods
+        self.assertTupleEqual(
+            periods['previous_period'](date(2017, 6, 1), date(2017, 6, 30)),
+            (date(2017, 5, 2), date(2017, 5, 31)),
+        )
+        self.assertTupleEqual(
+            periods['previous_year'](date(2020, 2, 1), date(2020, 2, 29)),
+            (date(2019, 2, 1), date(2019, 2, 28)),
+        )
+
+    def test_errors(self):
+        cases = (
+            ('previous_week', ['channel']),
+            ('previous_period', ['date']),
+            ('previous_period', ['date__month', 'os']),
+            ('previous_period', ['installs']),
+        )
+        for compare, group_by in cases:
+            with self.subTest(compare=compare, group_by=group_by):
+                with self.assertRaises(AggregationError):
+                    self.aggregator.aggregate_comparison(
+                        self.queryset, group_by, ['clicks'], compare, date(2017, 5, 17), date(2017, 5, 18),
+                    )
+        with self.assertRaises(AggregationError):
+            self.aggregator.aggregate_comparison(
+                self.queryset, ['os'], ['clicks'], 'previous_period', date(2017, 5, 18), date(2017, 5, 17),
+            )
+
+
+class DateBucketAggregationTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        dates = ['2017-03-31', '2017-04-02', '2017-04-03', '2017-06-30', '2017-07-01', '2018-01-01']
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**dict(data, date=date))
+            for date in dates
+            for data in metric_data[:2]
+        ])
+        refresh_rollups()
+        cls.aggregator = MetricAggregator()
+
+    def aggregate(self, group_by, **filters):
+        queryset = Metric.objects.filter(**filters)
+        result = self.aggregator.aggregate(queryset, group_by, ['installs'])
+        return list(result.order_by(*group_by))
+
+    def test_group_by_date_buckets(self):
+        day_installs = sum(data['installs'] for data in metric_data[:2])
+        cases = (
+            ('date__week', [('2017-03-27', 2), ('2017-04-03', 1), ('2017-06-26', 2), ('2018-01-01', 1)]),
+            ('date__month', [('2017-03-01', 1), ('2017-04-01', 2), ('2017-06-01', 1),
+                             ('2017-07-01', 1), ('2018-01-01', 1)]),
+            ('date__quarter', [('2017-01-01', 1), ('2017-04-01', 3), ('2017-07-01', 1), ('2018-01-01', 1)]),
+            ('date__year', [('2017-01-01', 5), ('2018-01-01', 1)]),
+        )
+        for bucket, expected_days in cases:
+            with self.subTest(bucket=bucket):
+                expected = [
+                    {bucket: date.fromisoformat(start), 'installs': days * day_installs}
+                    for start, days in expected_days
+                ]
+                self.assertListEqual(self.aggregate([bucket]), expected)
+
+    def test_date_bucket_with_dimension_and_filter(self):
+        result = self.aggregate(['date__month', 'os'], date__gte='2017-04-01', os='ios')
+        self.assertListEqual(
+            [(row['date__month'], row['os']) for row in result],
+            [(date(2017, 4, 1), 'ios'), (date(2017, 6, 1), 'ios'), (date(2017, 7, 1), 'ios'),
+             (date(2018, 1, 1), 'ios')],
+        )
+
+    def test_date_bucket_column_order(self):
+        for group_by in (['date__month', 'os'], ['os', 'date__month'], ['channel', 'date__week', 'country']):
+            with self.subTest(group_by=group_by):
+                queryset = self.aggregator.aggregate(Metric.objects.all(), group_by, ['installs', 'cpi'])
+                columns = [*group_by, 'installs', 'cpi']
+                self.assertListEqual(list(queryset.order_by(*group_by)[0]), columns)
+                self.assertListEqual(self.aggregator.get_columns(group_by, ['installs', 'cpi']), columns)
+
+    def test_ordering_by_date_bucket(self):
+        queryset = self.aggregator.aggregate(Metric.objects.all(), ['date__quarter'], ['clicks'])
+        result = [row['date__quarter'] for row in queryset.order_by('-date__quarter')]
+        self.assertListEqual(result, sorted(result, reverse=True))
+
+    def test_date_bucket_from_rollup(self):
+        queryset = self.aggregator.aggregate(Metric.objects.all(), ['date__month', 'os'], ['installs'])
+        self.assertIs(queryset.model, MetricDateOSRollup)
+
+
+@skipIf(np is None, 'numpy is not installed')
+class NumpyMetricAggregatorTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        bump_data_version(append_only=True)
+        cls.sql_aggregator = MetricAggregator(use_rollups=False)
+
+    display_columns = ['impressions', 'spend__sum', 'cpi', 'ctr', 'roas']
+
+    def setUp(self):
+        self.aggregator = NumpyMetricAggregator()
+
+    def assertSameAsSQL(self, queryset, group_by, display_columns):
+        result = self.aggregator.aggregate(queryset, group_by, display_columns)
+        expected = self.sql_aggregator.aggregate(queryset, group_by, display_columns)
+        self.assertIsInstance(result, AggregationResult)
+        self.assertListEqual(list(expected.order_by(*group_by)), list(result.order_by(*group_by)))
+
+    def test_same_results_as_sql(self):
+        querysets = (
+            Metric.objects.all(),
+            Metric.objects.filter(date='2017-05-17'),
+            Metric.objects.filter(date__gte='2017-05-18'),
+            Metric.objects.filter(date__lte='2017-05-17', os='ios'),
+            Metric.objects.filter(date__range=('2017-05-10', '2017-05-17')),
+            Metric.objects.filter(Q(country='US') | Q(country='GB')),
+            Metric.objects.filter(country__in=['CA', 'FR', 'DE']),
+            Metric.objects.filter(channel='unknown'),
+            Metric.objects.filter(channel__gt='apple_search_ads'),
+            Metric.objects.exclude(os='ios'),
+        )
+        group_by_cases = (
+            ['channel'],
+            ['date', 'os'],
+            ['country', 'channel', 'os', 'date'],
+            ['date__week', 'channel'],
+            ['os', 'date__month'],
+            ['date__quarter'],
+            ['date__year'],
+        )
+        for queryset in querysets:
+            for group_by in group_by_cases:
+                with self.subTest(where=str(queryset.query.where), group_by=group_by):
+                    self.assertSameAsSQL(queryset, group_by, self.display_columns)
+
+    def test_ordering_and_keyset_filter(self):
+        result = self.aggregator.aggregate(Metric.objects.all(), ['channel', 'country'], ['clicks'])
+        result = result.order_by('-clicks', 'channel')
+        clicks = [row['clicks'] for row in result]
+        self.assertListEqual(clicks, sorted(clicks, reverse=True))
+
+        filtered = result.filter(Q(clicks__lt=10) | Q(clicks=10, channel__gt='chartboost'))
+        self.assertTrue(all(row['clicks'] <= 10 for row in filtered))
+        self.assertEqual(filtered.ordering, ('-clicks', 'channel'))
+
+    def test_fallback_to_sql(self):
+        queryset = Metric.objects.filter(channel__icontains='ads')
+        result = self.aggregator.aggregate(queryset, ['channel'], ['installs'])
+        self.assertNotIsInstance(result, AggregationResult)
+
+    def test_no_group_by_fallback_to_sql(self):
+        self.aggregator = NumpyMetricAggregator(use_rollups=False)
+        for queryset in (Metric.objects.all(), Metric.objects.filter(channel='unknown')):
+            with self.subTest(where=str(queryset.query.where)):
+                result = self.aggregator.aggregate(queryset, [], self.display_columns)
+                self.assertNotIsInstance(result, AggregationResult)
+                self.assertListEqual(
+                    list(result.order_by('id')),
+                    list(self.sql_aggregator.aggregate(queryset, [], self.display_columns).order_by('id')),
+                )
+
+    def test_incremental_reload(self):
+        self.aggregator.aggregate(Metric.objects.all(), ['channel'], ['installs'])
+        Metric.objects.bulk_create([Metric(**dict(metric_data[0], channel='vungle'))])
+        bump_data_version(append_only=True)
+
+        with self.assertNumQueries(2):
+            # The data version and new rows
+            self.aggregator.aggregate(Metric.objects.all(), ['channel'], ['installs'])
+
+        self.assertEqual(len(self.aggregator.store), len(metric_data) + 1)
+        self.assertSameAsSQL(Metric.objects.all(), ['channel'], ['installs'])
+
+    def test_reload_after_rewrite(self):
+        self.aggregator.aggregate(Metric.objects.all(), ['channel'], ['installs'])
+        Metric.objects.filter(channel='adcolony').update(installs=100)
+        bump_data_version()
+
+        self.assertSameAsSQL(Metric.objects.all(), ['channel'], ['installs'])
@@ -1,9 +1,21 @@
+import json
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from ..aggregations import AggregationResult, MetricAggregator, np
+from ..loaders import COLUMNS
 from ..models import Metric
+from ..rollups import refresh_rollups
+from ..versioning import bump_data_version
 from .data import metric_data
 from ..api.serializers import MetricSerializer
 
@@ -15,8 +27,12 @@ class MetricApiTests(APITestCase):
         cls.metrics = Metric.objects.bulk_create([
             Metric(**data) for data in metric_data
         ])
+        refresh_rollups()
         cls.url = reverse('metric-list')
 
+    def setUp(self):
+        caches['metrics'].clear()
+
     def test_no_aggregation_all_columns_presented(self):
         response = self.client.get(self.url, format='json')
         actual_data = response.data['results'][0]
@@ -60,6 +76,137 @@ class MetricApiTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(actual_data), 6)
 
+    def test_ordering_by_derived_metrics(self):
+        data = {'group_by': 'channel,country', 'display_columns': 'ctr,roas,clicks__avg'}
+        for column in ('ctr', '-roas', '-clicks_avg'):
+            with self.subTest(ordering=column):
+                response = self.client.get(self.url, dict(data, ordering=column), format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                values = [row[column.lstrip('-')] for row in response.data['results']]
+                self.assertListEqual(values, sorted(values, reverse=column.startswith('-')))
+
+    def test_totals(self):
+        data = {'group_by': 'os,channel', 'display_columns': 'installs,cpi', 'totals': 'rollup'}
+        response = self.client.get(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 6 + 2 + 1)
+        grand_total = response.data['results'][-1]
+        self.assertDictEqual(grand_total, {
+            'os': None,
+            'channel': None,
+            'installs': sum(data['installs'] for data in metric_data),
+            'cpi': sum(data['spend'] for data in metric_data) / sum(data['installs'] for data in metric_data),
+            'grouping': 3,
+        })
+
+        response = self.client.get(self.url, dict(data, ordering='-installs'), format='json')
+        self.assertDictEqual(response.data['results'][0], grand_total)
+
+    def test_totals_errors(self):
+        data = {'group_by': 'os', 'display_columns': 'installs'}
+        for params in ({'totals': 'all'}, {'totals': 'cube', 'pagination': 'cursor'}):
+            with self.subTest(params=params):
+                response = self.client.get(self.url, dict(data, **params), format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_top(self):
+        data = {
+            'group_by': 'channel,os',
+            'display_columns': 'installs,cpi',
+            'top': 1,
+            'top_by': '-installs',
+            'top_partition': 'channel',
+        }
+        response = self.client.get(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertListEqual(
+            [(row['channel'], row['os'], row['installs']) for row in response.data['results']],
+            [('adcolony', 'ios', 6), ('apple_search_ads', 'android', 10), ('chartboost', 'ios', 16)],
+        )
+
+        response = self.client.get(self.url, dict(data, ordering='-installs'), format='json')
+        self.assertListEqual([row['installs'] for row in response.data['results']], [16, 10, 6])
+
+    def test_top_errors(self):
+        data = {'group_by': 'os', 'display_columns': 'installs', 'top': 1, 'top_by': 'installs'}
+        cases = (
+            ({'top': 0}, 'top'),
+            ({'top': 'a'}, 'top'),
+            ({'top_by': ''}, 'top_by'),
+            ({'totals': 'grand'}, 'top'),
+            ({'pagination': 'cursor'}, 'top'),
+        )
+        for params, key in cases:
+            with self.subTest(params=params):
+                response = self.client.get(self.url, dict(data, **params), format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(key, response.data)
+
+        response = self.client.get(self.url, dict(data, top_by='clicks'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Aggregation error', response.data['error'])
+
+    def test_compare(self):
+        data = {
+            'group_by': 'channel',
+            'display_columns': 'installs,cpi',
+            'date_range_after': '2017-05-18',
+            'date_range_before': '2017-05-18',
+            'compare': 'previous_period',
+            'ordering': '-installs_previous',
+        }
+        response = self.client.get(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertListEqual(
+            [(row['channel'], row['installs'], row['installs_previous']) for row in response.data['results']],
+            [('chartboost', None, 24), ('apple_search_ads', 6, 9), ('adcolony', 4, 3)],
+        )
+        self.assertAlmostEqual(response.data['results'][-1]['cpi_delta'], 1.0 - 10 / 3)
+
+    def test_compare_errors(self):
+        data = {
+            'group_by': 'os',
+            'display_columns': 'installs',
+            'date_range_after': '2017-05-18',
+            'date_range_before': '2017-05-18',
+            'compare': 'previous_year',
+        }
+        cases = (
+            {'date_range_before': ''},
+            {'date_range_after': 'yesterday'},
+            {'totals': 'grand'},
+            {'top': 1, 'top_by': 'installs'},
+        )
+        for params in cases:
+            with self.subTest(params=params):
+                response = self.client.get(self.url, dict(data, **params), format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('compare', response.data)
+
+        response = self.client.get(self.url, dict(data, compare='previous_week'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Aggregation error', response.data['error'])
+
+    def test_dimension_values(self):
+        data = {
+            'group_by': 'channel,country,os',
+            'display_columns': 'installs',
+            'channel': 'chartboost',
+            'ordering': 'country',
+        }
+        response = self.client.get(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(
+            [(row['channel'], row['country'], row['os']) for row in response.data['results']],
+            [('chartboost', 'FR', 'ios'), ('chartboost', 'GB', 'android'), ('chartboost', 'US', 'ios')],
+        )
+
+        response = self.client.get(self.url, {'channel': 'unknown'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 0)
+
     def test_aggregation_error_not_supported_group_by_columns(self):
         data = {'group_by': 'installs', 'display_columns': 'spend'}
         response = self.client.get(self.url, data, format='json')
@@ -74,3 +221,697 @@ class MetricApiTests(APITestCase):
         data = {'group_by': 'os', 'display_columns': 'date'}
         response = self.client.get(self.url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricKeysetPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get_all_pages(self, data):
+        pages = []
+        url, params = self.url, dict(data, pagination='cursor', limit=2)
+        while url:
+            response = self.client.get(url, params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            url, params = response.data['next'], None
+        return pages
+
+    def assert_same_rows_as_offset_pagination(self, data):
+        """Compare rows and their order ignoring the order of rows with equal ordering values."""
+        pages = self.get_all_pages(data)
+        actual = [row for page in pages for row in page['results']]
+        expected = self.client.get(self.url, dict(data, limit=100), format='json').data['results']
+
+        ordering = [field.lstrip('-') for field in data['ordering'].split(',')]
+        self.assertListEqual(
+            [[row[field] for field in ordering] for row in expected],
+            [[row[field] for field in ordering] for row in actual],
+        )
+        self.assertCountEqual(
+            [tuple(row.items()) for row in expected],
+            [tuple(row.items()) for row in actual],
+        )
+        return pages
+
+    def test_raw_rows(self):
+        for ordering in ('date', '-cpi', 'channel,-installs', '-spend,date'):
+            with self.subTest(ordering=ordering):
+                pages = self.assert_same_rows_as_offset_pagination({'ordering': ordering})
+                self.assertEqual(len(pages), 5)
+
+    def test_aggregated_rows(self):
+        data = {'group_by': 'channel,country', 'display_columns': 'clicks,cpi'}
+        for ordering in ('-clicks', 'cpi', 'country'):
+            with self.subTest(ordering=ordering):
+                self.assert_same_rows_as_offset_pagination(dict(data, ordering=ordering))
+
+    def test_aggregated_rows_by_date_bucket(self):
+        data = {'group_by': 'date__month,os', 'display_columns': 'installs'}
+        for ordering in ('-date__month', 'installs'):
+            with self.subTest(ordering=ordering):
+                self.assert_same_rows_as_offset_pagination(dict(data, ordering=ordering))
+
+    def test_dimension_values_order(self):
+        # The code of a new value is greater than the codes of the values sorted after it
+        Metric.objects.create(**dict(metric_data[0], channel='aarki'))
+        for ordering in ('channel,date', '-channel,date'):
+            with self.subTest(ordering=ordering):
+                pages = self.assert_same_rows_as_offset_pagination({'ordering': ordering})
+                channels = [row['channel'] for page in pages for row in page['results']]
+                self.assertListEqual(channels, sorted(channels, reverse=ordering.startswith('-')))
+                self.assertIn('aarki', channels)
+
+    def test_previous_page(self):
+        pages = self.get_all_pages({'ordering': '-installs'})
+        response = self.client.get(pages[2]['previous'], format='json')
+        self.assertListEqual(response.data['results'], pages[1]['results'])
+        response = self.client.get(response.data['previous'], format='json')
+        self.assertListEqual(response.data['results'], pages[0]['results'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_next_page_after_previous_page(self):
+        pages = self.get_all_pages({'ordering': 'channel,country,os'})
+        previous = self.client.get(pages[1]['previous'], format='json')
+        self.assertListEqual(previous.data['results'], pages[0]['results'])
+        response = self.client.get(previous.data['next'], format='json')
+        self.assertListEqual(response.data['results'], pages[1]['results'])
+
+    def test_null_values_at_page_boundaries(self):
+        # NULL CPI of rows and groups without installs
+        Metric.objects.filter(channel='chartboost', country__in=['US', 'GB']).update(installs=0)
+        Metric.objects.filter(channel='adcolony', country='CA').update(installs=0)
+        refresh_rollups()
+        bump_data_version()
+
+        cases = (
+            {'ordering': 'cpi'},
+            {'ordering': '-cpi,date'},
+            {'group_by': 'channel,country', 'display_columns': 'installs,cpi', 'ordering': 'cpi'},
+            {'group_by': 'channel,country', 'display_columns': 'installs,cpi', 'ordering': '-cpi'},
+        )
+        aggregate = MetricAggregator.aggregate
+
+        def aggregate_in_memory(aggregator, *args):
+            return AggregationResult(list(aggregate(aggregator, *args)))
+
+        for data in cases:
+            with self.subTest(data=data):
+                pages = self.assert_same_rows_as_offset_pagination(data)
+                self.assertTrue(any(row['cpi'] is None for row in pages[0]['results'] + pages[-1]['results']))
+
+                previous = self.client.get(pages[-1]['previous'], format='json')
+                self.assertListEqual(previous.data['results'], pages[-2]['results'])
+
+            if 'group_by' in data:
+                with self.subTest(data=data, in_memory=True), \
+                        mock.patch.object(MetricAggregator, 'aggregate', aggregate_in_memory):
+                    caches['metrics'].clear()
+                    self.assert_same_rows_as_offset_pagination(data)
+
+    def test_invalid_cursor(self):
+        pages = self.get_all_pages({'ordering': 'date'})
+        cursor = pages[0]['next'].split('cursor=')[1].split('&')[0]
+        cases = (
+            {'cursor': 'invalid'},
+            {'cursor': cursor, 'ordering': 'channel'},
+        )
+        for data in cases:
+            with self.subTest(data=data):
+                response = self.client.get(self.url, dict(data, pagination='cursor'), format='json')
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_pagination_mode(self):
+        response = self.client.get(self.url, {'pagination': 'unknown'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricNoCountPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get(self, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, dict(data, pagination='nocount'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, [query['sql'] for query in queries]
+
+    def test_pages_without_count(self):
+        cases = (
+            {'ordering': '-installs'},
+            {'group_by': 'date,channel,country,os', 'display_columns': 'clicks,cpi', 'ordering': '-clicks,os'},
+        )
+        for data in cases:
+            with self.subTest(data=data):
+                expected = self.client.get(self.url, dict(data, limit=100), format='json').data['results']
+                first, queries = self.get(dict(data, limit=4))
+                self.assertFalse(any('COUNT(' in sql for sql in queries))
+                self.assertNotIn('count', first.data)
+                self.assertTrue(first.data['has_more'])
+                self.assertListEqual(first.data['results'], expected[:4])
+
+                rows, page = [], first.data
+                while page['has_more']:
+                    rows.extend(page['results'])
+                    page = self.client.get(page['next'], format='json').data
+                rows.extend(page['results'])
+                self.assertIsNone(page['next'])
+                self.assertListEqual(rows, expected)
+
+    def test_cached_count(self):
+        data = {'group_by': 'channel,country', 'display_columns': 'clicks', 'count': 'cached', 'limit': 2}
+        response, queries = self.get(data)
+        self.assertEqual(response.data['count'], 6)
+        self.assertFalse(response.data['count_estimated'])
+        self.assertTrue(any('COUNT(' in sql for sql in queries))
+
+        response, queries = self.get(dict(data, offset=2, ordering='-clicks'))
+        self.assertEqual(response.data['count'], 6)
+        self.assertFalse(any('COUNT(' in sql for sql in queries))
+
+        bump_data_version()
+        response, queries = self.get(dict(data, offset=2))
+        self.assertTrue(any('COUNT(' in sql for sql in queries))
+
+    def test_estimated_count_falls_back_to_cached_count(self):
+        response, _ = self.get({'count': 'estimate', 'os': 'ios'})
+        self.assertEqual(response.data['count'], 5)
+        self.assertFalse(response.data['count_estimated'])
+
+    def test_unknown_count_mode(self):
+        response = self.client.get(self.url, {'pagination': 'nocount', 'count': 'exact'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(METRICS_INSTRUMENTATION=True, METRICS_SLOW_REQUEST_THRESHOLD=0)
+class MetricInstrumentationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get_server_timing(self, response) -> dict:
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, duration, *_ = entry.split(';')
+            entries[name] = float(duration[len('dur='):])
+        return entries
+
+    def test_server_timing(self):
+        data = {'group_by': 'channel,country', 'display_columns': 'clicks'}
+        with self.assertLogs('modules.metrics.slow_requests'):
+            response = self.client.get(self.url, data, format='json')
+        timing = self.get_server_timing(response)
+        self.assertListEqual(
+            list(timing),
+            ['cache', 'filter', 'paginate', 'serialize', 'render', 'sql', 'count', 'total'],
+        )
+        self.assertGreaterEqual(timing['total'], timing['paginate'])
+        self.assertGreaterEqual(timing['paginate'], timing['count'])
+
+        # Cached response
+        with self.assertLogs('modules.metrics.slow_requests'):
+            response = self.client.get(self.url, data, format='json')
+        self.assertListEqual(list(self.get_server_timing(response)), ['cache', 'render', 'sql', 'total'])
+
+    def test_slow_request_log(self):
+        data = {'group_by': 'os,channel', 'display_columns': 'installs', 'country': ['US', 'CA']}
+        with self.assertLogs('modules.metrics.slow_requests') as logs:
+            self.client.get(self.url, data, format='json')
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record, logs.records[0].metrics_request)
+        self.assertDictEqual(
+            record['params'],
+            {'country': ['CA', 'US'], 'display_columns': 'installs', 'group_by': 'os,channel'},
+        )
+        self.assertEqual(record['status'], status.HTTP_200_OK)
+        self.assertEqual(record['sql_count'], len(record['sql']))
+        self.assertTrue(any(query['sql'].startswith('SELECT COUNT(*)') for query in record['sql']))
+
+    @override_settings(METRICS_SLOW_REQUEST_THRESHOLD=60)
+    def test_fast_request_not_logged(self):
+        with self.assertNoLogs('modules.metrics.slow_requests'):
+            response = self.client.get(self.url, format='json')
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(METRICS_INSTRUMENTATION=False)
+    def test_disabled(self):
+        with self.assertNoLogs('modules.metrics.slow_requests'):
+            response = self.client.get(self.url, format='json')
+        self.assertNotIn('Server-Timing', response)
+
+
+class MetricBatchApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-batch')
+        cls.list_url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def test_same_results_as_list_api(self):
+        filters = {'country': ['US', 'GB'], 'date_range_before': '2017-05-31'}
+        queries = [
+            {'group_by': 'channel', 'display_columns': 'clicks,cpi', 'ordering': '-clicks,channel'},
+            {'group_by': 'os,country', 'display_columns': 'installs,roas', 'ordering': 'os,country'},
+            {'group_by': 'date', 'display_columns': 'spend__max,clicks__avg', 'ordering': 'date'},
+        ]
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(self.url, {'filters': filters, 'queries': queries}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            len([query for query in captured if Metric._meta.db_table in query['sql']]), 1,
+        )
+
+        for query, rows in zip(queries, response.data['results']):
+            with self.subTest(query=query):
+                expected = self.client.get(self.list_url, dict(filters, **query), format='json')
+                expected = expected.data['results']
+                self.assertEqual(len(rows), len(expected))
+                for expected_row, row in zip(expected, rows):
+                    self.assertListEqual(list(row), list(expected_row))
+                    for column, value in expected_row.items():
+                        self.assertAlmostEqual(row[column], value)
+
+    def test_limit(self):
+        queries = [
+            {'group_by': 'channel,country', 'display_columns': 'clicks', 'ordering': '-clicks', 'limit': 2},
+        ]
+        response = self.client.post(self.url, {'queries': queries}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual([row['clicks'] for row in response.data['results'][0]], [17, 15])
+
+    def test_errors(self):
+        query = {'group_by': 'channel', 'display_columns': 'clicks'}
+        cases = (
+            {'queries': []},
+            {'queries': [{'group_by': 'channel'}]},
+            {'queries': [query], 'filters': {'date': 'invalid'}},
+            {'queries': [dict(query, group_by='installs')]},
+            {'queries': [dict(query, display_columns='clicks__rnd')]},
+            {'queries': [dict(query, ordering='-cpi')]},
+        )
+        for data in cases:
+            with self.subTest(data=data):
+                response = self.client.post(self.url, data, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MetricResponseCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+        cls.stats_url = reverse('metric-cache-stats')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get_stats(self):
+        return self.client.get(self.stats_url, format='json').data
+
+    def test_repeated_request_served_from_cache(self):
+        data = {'group_by': 'channel', 'display_columns': 'installs,cpi', 'ordering': '-cpi'}
+        first = self.client.get(self.url, data, format='json')
+
+        with self.assertNumQueries(1):
+            # Only the data version query
+            second = self.client.get(self.url, data, format='json')
+
+        self.assertEqual(first.data, second.data)
+        stats = self.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_ratio']), (1, 1, 0.5))
+
+    def test_normalized_params_share_cache_entry(self):
+        requests = (
+            {'group_by': 'channel,os', 'display_columns': 'installs,spend', 'country': ['US', 'GB'], 'date': '2017-05-17'},
+            {'display_columns': 'installs, spend', 'country': ['GB', 'US'], 'group_by': 'channel,os', 'date': '05/17/2017'},
+        )
+        for data in requests:
+            response = self.client.get(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.get_stats()['hits'], 1)
+
+    def test_group_by_order_not_shared_with_totals(self):
+        responses = [
+            self.client.get(self.url, {'group_by': group_by, 'display_columns': 'installs', 'totals': 'rollup'})
+            for group_by in ('channel,os', 'os,channel')
+        ]
+        self.assertEqual(self.get_stats()['hits'], 0)
+
+        caches['metrics'].clear()
+        expected = self.client.get(self.url, {'group_by': 'os,channel', 'display_columns': 'installs', 'totals': 'rollup'})
+        self.assertEqual(responses[1].json(), expected.json())
+        subtotals = {row['os'] for row in expected.data['results'] if row['grouping'] == 1}
+        self.assertSetEqual(subtotals, {'android', 'ios'})
+        self.assertNotEqual(responses[0].data['count'], responses[1].data['count'])
+
+    def test_data_version_invalidates_cache(self):
+        data = {'group_by': 'country', 'display_columns': 'installs'}
+        self.client.get(self.url, data, format='json')
+        Metric.objects.filter(country='CA').update(installs=100)
+        refresh_rollups()
+        bump_data_version()
+
+        response = self.client.get(self.url, data, format='json')
+
+        ca_installs = {row['country']: row['installs'] for row in response.data['results']}['CA']
+        self.assertEqual(ca_installs, 100)
+        self.assertEqual(self.get_stats()['hits'], 0)
+
+    def test_errors_not_cached(self):
+        data = {'group_by': 'installs', 'display_columns': 'spend'}
+        for _ in range(2):
+            response = self.client.get(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(self.get_stats()['misses'], 2)
+
+    @override_settings(METRICS_RESPONSE_CACHE=None)
+    def test_cache_disabled(self):
+        data = {'group_by': 'country', 'display_columns': 'installs'}
+        for _ in range(2):
+            self.client.get(self.url, data, format='json')
+
+        stats = self.get_stats()
+        self.assertFalse(stats['enabled'])
+        self.assertEqual(stats['hits'], 0)
+
+
+class MetricConditionalGetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, {'group_by': 'channel,os', 'display_columns': 'installs'})
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+        with self.assertNumQueries(1):
+            # Only the data version query
+            response = self.client.get(
+                self.url, {'display_columns': 'installs', 'group_by': 'channel, os'}, HTTP_IF_NONE_MATCH=etag,
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+        bump_data_version()
+        response = self.client.get(
+            self.url, {'group_by': 'channel,os', 'display_columns': 'installs'}, HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_params_and_format(self):
+        etags = {
+            self.client.get(self.url, params)['ETag']
+            for params in ({}, {'country': 'US'}, {'format': 'csv'}, {'format': 'json'})
+        }
+        self.assertEqual(len(etags), 4)
+
+    def test_errors_without_etag(self):
+        response = self.client.get(self.url, {'group_by': 'installs', 'display_columns': 'spend'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    @override_settings(METRICS_HTTP_CACHE_MAX_AGE=None)
+    def test_cache_control_disabled(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+
+class MetricColumnarFormatTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get_both_formats(self, params: dict):
+        columnar = self.client.get(self.url, {**params, 'format': 'columnar'}).json()
+        default = self.client.get(self.url, {**params, 'format': 'json'}).json()
+        return columnar, default
+
+    def test_same_data_as_default_format(self):
+        params_list = [
+            {'limit': 3, 'offset': 2},
+            {'group_by': 'channel,os', 'display_columns': 'installs,cpi', 'ordering': '-cpi'},
+            {'group_by': 'date__month', 'display_columns': 'installs'},
+            {'group_by': 'country', 'display_columns': 'spend', 'totals': 'grand'},
+            {'group_by': 'channel', 'display_columns': 'installs', 'top': 1, 'top_by': 'installs'},
+            {'pagination': 'nocount', 'limit': 2},
+        ]
+        for params in params_list:
+            with self.subTest(params=params):
+                columnar, default = self.get_both_formats(params)
+                columns = columnar.pop('columns')
+                rows = [dict(zip(columns, values)) for values in columnar.pop('data')]
+                self.assertListEqual(rows, default.pop('results'))
+                self.assertEqual(json.dumps(columnar).replace('columnar', 'json'), json.dumps(default))
+
+    def test_cursor_pagination(self):
+        params = {'group_by': 'channel,os', 'display_columns': 'installs', 'pagination': 'cursor', 'limit': 2}
+        page = self.client.get(self.url, {**params, 'format': 'columnar'}).json()
+        self.assertListEqual(page['columns'], ['channel', 'os', 'installs'])
+        self.assertListEqual(page['data'], [['adcolony', 'android', 1], ['adcolony', 'ios', 6]])
+
+        page = self.client.get(page['next']).json()
+        self.assertListEqual(page['data'], [['apple_search_ads', 'android', 10], ['apple_search_ads', 'ios', 5]])
+
+    def test_cached_columns_in_request_order(self):
+        for group_by in ('channel,os', 'os,channel', 'channel,os', 'date__month,os'):
+            columnar, default = self.get_both_formats({'group_by': group_by, 'display_columns': 'installs,clicks'})
+            self.assertListEqual(columnar['columns'], [*group_by.split(','), 'installs', 'clicks'])
+            self.assertListEqual(list(default['results'][0]), columnar['columns'])
+
+        columnar, _ = self.get_both_formats({'group_by': 'os', 'display_columns': 'clicks,installs'})
+        self.assertListEqual(columnar['columns'], ['os', 'clicks', 'installs'])
+
+    def test_empty_page_has_columns(self):
+        columnar, _ = self.get_both_formats({'group_by': 'os', 'display_columns': 'clicks', 'country': 'DE'})
+        self.assertEqual(columnar['columns'], ['os', 'clicks'])
+        self.assertEqual(columnar['data'], [])
+
+    def test_cached_separately(self):
+        params = {'group_by': 'os', 'display_columns': 'clicks'}
+        for _ in range(2):
+            columnar, default = self.get_both_formats(params)
+            self.assertIn('data', columnar)
+            self.assertIn('results', default)
+
+    def test_errors(self):
+        response = self.client.get(self.url, {'group_by': 'installs', 'display_columns': 'spend', 'format': 'columnar'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Aggregation error', response.json()['error'])
+
+
+class MetricExportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.url = reverse('metric-list')
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def get_export(self, data):
+        response = self.client.get(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def get_json_results(self, data):
+        return self.client.get(self.url, dict(data, format='json'), format='json').data['results']
+
+    def test_csv_raw_rows(self):
+        data = {'ordering': '-installs,channel', 'country': 'GB'}
+        content = self.get_export(dict(data, format='csv'))
+        expected = self.get_json_results(data)
+
+        header, *rows = content.splitlines()
+        self.assertEqual(header, ','.join(MetricSerializer.Meta.fields))
+        self.assertListEqual(
+            rows,
+            [','.join(str(value) for value in row.values()) for row in expected],
+        )
+
+    def test_ndjson_aggregated_rows(self):
+        data = {'group_by': 'channel,country', 'display_columns': 'clicks,cpi', 'ordering': '-clicks'}
+        content = self.get_export(dict(data, format='ndjson'))
+        expected = self.get_json_results(data)
+
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertListEqual(rows, [dict(row) for row in expected])
+
+    def test_csv_compared_periods(self):
+        data = {
+            'group_by': 'channel',
+            'display_columns': 'installs,cpi',
+            'date_range_after': '2017-05-18',
+            'date_range_before': '2017-05-18',
+            'compare': 'previous_period',
+            'ordering': 'channel',
+        }
+        content = self.get_export(dict(data, format='csv'))
+        expected = self.get_json_results(data)
+
+        header, *rows = content.splitlines()
+        self.assertEqual(header, ','.join(expected[0]))
+        self.assertEqual(header, 'channel,installs,cpi,installs_previous,cpi_previous,installs_delta,cpi_delta')
+        self.assertListEqual(
+            rows,
+            [','.join('' if value is None else str(value) for value in row.values()) for row in expected],
+        )
+
+    def test_export_not_paginated(self):
+        content = self.get_export({'format': 'ndjson', 'limit': 2})
+        self.assertEqual(len(content.splitlines()), len(metric_data))
+
+    def test_aggregation_error(self):
+        data = {'group_by': 'installs', 'display_columns': 'spend', 'format': 'csv'}
+        response = self.client.get(self.url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.startswith(b'error\r\n'))
+
+
+@skipIf(np is None, 'numpy is not installed')
+@override_settings(METRICS_RESPONSE_CACHE=None)
+class MetricNumpyAggregatorApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        bump_data_version(append_only=True)
+        cls.url = reverse('metric-list')
+
+    def test_same_responses_as_sql(self):
+        cases = (
+            {'group_by': 'channel,country', 'display_columns': 'clicks,cpi', 'ordering': '-clicks,channel'},
+            {'group_by': 'date', 'display_columns': 'installs', 'ordering': 'date', 'os': 'ios'},
+            {'group_by': 'os', 'display_columns': 'spend', 'country': ['US', 'GB'], 'limit': 1, 'offset': 1},
+            {'group_by': 'channel', 'display_columns': 'cpi', 'ordering': '-cpi', 'pagination': 'cursor'},
+            {'group_by': 'channel', 'display_columns': 'spend,cpi', 'format': 'csv'},
+        )
+        for data in cases:
+            with self.subTest(data=data):
+                expected = self.client.get(self.url, data)
+                with override_settings(
+                    METRICS_AGGREGATOR='modules.metrics.aggregations.NumpyMetricAggregator',
+                ):
+                    actual = self.client.get(self.url, data)
+
+                self.assertEqual(expected.status_code, status.HTTP_200_OK)
+                self.assertEqual(expected.getvalue(), actual.getvalue())
+
+
+class MetricIngestApiTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('loader')
+        cls.url = reverse('metric-ingest')
+        lines = [','.join(COLUMNS)] + [
+            ','.join(str(data[column]) for column in COLUMNS) for data in metric_data
+        ]
+        cls.csv_content = '\n'.join(lines) + '\n'
+        cls.ndjson_content = ''.join(json.dumps(data) + '\n' for data in metric_data)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def ingest(self, content: str, content_type: str = 'text/csv'):
+        return self.client.generic('POST', self.url, content.encode(), content_type=content_type)
+
+    def test_ingest_csv(self):
+        response = self.ingest(self.csv_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], len(metric_data))
+        self.assertIn('rows_per_second', response.data)
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+
+        # Sending corrected data again replaces the rows
+        response = self.ingest(self.csv_content.replace(',9,1,5,6', ',9,1,7,6'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+        self.assertEqual(Metric.objects.get(date='2017-05-17', channel='adcolony', os='android').spend, 7)
+
+    def test_ingest_ndjson(self):
+        response = self.ingest(self.ndjson_content, 'application/x-ndjson; charset=utf-8')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rows'], len(metric_data))
+        self.assertEqual(
+            self.client.get(reverse('metric-list'), format='json').data['count'], len(metric_data),
+        )
+
+    def test_errors(self):
+        response = self.ingest(self.csv_content.replace('2017-05-17', '2017-05-32'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Load error', response.data['error'])
+        self.assertFalse(Metric.objects.exists())
+
+        response = self.ingest(self.ndjson_content, 'application/json')
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        self.client.force_authenticate(None)
+        response = self.ingest(self.csv_content)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertFalse(Metric.objects.exists())
@@ -0,0 +1,97 @@
+import json
+import threading
+from urllib.parse import urlencode
+from unittest import mock
+
+from django.core.cache import caches
+from django.db.models import QuerySet
+from django.test import AsyncClient, TransactionTestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.pagination import LimitOffsetPagination
+
+from ..models import Metric
+from .data import metric_data
+
+
+class AsyncMetricApiTests(TransactionTestCase):
+    """Queries of the async view run on pool threads with their own connections, so the data is committed."""
+
+    def setUp(self):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        caches['metrics'].clear()
+        self.async_client = AsyncClient()
+        self.url = reverse('metric-list-async')
+        self.sync_url = reverse('metric-list')
+
+    async def get_json(self, url: str, params: dict):
+        response = await self.async_client.get(f'{url}?{urlencode(params)}')
+        # Page links of both views differ only by the path
+        return response.status_code, json.loads(response.content.decode().replace(url, self.sync_url))
+
+    async def test_same_responses_as_sync_view(self):
+        params_list = [
+            {'limit': 3, 'offset': 2},
+            {'group_by': 'channel,os', 'display_columns': 'installs,cpi', 'ordering': '-cpi'},
+            {'group_by': 'country', 'display_columns': 'spend', 'totals': 'grand', 'country': 'US'},
+            {'pagination': 'cursor', 'limit': 2},
+            {'pagination': 'nocount', 'count': 'cached'},
+            {'group_by': 'os', 'display_columns': 'clicks', 'format': 'columnar'},
+        ]
+        for params in params_list:
+            with self.subTest(params=params):
+                caches['metrics'].clear()
+                expected = await self.get_json(self.sync_url, params)
+                caches['metrics'].clear()
+                self.assertEqual(await self.get_json(self.url, params), expected)
+
+    async def test_errors(self):
+        status_code, data = await self.get_json(self.url, {'group_by': 'installs', 'display_columns': 'spend'})
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Aggregation error', data['error'])
+
+        status_code, data = await self.get_json(self.url, {'pagination': 'unknown'})
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('pagination', data)
+
+        response = await self.async_client.post(self.url, {})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_not_modified(self):
+        response = await self.async_client.get(self.url, {'group_by': 'os', 'display_columns': 'installs'})
+        etag = response['ETag']
+        # The async client sends extra arguments as raw headers
+        response = await self.async_client.get(
+            self.url, {'group_by': 'os', 'display_columns': 'installs'}, **{'If-None-Match': etag},
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    async def test_page_and_count_queries_concurrent(self):
+        # Both queries wait for each other, running them one after another breaks the barrier
+        barrier = threading.Barrier(2, timeout=5)
+        threads = set()
+        get_count = LimitOffsetPagination.get_count
+        fetch_all = QuerySet._fetch_all
+
+        def wait_and_get_count(paginator, queryset):
+            threads.add(threading.current_thread().name)
+            barrier.wait()
+            return get_count(paginator, queryset)
+
+        def wait_and_fetch_all(queryset):
+            if queryset.model is Metric and queryset.query.is_sliced and queryset._result_cache is None:
+                threads.add(threading.current_thread().name)
+                barrier.wait()
+            return fetch_all(queryset)
+
+        with mock.patch.object(LimitOffsetPagination, 'get_count', wait_and_get_count), \
+                mock.patch.object(QuerySet, '_fetch_all', wait_and_fetch_all):
+            status_code, data = await self.get_json(self.url, {'limit': 5})
+
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(data['count'], len(metric_data))
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('metrics-db') for name in threads))
@@ -0,0 +1,173 @@
+import csv
+import json
+import os
+import tempfile
+from collections import Counter
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase
+
+from ..models import Metric
+from ..rollups import refresh_rollups
+from ..synthetic import SyntheticMetricGenerator
+from .data import metric_data
+
+
+class SyntheticMetricGeneratorTestCase(TestCase):
+
+    def setUp(self):
+        with open(settings.BASE_DIR / 'dataset.csv') as sample:
+            self.sample_rows = list(csv.DictReader(sample))
+            sample.seek(0)
+            self.generator = SyntheticMetricGenerator(sample, rows_per_day=30)
+
+    def generate(self, rows: int) -> list:
+        output = StringIO()
+        self.generator.write(output, rows)
+        output.seek(0)
+        return list(csv.DictReader(output))
+
+    def test_dimension_distributions(self):
+        rows = self.generate(20000)
+        for column in ('channel', 'country', 'os'):
+            expected = Counter(row[column] for row in self.sample_rows)
+            actual = Counter(row[column] for row in rows)
+            with self.subTest(column=column):
+                self.assertSetEqual(set(actual), set(expected))
+                for value, count in expected.items():
+                    self.assertAlmostEqual(
+                        actual[value] / len(rows), count / len(self.sample_rows), delta=0.02,
+                    )
+
+    def test_unique_dimensions_per_day(self):
+        rows = self.generate(5000)
+        self.assertEqual(len({row['date'] for row in rows}), -(-5000 // 30))
+        keys = {(row['date'], row['channel'], row['country'], row['os']) for row in rows}
+        self.assertEqual(len(keys), len(rows))
+
+        with open(settings.BASE_DIR / 'dataset.csv') as sample:
+            with self.assertRaises(ValueError):
+                SyntheticMetricGenerator(sample, rows_per_day=0)
+
+    def test_rows_per_day(self):
+        dates = Counter(row['date'] for row in self.generate(70))
+        self.assertListEqual(list(dates.values()), [30, 30, 10])
+
+    def test_large_days(self):
+        with open(settings.BASE_DIR / 'dataset.csv') as sample:
+            self.generator = SyntheticMetricGenerator(sample, rows_per_day=10000)
+        rows = self.generate(30000)
+        self.assertEqual(len({row['date'] for row in rows}), 3)
+        keys = {(row['date'], row['channel'], row['country'], row['os']) for row in rows}
+        self.assertEqual(len(keys), len(rows))
+
+        # The sample has 1096 rows, the most frequent dimensions have 30 rows:
+        # a day of the sample channels has 36 rows at most, larger days add channel variants
+        sample_channels = {row['channel'] for row in self.sample_rows}
+        channels = {row['channel'] for row in rows}
+        self.assertSetEqual(
+            channels,
+            {f'{channel}_{variant}' if variant else channel
+             for channel in sample_channels for variant in range(-(-10000 // 36))},
+        )
+        for column in ('channel', 'country', 'os'):
+            expected = Counter(row[column] for row in self.sample_rows)
+            actual = Counter(row[column].rsplit('_', 1)[0] if row[column] not in expected else row[column]
+                             for row in rows)
+            with self.subTest(column=column):
+                self.assertSetEqual(set(actual), set(expected))
+                for value, count in expected.items():
+                    self.assertAlmostEqual(
+                        actual[value] / len(rows), count / len(self.sample_rows), delta=0.01,
+                    )
+
+    def test_same_seed_same_data(self):
+        with open(settings.BASE_DIR / 'dataset.csv') as sample:
+            generator = SyntheticMetricGenerator(sample, rows_per_day=30)
+        self.assertListEqual(
+            [batch.rows for batch in generator.iter_batches(100, batch_size=30)],
+            [batch.rows for batch in self.generator.iter_batches(100, batch_size=30)],
+        )
+
+    def test_generate_test_data_command(self):
+        call_command('generate_test_data', '2K', batch_size=500, verbosity=0)
+        self.assertEqual(Metric.objects.count(), 2000)
+
+    def test_invalid_number_of_rows(self):
+        for rows in ('0', 'many', '1G'):
+            with self.subTest(rows=rows):
+                with self.assertRaises(CommandError):
+                    call_command('generate_test_data', rows, verbosity=0)
+
+
+class BenchmarkCommandTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+
+    def setUp(self):
+        file_descriptor, self.output = tempfile.mkstemp(suffix='.json')
+        os.close(file_descriptor)
+        self.addCleanup(os.remove, self.output)
+
+    def run_benchmark(self, *benchmarks: str, **options) -> dict:
+        call_command(
+            'benchmark', *benchmarks, repeat=1, ingestion_rows=100, output=self.output, stdout=StringIO(), **options,
+        )
+        with open(self.output) as output:
+            return json.load(output)
+
+    def write_baseline(self, report: dict, factor: float) -> str:
+        report = json.loads(json.dumps(report))
+        for data in report['benchmarks'].values():
+            data['best_ms'] *= factor
+        file_descriptor, filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(report, file)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    def test_report(self):
+        report = self.run_benchmark()
+        self.assertEqual(report['environment']['rows'], len(metric_data))
+        self.assertEqual(len([name for name in report['benchmarks'] if name.startswith('use_case:')]), 4)
+        self.assertIn('raw_list:cursor_next_page', report['benchmarks'])
+        self.assertGreater(report['benchmarks']['ingestion']['rows_per_second'], 0)
+        # Ingested rows are rolled back
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+
+    def test_selected_benchmarks(self):
+        report = self.run_benchmark('raw_list')
+        self.assertTrue(all(name.startswith('raw_list:') for name in report['benchmarks']))
+
+    def test_baseline_comparison(self):
+        report = self.run_benchmark('use_case')
+        self.run_benchmark('use_case', baseline=self.write_baseline(report, 1000))
+
+        with self.assertRaisesMessage(CommandError, 'Slower than the baseline'):
+            self.run_benchmark('use_case', baseline=self.write_baseline(report, 0.001))
+
+
+class LoadTestCommandTestCase(TransactionTestCase):
+    """The async API queries run on pool threads with their own connections, so the data is committed."""
+
+    def setUp(self):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        refresh_rollups()
+
+    def test_report(self):
+        out = StringIO()
+        call_command('load_test', requests=10, concurrency=3, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertListEqual([line.split()[0] for line in lines], ['interface', 'wsgi', 'asgi'])
+        self.assertTrue(all(line.split()[-1] == '0' for line in lines[1:]))
+
+    def test_unknown_interface(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown interfaces: http'):
+            call_command('load_test', 'http', stdout=StringIO())
@@ -0,0 +1,122 @@
+import time
+from urllib.parse import urlencode
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from ..models import Metric, MetricQueryJob, MetricQueryJobPage
+from ..versioning import bump_data_version
+from .data import metric_data
+
+AGGREGATION_PARAMS = {'group_by': 'channel,os', 'display_columns': 'installs,cpi', 'ordering': '-cpi'}
+
+
+class MetricQueryJobApiTests(TransactionTestCase):
+    """Jobs run on pool threads with their own connections, so the data is committed."""
+
+    def setUp(self):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        caches['metrics'].clear()
+        self.client = APIClient()
+        self.url = reverse('metric-jobs')
+
+    def submit(self, params: dict):
+        return self.client.post(f'{self.url}?{urlencode(params)}')
+
+    def wait(self, job_url: str) -> dict:
+        for _ in range(100):
+            data = self.client.get(job_url).data
+            if data['status'] not in MetricQueryJob.IN_FLIGHT_STATUSES:
+                return data
+            time.sleep(0.05)
+        self.fail('The job did not finish')
+
+    def test_job_results(self):
+        for params in (AGGREGATION_PARAMS, {'country': 'US'}):
+            with self.subTest(params=params):
+                response = self.submit(params)
+                self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+                self.assertEqual(response['Location'], response.data['url'])
+
+                job = self.wait(response.data['url'])
+                self.assertEqual(job['status'], MetricQueryJob.Status.DONE)
+                results = self.client.get(f'{job["results"]}?limit=2&offset=1').json()
+                expected = self.client.get(reverse('metric-list'), {**params, 'limit': 2, 'offset': 1}).json()
+                self.assertEqual(results['count'], expected['count'])
+                self.assertListEqual(results['results'], expected['results'])
+
+    @override_settings(METRICS_JOB_PAGE_SIZE=3)
+    def test_rows_stored_by_pages(self):
+        job = self.wait(self.submit({'ordering': 'impressions'}).data['url'])
+        self.assertEqual(MetricQueryJobPage.objects.filter(job_id=job['id']).count(), -(-len(metric_data) // 3))
+
+        expected = self.client.get(reverse('metric-list'), {'ordering': 'impressions', 'limit': 4, 'offset': 2}).json()
+        # The job and the two pages of rows 2-5
+        with self.assertNumQueries(2):
+            results = self.client.get(f'{job["results"]}?limit=4&offset=2').json()
+        self.assertEqual(results['count'], len(metric_data))
+        self.assertListEqual(results['results'], expected['results'])
+
+        results = self.client.get(f'{job["results"]}?limit=100').json()
+        expected = self.client.get(reverse('metric-list'), {'ordering': 'impressions', 'limit': 100}).json()
+        self.assertListEqual(results['results'], expected['results'])
+
+    def test_failed_job(self):
+        response = self.submit({'group_by': 'channel', 'display_columns': 'unknown'})
+        job = self.wait(response.data['url'])
+        self.assertEqual(job['status'], MetricQueryJob.Status.FAILED)
+        self.assertIn('unknown', job['error'])
+        self.assertIsNone(job['results'])
+
+        # Failed jobs are not reused
+        self.assertNotEqual(self.submit({'group_by': 'channel', 'display_columns': 'unknown'}).data['id'], job['id'])
+
+    @mock.patch('modules.metrics.jobs.get_job_executor')
+    def test_identical_jobs_deduplicated(self, get_job_executor):
+        job_id = self.submit(AGGREGATION_PARAMS).data['id']
+        self.assertEqual(get_job_executor.return_value.submit.call_count, 1)
+
+        same_params = {**AGGREGATION_PARAMS, 'group_by': 'channel, os', 'limit': 10, 'pagination': 'nocount'}
+        self.assertEqual(self.submit(same_params).data['id'], job_id)
+        self.assertNotEqual(self.submit({**AGGREGATION_PARAMS, 'ordering': 'cpi'}).data['id'], job_id)
+        self.assertNotEqual(self.submit({**AGGREGATION_PARAMS, 'group_by': 'os,channel'}).data['id'], job_id)
+        self.assertEqual(get_job_executor.return_value.submit.call_count, 3)
+
+        bump_data_version()
+        self.assertNotEqual(self.submit(AGGREGATION_PARAMS).data['id'], job_id)
+
+    @mock.patch('modules.metrics.jobs.get_job_executor')
+    def test_results_of_pending_job(self, get_job_executor):
+        job = self.submit(AGGREGATION_PARAMS).data
+        response = self.client.get(reverse('metric-job-results', kwargs={'job_id': job['id']}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['status'], MetricQueryJob.Status.PENDING)
+
+        response = self.client.get(reverse('metric-job', kwargs={'job_id': 'unknown'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_MAX_QUEUED_JOBS=1)
+    @mock.patch('modules.metrics.jobs.get_job_executor')
+    def test_queue_limit(self, get_job_executor):
+        self.assertEqual(self.submit(AGGREGATION_PARAMS).status_code, status.HTTP_202_ACCEPTED)
+        response = self.submit({'country': 'US'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @override_settings(METRICS_JOB_TIMEOUT=0)
+    @mock.patch('modules.metrics.jobs.get_job_executor')
+    def test_stale_jobs_expired(self, get_job_executor):
+        job_id = self.submit(AGGREGATION_PARAMS).data['id']
+        self.assertNotEqual(self.submit(AGGREGATION_PARAMS).data['id'], job_id)
+        self.assertEqual(MetricQueryJob.objects.get(pk=job_id).status, MetricQueryJob.Status.FAILED)
+
+    def test_invalid_params(self):
+        response = self.submit({'date': 'not a date'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.submit({**AGGREGATION_PARAMS, 'top': 'many'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(MetricQueryJob.objects.exists())
@@ -0,0 +1,121 @@
+import json
+import os
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ..exceptions import LoadError
+from ..loaders import COLUMNS, iter_csv_batches, iter_ndjson_batches
+from ..models import Metric, MetricChannelCountryOSRollup, MetricDateCountryRollup
+from ..versioning import get_data_version, get_data_versions
+from .data import metric_data
+
+
+class LoadTestDataTestCase(TestCase):
+
+    def setUp(self):
+        lines = [','.join(COLUMNS)] + [
+            ','.join(str(data[column]) for column in COLUMNS) for data in metric_data
+        ]
+        self.content = '\n'.join(lines) + '\n'
+        self.filename = self.write_file(self.content)
+
+    def write_file(self, content: str) -> str:
+        file_descriptor, filename = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(file_descriptor, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    def test_load_by_batches(self):
+        out = StringIO()
+        call_command('load_test_data', self.filename, batch_size=2, transaction_batches=2, stdout=out)
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertEqual(get_data_version(), 1)
+        self.assertEqual(
+            set(Metric.objects.values_list('date', 'country')),
+            set(MetricDateCountryRollup.objects.values_list('date', 'country')),
+        )
+
+    def test_rollups_refreshed_for_loaded_dimensions(self):
+        MetricChannelCountryOSRollup.objects.create(
+            channel='vungle', country='FR', os='ios', impressions=1, clicks=1, installs=1, spend=1, revenue=1,
+        )
+        lines = self.content.splitlines()
+        call_command('load_test_data', self.write_file('\n'.join(lines[:3]) + '\n'), stdout=StringIO())
+
+        # Rollups without `date` are refreshed for the loaded dimensions only, other rows are kept
+        self.assertListEqual(
+            list(MetricChannelCountryOSRollup.objects.order_by('channel', 'os').values_list(
+                'channel', 'country', 'os', 'spend',
+            )),
+            [('adcolony', 'US', 'android', 5), ('adcolony', 'US', 'ios', 5), ('vungle', 'FR', 'ios', 1)],
+        )
+
+    def test_batch_offsets(self):
+        with open(self.filename, 'rb') as file:
+            batches = list(iter_csv_batches(file, batch_size=4))
+
+        self.assertListEqual([len(batch.rows) for batch in batches], [4, 4, 1])
+        self.assertEqual(batches[-1].end_offset, len(self.content.encode()))
+
+        with open(self.filename, 'rb') as file:
+            resumed = list(iter_csv_batches(file, batch_size=4, offset=batches[0].end_offset))
+
+        self.assertListEqual(resumed[0].rows, batches[1].rows)
+
+    def test_upsert_replaces_rows(self):
+        call_command('load_test_data', self.filename, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'UNIQUE constraint failed'):
+            call_command('load_test_data', self.filename, stdout=StringIO())
+
+        lines = self.content.splitlines()
+        corrected = lines[:2] + [lines[2].replace(',8,2,5,8', ',8,2,50,8')]
+        call_command(
+            'load_test_data', self.write_file('\n'.join(corrected) + '\n'), batch_size=1, upsert=True,
+            stdout=StringIO(),
+        )
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+        spends = Metric.objects.filter(date='2017-05-17', channel='adcolony').order_by('os').values_list('spend', flat=True)
+        self.assertListEqual(list(spends), [5, 50])
+        rollup = MetricDateCountryRollup.objects.get(date='2017-05-17', country='US')
+        self.assertEqual(rollup.spend, 5 + 50 + 8)
+        # Replaced rows are a rewrite of the data
+        self.assertEqual(get_data_versions(), (2, 2))
+
+    def test_ndjson_batches(self):
+        lines = [json.dumps(dict(data, extra=1)) for data in metric_data]
+        batches = list(iter_ndjson_batches(BytesIO('\n'.join(lines).encode() + b'\n\n'), batch_size=4))
+        self.assertListEqual([len(batch.rows) for batch in batches], [4, 4, 1])
+        self.assertListEqual(batches[0].rows[0], [str(metric_data[0][column]) for column in COLUMNS])
+
+        for content in (b'{"date": "2017-05-17"}\n', b'[1, 2]\n', b'{"date": \n'):
+            with self.subTest(content=content):
+                with self.assertRaises(LoadError):
+                    list(iter_ndjson_batches(BytesIO(content), batch_size=4))
+
+    def test_resume_after_failure(self):
+        lines = self.content.splitlines()
+        lines[6] = lines[6].replace('2017-05-18', 'not-a-date')
+        filename = self.write_file('\n'.join(lines) + '\n')
+
+        with self.assertRaisesMessage(CommandError, '--offset'):
+            call_command(
+                'load_test_data', filename, batch_size=2, transaction_batches=1, stdout=StringIO(),
+            )
+        self.assertEqual(Metric.objects.count(), 4)
+
+        with open(filename, 'rb') as file:
+            offset = list(iter_csv_batches(file, batch_size=2))[1].end_offset
+        call_command('load_test_data', self.filename, offset=offset, stdout=StringIO())
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+
+    def test_new_dimension_value(self):
+        filename = self.write_file(self.content.replace('chartboost', 'aarki', 1))
+
+        call_command('load_test_data', filename, stdout=StringIO())
+        self.assertEqual(Metric.objects.filter(channel='aarki').count(), 1)
+        self.assertEqual(Metric.objects.order_by('channel').values_list('channel', flat=True)[0], 'aarki')
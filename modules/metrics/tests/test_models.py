@@ -1,6 +1,13 @@
-from django.test import TestCase
+from datetime import date
+from unittest import mock
 
-from ..models import Metric
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+
+from ..aggregations import MetricAggregator
+from ..models import DimensionCode, Metric, MetricChannelCountryOSRollup, MetricDateCountryRollup, MetricDateOSRollup
+from ..versioning import bump_data_version, get_data_version
 from .data import metric_data
 
 
@@ -19,3 +26,139 @@ class MetricTestCase(TestCase):
             actual = metric.cpi
             with self.subTest(expected=expected, actual=actual):
                 self.assertEqual(expected, actual)
+
+
+class DimensionFieldTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Codes in the reverse order of the values
+        for channel in sorted({data['channel'] for data in metric_data}, reverse=True):
+            DimensionCode.objects.get_code('channel', channel, create=True)
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+
+    def test_stored_as_codes(self):
+        metric = Metric.objects.filter(channel='chartboost', country='US', os='ios').first()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT channel, country, os FROM metrics_metric WHERE id = %s',
+                [metric.pk],
+            )
+            codes = cursor.fetchone()
+
+        self.assertEqual(codes, tuple(
+            DimensionCode.objects.get(dimension=dimension, value=value).pk
+            for dimension, value in (('channel', 'chartboost'), ('country', 'US'), ('os', 'ios'))
+        ))
+        self.assertEqual((metric.channel, metric.country, metric.os), ('chartboost', 'US', 'ios'))
+
+    def test_lookups(self):
+        self.assertEqual(
+            Metric.objects.filter(country__in=['US', 'GB']).count(),
+            len([data for data in metric_data if data['country'] in ('US', 'GB')]),
+        )
+        self.assertFalse(Metric.objects.filter(channel='unknown').exists())
+
+        # Range lookups compare the values, not the codes
+        self.assertEqual(
+            Metric.objects.filter(channel__gt='adcolony').count(),
+            len([data for data in metric_data if data['channel'] > 'adcolony']),
+        )
+        self.assertEqual(
+            Metric.objects.filter(channel__lte='chartboost').count(),
+            len([data for data in metric_data if data['channel'] <= 'chartboost']),
+        )
+        self.assertEqual(
+            Metric.objects.filter(channel__range=('b', 'd')).count(),
+            len([data for data in metric_data if 'b' <= data['channel'] <= 'd']),
+        )
+
+    def test_ordering_by_values(self):
+        channels = list(Metric.objects.order_by('channel').values_list('channel', flat=True))
+        self.assertListEqual(channels, sorted(data['channel'] for data in metric_data))
+
+        grouped = Metric.objects.values('channel').annotate(installs=Sum('installs')).order_by('-channel')
+        self.assertListEqual(
+            [row['channel'] for row in grouped],
+            sorted({data['channel'] for data in metric_data}, reverse=True),
+        )
+
+    def test_new_value_saved(self):
+        Metric.objects.create(**dict(metric_data[0], channel='aarki'))
+
+        self.assertTrue(DimensionCode.objects.filter(dimension='channel', value='aarki').exists())
+        self.assertEqual(Metric.objects.order_by('channel').first().channel, 'aarki')
+        self.assertEqual(Metric.objects.filter(channel__lt='adcolony').get().channel, 'aarki')
+
+    def test_rolled_back_codes_not_used(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Metric.objects.create(**dict(metric_data[0], channel='aarki'))
+            raise RuntimeError
+        Metric.objects.create(**dict(metric_data[0], channel='zynga'))
+
+        self.assertFalse(Metric.objects.filter(channel='aarki').exists())
+        self.assertEqual(Metric.objects.order_by('-channel').first().channel, 'zynga')
+
+    def test_text_storage(self):
+        field = Metric._meta.get_field('channel')
+        with override_settings(METRICS_DIMENSION_CODES=False):
+            self.assertEqual(field.db_type(connection), 'varchar(250)')
+            self.assertEqual(field.get_prep_value('chartboost'), 'chartboost')
+            self.assertEqual(field.from_db_value('chartboost', None, connection), 'chartboost')
+            self.assertEqual(Metric.objects.order_by('channel').query.order_by, ('channel', ))
+        self.assertEqual(field.db_type(connection), 'smallint unsigned')
+
+
+class DataVersionTestCase(TestCase):
+
+    def test_bump_data_version(self):
+        self.assertEqual(get_data_version(), 0)
+        self.assertEqual(bump_data_version(), 1)
+        self.assertEqual(bump_data_version(), 2)
+        self.assertEqual(get_data_version(), 2)
+
+    def test_metric_changes_bump_version_and_refresh_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            metric = Metric.objects.create(**metric_data[0])
+        self.assertEqual(get_data_version(), 1)
+        self.assertEqual(MetricDateCountryRollup.objects.get().installs, metric.installs)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            metric.delete()
+        self.assertEqual(get_data_version(), 2)
+        self.assertFalse(MetricDateCountryRollup.objects.exists())
+
+    def test_changed_dimensions_refresh_old_rollup_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            metric = Metric.objects.create(**metric_data[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            metric.date = date(2017, 5, 20)
+            metric.os = 'android'
+            metric.save()
+
+        self.assertListEqual(
+            list(MetricDateOSRollup.objects.values_list('date', 'os', 'installs')),
+            [(date(2017, 5, 20), 'android', metric.installs)],
+        )
+        self.assertListEqual(
+            list(MetricChannelCountryOSRollup.objects.values_list('os', 'installs')),
+            [('android', metric.installs)],
+        )
+        raw_aggregator = MetricAggregator(use_rollups=False)
+        for group_by in (['date', 'os'], ['channel', 'country', 'os']):
+            with self.subTest(group_by=group_by):
+                self.assertListEqual(
+                    list(MetricAggregator().aggregate(Metric.objects.all(), group_by, ['installs'])),
+                    list(raw_aggregator.aggregate(Metric.objects.all(), group_by, ['installs'])),
+                )
+
+    def test_changes_of_transaction_refresh_rollups_once(self):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        with mock.patch('modules.metrics.signals.refresh_rollups_for_rows') as refresh_rollups_for_rows, \
+                self.captureOnCommitCallbacks(execute=True):
+            for metric in Metric.objects.all():
+                metric.delete()
+
+        refresh_rollups_for_rows.assert_called_once()
+        self.assertEqual(len(refresh_rollups_for_rows.call_args[0][0]), len(metric_data))
+        self.assertEqual(get_data_version(), 1)
@@ -0,0 +1,221 @@
+from datetime import date
+from io import StringIO
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F, Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+
+from ..loaders import MetricLoader
+from ..models import Metric, MetricDateCountryRollup
+from ..partitions import get_partition_backend
+from ..rollups import refresh_rollups
+from ..versioning import get_data_version
+from .data import metric_data
+
+MAY = date(2017, 5, 1)
+JUNE = date(2017, 6, 1)
+
+
+class MetricPartitionsTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        refresh_rollups()
+
+    def setUp(self):
+        caches['metrics'].clear()
+        self.backend = get_partition_backend()
+        self.url = reverse('metric-list')
+
+    def count_table_rows(self, table: str) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            return cursor.fetchone()[0]
+
+    def get_responses(self, params_list):
+        return [self.client.get(self.url, params, format='json').data for params in params_list]
+
+    def test_partition_takes_rows_of_its_month(self):
+        params_list = [
+            {},
+            {'group_by': 'date,channel', 'display_columns': 'installs,cpi', 'ordering': 'date,channel'},
+            {'date_range_after': '2017-05-18', 'ordering': '-installs'},
+        ]
+        expected = self.get_responses(params_list)
+
+        self.assertTrue(self.backend.create_partition(MAY))
+        self.assertFalse(self.backend.create_partition(MAY))
+
+        self.assertDictEqual(self.backend.get_partitions(), {MAY: 'metrics_metric_p201705'})
+        self.assertEqual(self.count_table_rows('metrics_metric_p201705'), len(metric_data))
+        self.assertEqual(self.count_table_rows('metrics_metric'), 0)
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+        caches['metrics'].clear()
+        self.assertListEqual(self.get_responses(params_list), expected)
+
+    def test_date_filters_prune_partitions(self):
+        self.backend.create_partition(MAY)
+        self.backend.create_partition(JUNE)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(
+                self.url,
+                {'date_range_after': '2017-05-17', 'date_range_before': '2017-05-17'},
+                format='json',
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 7)
+        sql = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertIn('metrics_metric_p201705', sql)
+        self.assertNotIn('metrics_metric_p201706', sql)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(Metric.objects.filter(date__gte=JUNE).count(), 0)
+        self.assertNotIn('metrics_metric_p201705', context.captured_queries[0]['sql'])
+
+    def test_counts_summed_per_table(self):
+        self.backend.create_partition(MAY)
+        queryset = Metric.objects.filter(channel='adcolony')
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(queryset.count(), 3)
+            self.assertEqual(queryset.annotate(cpi=F('spend') / F('installs')).count(), 3)
+            self.assertEqual(queryset.values('country').distinct().count(), 2)
+        count_sql, subquery_count_sql, distinct_count_sql = (query['sql'] for query in context.captured_queries)
+        self.assertIn('SELECT SUM("__count")', count_sql)
+        self.assertIn('SELECT SUM(table_count)', subquery_count_sql)
+        self.assertIn('UNION ALL', distinct_count_sql)
+        self.assertNotIn('SUM', distinct_count_sql)
+
+    def test_tables_select_referenced_columns(self):
+        self.backend.create_partition(MAY)
+        queryset = Metric.objects.filter(date='2017-05-17', country='US').values('os').annotate(
+            revenue=Sum('revenue'),
+        ).order_by('os')
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertListEqual(
+                [(row['os'], row['revenue']) for row in queryset], [('android', 6.0), ('ios', 30.0)],
+            )
+        sql = context.captured_queries[0]['sql']
+        self.assertIn(
+            'SELECT "date", "country", "os", "revenue" FROM "metrics_metric_p201705" "metrics_metric" WHERE', sql,
+        )
+        self.assertNotIn('"impressions"', sql)
+
+    def test_offset_pages_skip_tables(self):
+        Metric.objects.bulk_create([
+            Metric(**dict(data, date=date(2017, 6, day))) for day, data in enumerate(metric_data, start=1)
+        ])
+        orderings = (('date', 'pk'), ('-date', 'pk'))
+        expected = {
+            ordering: list(Metric.objects.order_by(*ordering).values_list('pk', flat=True))
+            for ordering in orderings
+        }
+        self.backend.create_partition(MAY)
+        self.backend.create_partition(JUNE)
+
+        for ordering in orderings:
+            for offset in (0, 5, 9, 12, 18):
+                with self.subTest(ordering=ordering, offset=offset):
+                    page = Metric.objects.order_by(*ordering).values_list('pk', flat=True)[offset:offset + 4]
+                    self.assertListEqual(list(page), expected[ordering][offset:offset + 4])
+
+        # The page after the May rows reads only the June partition
+        with CaptureQueriesContext(connection) as context:
+            list(Metric.objects.order_by('date')[10:12])
+        sql = context.captured_queries[-1]['sql']
+        self.assertIn('metrics_metric_p201706', sql)
+        self.assertNotIn('metrics_metric_p201705', sql)
+        self.assertIn('LIMIT 2 OFFSET 1', sql)
+
+    def test_writes_routed_to_partitions(self):
+        self.backend.create_partition(MAY)
+
+        metric = Metric.objects.create(**dict(metric_data[0], date=date(2017, 5, 20)))
+        self.assertEqual(self.count_table_rows('metrics_metric_p201705'), len(metric_data) + 1)
+        self.assertEqual(Metric.objects.get(pk=metric.pk).date, date(2017, 5, 20))
+
+        metrics = Metric.objects.bulk_create([
+            Metric(**dict(metric_data[1], date=date(2017, 6, 1))),
+            Metric(**dict(metric_data[2], date=date(2017, 5, 21))),
+        ])
+        self.assertEqual(self.count_table_rows('metrics_metric'), 1)
+        ids = list(Metric.objects.values_list('pk', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertIn(metrics[1].pk, ids)
+
+        self.assertEqual(Metric.objects.filter(channel='adcolony').update(clicks=0), 6)
+        self.assertEqual(Metric.objects.filter(clicks=0).count(), 6)
+
+        metric.delete()
+        deleted, _ = Metric.objects.filter(channel='adcolony').delete()
+        self.assertEqual(deleted, 5)
+        self.assertFalse(Metric.objects.filter(channel='adcolony').exists())
+
+    def test_updated_dates_move_rows(self):
+        self.backend.create_partition(MAY)
+        self.backend.create_partition(JUNE)
+        metric = Metric.objects.get(channel='chartboost', country='US')
+
+        # Saved as in the admin
+        metric.date = date(2017, 6, 5)
+        metric.save()
+        self.assertEqual(Metric.objects.filter(date__gte=JUNE).get().pk, metric.pk)
+        self.assertEqual(self.count_table_rows('metrics_metric_p201706'), 1)
+
+        # Moved to a month without a partition and back by queryset updates
+        self.assertEqual(Metric.objects.filter(date__gte=JUNE).update(date='2017-07-01'), 1)
+        self.assertEqual(self.count_table_rows('metrics_metric'), 1)
+        self.assertEqual(Metric.objects.filter(date__gte=date(2017, 7, 1)).count(), 1)
+        Metric.objects.filter(pk=metric.pk).update(date='2017-05-20')
+        self.assertEqual(self.count_table_rows('metrics_metric'), 0)
+        self.assertEqual(self.count_table_rows('metrics_metric_p201705'), len(metric_data))
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+
+    def test_upsert_routed_to_partitions(self):
+        self.backend.create_partition(MAY)
+        rows = [
+            (date(2017, 5, 17), 'adcolony', 'US', 'android', 1, 1, 1, 100.0, 1.0),
+            (date(2017, 6, 1), 'adcolony', 'US', 'android', 1, 1, 1, 10.0, 1.0),
+        ]
+        loader = MetricLoader(upsert=True)
+        loader.insert(rows)
+        loader.insert(rows)
+
+        self.assertEqual(self.count_table_rows('metrics_metric_p201705'), len(metric_data))
+        self.assertEqual(self.count_table_rows('metrics_metric'), 1)
+        self.assertListEqual(
+            list(Metric.objects.filter(channel='adcolony', country='US', os='android').order_by('date').values_list(
+                'date', 'spend',
+            )),
+            [(date(2017, 5, 17), 100.0), (date(2017, 6, 1), 10.0)],
+        )
+        ids = list(Metric.objects.values_list('pk', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_partition_command(self):
+        out = StringIO()
+        call_command('partition_metrics', start_date=MAY, date=date(2017, 6, 15), months_ahead=1, stdout=out)
+        self.assertIn('Created partition for 2017-07', out.getvalue())
+        self.assertListEqual(sorted(self.backend.get_partitions()), [MAY, JUNE, date(2017, 7, 1)])
+
+        call_command('partition_metrics', date=date(2017, 6, 15), retention_months=0, detach=True, stdout=out)
+        self.assertIn('Detached partition for 2017-05 as metrics_metric_detached_p201705', out.getvalue())
+        self.assertEqual(self.count_table_rows('metrics_metric_detached_p201705'), len(metric_data))
+        self.assertFalse(Metric.objects.exists())
+        self.assertFalse(MetricDateCountryRollup.objects.exists())
+        self.assertEqual(get_data_version(), 1)
+
+        call_command(
+            'partition_metrics', date=date(2017, 8, 15), months_ahead=1, retention_months=0, stdout=out,
+        )
+        self.assertIn('Dropped partition for 2017-07', out.getvalue())
+        self.assertListEqual(sorted(self.backend.get_partitions()), [date(2017, 8, 1), date(2017, 9, 1)])
@@ -0,0 +1,59 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..management.commands.check_query_plans import COVERING_SCAN_PATTERN, get_full_scan_pattern, get_full_scans
+from ..models import Metric
+from ..use_cases import README_USE_CASES
+from .data import metric_data
+
+
+class QueryPlansTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+
+    def test_use_cases_do_not_use_full_scan(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        output = out.getvalue()
+        self.assertNotIn('FULL SCAN', output)
+        self.assertEqual(output.count('OK ') + output.count('INDEX SCAN '), len(README_USE_CASES))
+
+    def test_full_scan_pattern(self):
+        full_scan = get_full_scan_pattern('sqlite')
+        for line in (
+            'SCAN metrics_metric',
+            'SCAN TABLE metrics_metric',
+            'SCAN metrics_metric USING INDEX metric_dims_date_idx',
+            'SCAN metrics_metric_p201705 USING INDEX metric_dims_date_idx_p201705',
+            'SCAN metrics_metricchannelcountryosrollup USING INDEX metrics_metricchannelcountryosrollup_uniq',
+            'SCAN metrics_metric USING COVERING INDEX metric_dims_date_idx',
+        ):
+            with self.subTest(line=line):
+                self.assertTrue(full_scan.search(line))
+        for line in (
+            'SEARCH metrics_metricdateosrollup USING INDEX rollup_os_installs_idx (os=?)',
+            'SCAN metrics_dimensioncode',
+        ):
+            with self.subTest(line=line):
+                self.assertFalse(full_scan.search(line))
+
+        self.assertTrue(COVERING_SCAN_PATTERN.search('SCAN metrics_metric USING COVERING INDEX metric_dims_date_idx'))
+        self.assertFalse(COVERING_SCAN_PATTERN.search('SCAN metrics_metric USING INDEX metric_dims_date_idx'))
+        self.assertTrue(get_full_scan_pattern('postgresql').search('Seq Scan on metrics_metric_p201705'))
+
+    def test_full_scans_skip_subqueries(self):
+        plan = '\n'.join((
+            '2 0 0 CO-ROUTINE metrics_metric',
+            '5 2 0 COMPOUND QUERY',
+            '7 5 0 SEARCH metrics_metric_p201705 USING INDEX metric_dims_date_idx_p201705 (channel=?)',
+            '9 5 0 UNION ALL',
+            '11 9 0 SCAN metrics_metric',
+            '48 0 0 SCAN metrics_metric',
+        ))
+        self.assertEqual(get_full_scans(plan, get_full_scan_pattern('sqlite')), ['11 9 0 SCAN metrics_metric'])
@@ -0,0 +1,78 @@
+from django.test import TestCase
+
+from ..aggregations import MetricAggregator
+from ..models import (
+    Metric,
+    MetricChannelCountryOSRollup,
+    MetricDateCountryRollup,
+    MetricDateOSRollup,
+)
+from ..rollups import refresh_rollups
+from .data import metric_data
+
+
+class RollupTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.metrics = Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ])
+        refresh_rollups()
+        cls.aggregator = MetricAggregator()
+        cls.raw_aggregator = MetricAggregator(use_rollups=False)
+
+    def assertSameAsRaw(self, queryset, group_by, display_columns):
+        result = self.aggregator.aggregate(queryset, group_by, display_columns)
+        expected = self.raw_aggregator.aggregate(queryset, group_by, display_columns)
+        self.assertListEqual(
+            list(expected.order_by(*group_by)),
+            list(result.order_by(*group_by)),
+        )
+        return result
+
+    def test_refresh_rollups(self):
+        expected_rows = {
+            MetricChannelCountryOSRollup: 8,
+            MetricDateCountryRollup: 5,
+            MetricDateOSRollup: 4,
+        }
+        for rollup_model, expected in expected_rows.items():
+            with self.subTest(rollup_model=rollup_model.__name__):
+                self.assertEqual(rollup_model.objects.count(), expected)
+
+    def test_refresh_rollups_for_dates(self):
+        Metric.objects.filter(date='2017-05-18').update(installs=100)
+        refresh_rollups(dates=['2017-05-18'])
+        rollup = MetricDateCountryRollup.objects.get(date='2017-05-18', country='CA')
+        self.assertEqual(rollup.installs, 100)
+        self.assertEqual(MetricDateCountryRollup.objects.count(), 5)
+
+    def test_smallest_covering_rollup_used(self):
+        cases = (
+            (Metric.objects.all(), ['os'], MetricDateOSRollup),
+            (Metric.objects.filter(date='2017-05-17'), ['country'], MetricDateCountryRollup),
+            (Metric.objects.filter(country='GB'), ['channel'], MetricChannelCountryOSRollup),
+            (Metric.objects.filter(date__gte='2017-05-17', os='ios'), ['date'], MetricDateOSRollup),
+        )
+        for queryset, group_by, rollup_model in cases:
+            with self.subTest(group_by=group_by, rollup_model=rollup_model.__name__):
+                result = self.assertSameAsRaw(queryset, group_by, ['installs', 'spend', 'cpi'])
+                self.assertIs(result.model, rollup_model)
+
+    def test_raw_table_used_without_covering_rollup(self):
+        cases = (
+            (Metric.objects.all(), ['date', 'channel']),
+            (Metric.objects.filter(channel='adcolony'), ['date']),
+            (Metric.objects.filter(date='2017-05-17', os='ios'), ['country']),
+        )
+        for queryset, group_by in cases:
+            with self.subTest(group_by=group_by):
+                result = self.assertSameAsRaw(queryset, group_by, ['clicks'])
+                self.assertIs(result.model, Metric)
+
+    def test_cpi_computed_from_rollup_totals(self):
+        result = self.aggregator.aggregate(Metric.objects.all(), ['country'], ['cpi'])
+        gb_metrics = [m for m in self.metrics if m.country == 'GB']
+        expected = sum(m.spend for m in gb_metrics) / sum(m.installs for m in gb_metrics)
+        self.assertEqual(result.get(country='GB')['cpi'], expected)
@@ -0,0 +1,104 @@
+from io import StringIO
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APITestCase
+
+from ..models import Metric
+from ..routers import (
+    PIN_COOKIE_NAME,
+    MetricReplicaRouter,
+    primary_pinning_middleware,
+    replica_load,
+    replica_reads,
+)
+from .data import metric_data
+
+
+@override_settings(METRICS_DATABASE_REPLICAS=['replica'])
+class MetricReplicaRouterTests(APITestCase):
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        Metric.objects.using('replica').bulk_create([Metric(**data) for data in metric_data[:2]])
+
+    def setUp(self):
+        caches['metrics'].clear()
+        self.url = reverse('metric-list')
+
+    def test_api_reads_replica(self):
+        self.assertEqual(self.client.get(self.url, format='json').data['count'], 2)
+
+        with override_settings(METRICS_DATABASE_REPLICAS=[]):
+            caches['metrics'].clear()
+            self.assertEqual(self.client.get(self.url, format='json').data['count'], len(metric_data))
+
+    def test_other_reads_and_writes_use_default(self):
+        self.assertEqual(Metric.objects.count(), len(metric_data))
+        with replica_reads():
+            self.assertEqual(Metric.objects.count(), 2)
+            metric = Metric.objects.create(**dict(metric_data[0], date='2017-05-19'))
+            self.assertEqual(metric._state.db, 'default')
+        self.assertEqual(Metric.objects.count(), len(metric_data) + 1)
+
+    def test_reads_pinned_to_primary_after_write(self):
+        factory = RequestFactory()
+
+        def write_view(request):
+            Metric.objects.filter(pk=Metric.objects.first().pk).update(clicks=0)
+            return HttpResponse()
+
+        response = primary_pinning_middleware(write_view)(factory.post('/admin/'))
+        pinned_until = response.cookies[PIN_COOKIE_NAME].value
+
+        def read_view(request):
+            with replica_reads():
+                return Metric.objects.count()
+
+        request = factory.get(self.url)
+        request.COOKIES[PIN_COOKIE_NAME] = pinned_until
+        self.assertEqual(primary_pinning_middleware(read_view)(request), len(metric_data))
+        request.COOKIES[PIN_COOKIE_NAME] = '0'
+        self.assertEqual(primary_pinning_middleware(read_view)(request), 2)
+
+    def test_replica_selection(self):
+        router = MetricReplicaRouter()
+        self.assertListEqual([router.select_replica(['a', 'b']) for _ in range(4)], ['a', 'b', 'a', 'b'])
+
+        self.addCleanup(replica_load.in_flight.clear)
+        replica_load.in_flight['a'] = 2
+        replica_load.in_flight['b'] = 1
+        with override_settings(METRICS_REPLICA_SELECTION='least_loaded'):
+            self.assertListEqual([router.select_replica(['a', 'b', 'c']) for _ in range(3)], ['c', 'c', 'c'])
+            replica_load.in_flight['c'] = 3
+            self.assertEqual(router.select_replica(['a', 'b', 'c']), 'b')
+
+        with override_settings(METRICS_REPLICA_SELECTION='random'):
+            with self.assertRaises(ImproperlyConfigured):
+                router.select_replica(['a'])
+
+    def test_replica_not_migrated(self):
+        router = MetricReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'metrics'))
+        self.assertIsNone(router.allow_migrate('default', 'metrics'))
+
+
+@override_settings(METRICS_DATABASE_REPLICAS=['replica'])
+class SyncSQLiteReplicasCommandTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def test_copy_to_replica(self):
+        Metric.objects.bulk_create([Metric(**data) for data in metric_data])
+        self.assertFalse(Metric.objects.using('replica').exists())
+
+        out = StringIO()
+        call_command('sync_sqlite_replicas', stdout=out)
+        self.assertIn('Copied', out.getvalue())
+        self.assertEqual(Metric.objects.using('replica').count(), len(metric_data))
@@ -0,0 +1,32 @@
+from django.test import TestCase
+
+from rest_framework.renderers import JSONRenderer
+
+from ..api.serializers import MetricRowSerializer, MetricSerializer
+from ..models import Metric
+from .data import metric_data
+
+
+class MetricRowSerializerTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Metric.objects.bulk_create([
+            Metric(**data) for data in metric_data
+        ] + [
+            Metric(**dict(metric_data[0], date='2017-05-19', installs=0, spend=1.1)),
+        ])
+
+    def test_same_output_as_model_serializer(self):
+        queryset = Metric.objects.with_cpi().order_by('pk')
+        row_serializer = MetricRowSerializer()
+
+        expected = JSONRenderer().render(MetricSerializer(queryset, many=True).data)
+        actual = JSONRenderer().render(row_serializer.serialize(row_serializer.get_rows(queryset)))
+
+        self.assertEqual(expected, actual)
+
+    def test_cpi_without_installs(self):
+        row_serializer = MetricRowSerializer()
+        rows = row_serializer.get_rows(Metric.objects.with_cpi().filter(installs=0))
+        self.assertIsNone(row_serializer.serialize(rows)[0]['cpi'])
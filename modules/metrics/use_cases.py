@@ -0,0 +1,45 @@
+"""
+Common API use-cases documented in the Readme.
+"""
+
+README_USE_CASES = (
+    dict(
+        name='impressions_clicks_by_channel_country',
+        params=dict(
+            date_range_before='2017-05-31',
+            display_columns='impressions,clicks',
+            group_by='channel,country',
+            ordering='-clicks',
+        ),
+    ),
+    dict(
+        name='ios_installs_by_date',
+        params=dict(
+            group_by='date',
+            display_columns='installs',
+            ordering='date',
+            date_range_before='2017-05-31',
+            date_range_after='2017-05-01',
+            os='ios',
+        ),
+    ),
+    dict(
+        name='us_revenue_by_os',
+        params=dict(
+            group_by='os',
+            display_columns='revenue',
+            ordering='-revenue',
+            date='2017-06-01',
+            country='US',
+        ),
+    ),
+    dict(
+        name='ca_cpi_spend_by_channel',
+        params=dict(
+            group_by='channel',
+            display_columns='cpi,spend',
+            ordering='-cpi',
+            country='CA',
+        ),
+    ),
+)
@@ -0,0 +1,43 @@
+from typing import Tuple
+
+from django.db.models import F
+
+from .models import DataVersion
+
+DATA_VERSION_ID = 1
+
+
+def get_data_version() -> int:
+    """Get current version of `Metric` data."""
+    return get_data_versions()[0]
+
+
+def get_data_versions() -> Tuple[int, int]:
+    """Get current version of `Metric` data and the version of its last rewrite.
+
+    Changes between the rewrite version and the current version only added new rows.
+
+    """
+    versions = DataVersion.objects.filter(pk=DATA_VERSION_ID).values_list(
+        'version', 'rewrite_version',
+    ).first()
+    return versions or (0, 0)
+
+
+def bump_data_version(append_only: bool = False) -> int:
+    """Increment the data version. Must be called by every writer of `Metric` data.
+
+    Writers that only added new rows should pass `append_only=True`.
+
+    """
+    changes = {'version': F('version') + 1}
+    if not append_only:
+        changes['rewrite_version'] = F('version') + 1
+
+    updated = DataVersion.objects.filter(pk=DATA_VERSION_ID).update(**changes)
+    if not updated:
+        defaults = {'version': 1, 'rewrite_version': 0 if append_only else 1}
+        _, created = DataVersion.objects.get_or_create(pk=DATA_VERSION_ID, defaults=defaults)
+        if not created:
+            DataVersion.objects.filter(pk=DATA_VERSION_ID).update(**changes)
+    return get_data_version()
@@ -39,6 +39,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'modules.metrics.routers.primary_pinning_middleware',
 ]
 
 ROOT_URLCONF = 'settings.urls'
@@ -61,14 +62,40 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'settings.wsgi.application'
+ASGI_APPLICATION = 'settings.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # SQLite backend routing `Metric` queries to monthly partition tables
+        'ENGINE': 'modules.metrics.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Stand-in read replica for local testing, copy `default` to it by `sync_sqlite_replicas`
+    'replica': {
+        'ENGINE': 'modules.metrics.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.replica.sqlite3',
+    },
+}
+
+# Send reads of the metrics API to replicas, writes and other reads use `default`
+DATABASE_ROUTERS = ['modules.metrics.routers.MetricReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'metrics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'metrics',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
 }
 
 # Password validation
@@ -118,5 +145,48 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
 }
 
+# Aggregation backend of the metrics API. Use `NumpyMetricAggregator` from the same module
+# to aggregate data in memory, it requires `numpy` package
+METRICS_AGGREGATOR = 'modules.metrics.aggregations.MetricAggregator'
+
+# Store `channel`, `country` and `os` as small integer codes of the `DimensionCode` table,
+# False stores the text values. Migrations create the columns by it: migrate `metrics` back
+# to `0006_data_rewrite_version` before changing it for an existing database
+METRICS_DIMENSION_CODES = True
+
+# Cache alias for metric API responses, use None to disable the cache
+METRICS_RESPONSE_CACHE = 'metrics'
+
+# Seconds HTTP caches (CDN, reverse proxy, browser) may serve metric API lists without revalidation,
+# they revalidate by the `ETag` of the data version afterwards. Use None to omit `Cache-Control`
+METRICS_HTTP_CACHE_MAX_AGE = 60
+
+# Profile metric API list requests: `Server-Timing` header and the slow request log
+METRICS_INSTRUMENTATION = False
+# Requests slower than the threshold in seconds are logged to `modules.metrics.slow_requests` logger,
+# use None to disable the log
+METRICS_SLOW_REQUEST_THRESHOLD = 1.0
+
+# Size of the thread pool running database queries of the async metrics API
+METRICS_ASYNC_DB_WORKERS = 8
+
+# Size of the thread pool running metrics API query jobs of the process
+METRICS_JOB_WORKERS = 2
+# Jobs waiting for a worker, new jobs are rejected with 503 above the limit
+METRICS_MAX_QUEUED_JOBS = 100
+# Seconds after which a queued or running job is failed, e.g. when its process stopped
+METRICS_JOB_TIMEOUT = 3600
+# Seconds to keep the rows of finished jobs
+METRICS_JOB_RESULT_SECONDS = 86400
+# Rows of a job result stored per page, a results request reads only the pages of its rows
+METRICS_JOB_PAGE_SIZE = 1000
+
+# Database aliases of the read replicas of `default` for the metrics API, e.g. ['replica']
+METRICS_DATABASE_REPLICAS = []
+# Replica selection: `round_robin` or `least_loaded` (the fewest queries in progress)
+METRICS_REPLICA_SELECTION = 'round_robin'
+# Seconds to read from `default` after a write of the same client to hide the replication lag
+METRICS_REPLICA_PIN_SECONDS = 5
+
 # Always use IPython for shell_plus
 SHELL_PLUS = "ipython"